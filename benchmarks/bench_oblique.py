@@ -0,0 +1,71 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Latency of oblique reslicing (ms per plane) for random orientations, with new and cached sampling grids'''
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'brain_mri_viewer'))
+import oblique
+from oblique import ObliqueSlicer, trilinear
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Oblique reslicing benchmark')
+    parser.add_argument('--size', type=int, default=512, help='edge of the synthetic cubic int16 volume')
+    parser.add_argument('--plane', type=int, default=256, help='pixels of each side of the resliced plane')
+    parser.add_argument('--orientations', type=int, default=20, help='number of random orientations')
+    parser.add_argument('--offsets', type=int, default=10, help='offsets resliced for each orientation')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    mri_data = rng.integers(0, 4096, size=(args.size,)*3, dtype=np.int16)
+    angles = np.column_stack([rng.uniform(-180, 180, args.orientations), rng.uniform(-90, 90, args.orientations)])
+    offsets = rng.uniform(-args.size/4, args.size/4, args.offsets)
+
+    backends = [('numpy', None)]
+    if oblique.map_coordinates is not None:
+        backends.append(('scipy', oblique.map_coordinates))
+    print('volume %d^3 int16, plane %d^2' % (args.size, args.plane))
+    print('%-8s %16s %16s' % ('backend', 'new grid (ms)', 'cached grid (ms)'))
+    for name, backend in backends:
+        oblique.map_coordinates = backend
+        slicer = ObliqueSlicer(mri_data, args.plane, max_grids=args.orientations)
+        new, cached = [], []
+        for azimuth, elevation in angles:
+            start = time.perf_counter()
+            slicer.reslice(azimuth, elevation, 0)
+            new.append(time.perf_counter() - start)
+            for offset in offsets:
+                start = time.perf_counter()
+                slicer.reslice(azimuth, elevation, offset)
+                cached.append(time.perf_counter() - start)
+        print('%-8s %16.2f %16.2f' % (name, 1000*np.median(new), 1000*np.median(cached)))
+
+    # the NumPy kernel is checked against scipy when both are available
+    if len(backends) > 1:
+        coords = rng.uniform(-2, args.size + 1, size=(3, 10000))
+        expected = backends[1][1](mri_data, coords, order=1, mode='constant', cval=0.0, prefilter=False)
+        np.testing.assert_allclose(trilinear(mri_data, coords), expected, rtol=1e-4, atol=1e-2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Benchmark suite of the stages of the viewer (extract_info, check_coord,
+windowing and headless Agg rendering) on synthetic NifTi files: 3D and 4D,
+int16, uint8 and float32, every axis orientation, .nii and .nii.gz. Wall
+time and peak memory of each stage are stored as JSON, and a previous
+result can be compared to find regressions (e.g. after a nibabel or numpy
+upgrade)
+'''
+
+import argparse
+import datetime
+import io
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import nibabel as nib
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'brain_mri_viewer'))
+from brain_mri_viewer import MRI
+from view_slices import windowing, plot_montage
+
+STAGES = ['extract_info', 'check_coord', 'windowing', 'render']
+DTYPES = ['int16', 'uint8', 'float32']
+COMMON_ORIENTATIONS = ['RAS', 'LAS', 'LPS', 'RPI', 'PSR', 'ASL']
+
+
+def all_orientations():
+    '''
+    Returns the 48 axis codes (permutations of the 3 axes with either direction)
+    '''
+    codes = []
+    for axes in itertools.permutations([('R', 'L'), ('A', 'P'), ('S', 'I')]):
+        for directions in itertools.product([0, 1], repeat=3):
+            codes.append(''.join(axis[d] for axis, d in zip(axes, directions)))
+    return codes
+
+
+def orientation_affine(codes, voxel_size=1.0):
+    '''
+    Builds an affine whose voxel axes point along the given axis codes (e.g. 'LPS')
+    '''
+    ornt = nib.orientations.axcodes2ornt(tuple(codes))
+    affine = np.eye(4)
+    affine[:3, :3] = 0
+    for axis, (world, direction) in enumerate(ornt):
+        affine[int(world), axis] = direction * voxel_size
+    return affine
+
+
+def synthetic_nifti(path, shape, dtype, codes, seed=0):
+    '''
+    Writes a random NifTi file with values of a typical scanner range
+    '''
+    rng = np.random.default_rng(seed)
+    mri_data = rng.normal(800, 400, size=shape)
+    if np.dtype(dtype).kind == 'u':
+        mri_data = np.clip(mri_data / 8, 0, 255)
+    nib.save(nib.Nifti1Image(mri_data.astype(dtype), orientation_affine(codes)), path)
+
+
+def measure(func, setup, repeat):
+    '''
+    Times func (best and median wall time of repeat runs), then runs it once
+    more under tracemalloc for its peak memory (timings are not traced, as
+    tracing slows allocations down)
+
+    Arguments:
+    func -- function of the stage, called with the result of setup
+    setup -- function preparing the input of each run (not timed)
+    repeat -- number of timed runs
+
+    Returns:
+    result -- dict with best_s, median_s and peak_mb
+    '''
+    times = []
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        func(state)
+        times.append(time.perf_counter() - start)
+    state = setup()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'best_s': min(times), 'median_s': float(np.median(times)), 'peak_mb': peak / 2**20}
+
+
+def bench_case(path, volume, lazy, repeat):
+    '''
+    Benchmarks every stage on one NifTi file
+
+    Returns:
+    stages -- dict of stage: measurements
+    '''
+    def loaded():
+        return MRI(nib.load(path))
+
+    def extracted():
+        mri = loaded()
+        mri.extract_info(volume, lazy)
+        return mri
+
+    extract = extracted()
+    mri_data = extract.mri_data
+    def reset():
+        # check_coord replaces mri_data with its RAS view
+        extract.mri_data = mri_data
+        return extract
+
+    extract.check_coord()
+    ras = extract.mri_data
+    window = extract.intensity_stats().window()
+
+    def render(mri):
+        fig = Figure(figsize=(9, 3))
+        plot_montage(fig, mri.mri_data, mri.mri_shape)
+        fig.savefig(io.BytesIO(), format='png', dpi=100)
+
+    return {
+        'extract_info': measure(lambda mri: mri.extract_info(volume, lazy), loaded, repeat),
+        'check_coord': measure(lambda mri: mri.check_coord(), reset, repeat),
+        'windowing': measure(lambda data: windowing(data, *window), lambda: ras, repeat),
+        'render': measure(render, lambda: extract, repeat),
+    }
+
+
+def compare(results, baseline, threshold):
+    '''
+    Prints the stages slower than the baseline by more than threshold (ratio of best times)
+
+    Returns:
+    regressions -- number of regressed stages
+    '''
+    previous = {result['case']: result['stages'] for result in baseline['results']}
+    regressions = 0
+    for result in results['results']:
+        if result['case'] not in previous:
+            continue
+        for stage, measurement in result['stages'].items():
+            before = previous[result['case']].get(stage)
+            if before is None:
+                continue
+            ratio = measurement['best_s'] / max(before['best_s'], 1e-9)
+            if ratio > threshold:
+                regressions += 1
+                print(' REGRESSION %-40s %-13s %8.2f ms -> %8.2f ms (%.2fx)' % (
+                    result['case'], stage, 1000 * before['best_s'], 1000 * measurement['best_s'], ratio))
+    print('%d regressions above %.2fx' % (regressions, threshold))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark suite of the extract_info, check_coord, windowing and render stages')
+    parser.add_argument('--size', type=int, default=128, help='edge of the synthetic volumes')
+    parser.add_argument('--volumes', type=int, default=4, help='number of volumes of the 4D images')
+    parser.add_argument('--dims', type=int, nargs='+', choices=[3, 4], default=[3, 4])
+    parser.add_argument('--dtypes', nargs='+', choices=DTYPES, default=DTYPES)
+    parser.add_argument('--orientations', nargs='+', default=COMMON_ORIENTATIONS, help='axis codes, or "all" for the 48 orientations')
+    parser.add_argument('--formats', nargs='+', choices=['nii', 'nii.gz'], default=['nii', 'nii.gz'])
+    parser.add_argument('--lazy', action='store_true', help='extracts the MRIs memory-mapped in their native dtype (--lazy flag of the viewer)')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of each stage')
+    parser.add_argument('-o', '--output', type=str, default=None, help='JSON file where the results are stored')
+    parser.add_argument('--compare', type=str, default=None, help='JSON results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    orientations = all_orientations() if args.orientations == ['all'] else args.orientations
+    results = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(), 'platform': platform.platform(),
+        'numpy': np.__version__, 'nibabel': nib.__version__, 'matplotlib': matplotlib.__version__,
+        'size': args.size, 'volumes': args.volumes, 'lazy': args.lazy, 'repeat': args.repeat,
+        'results': [],
+    }
+    print('%-40s' % 'case' + ''.join('%19s' % stage for stage in STAGES))
+    with tempfile.TemporaryDirectory() as root:
+        for dim, dtype, codes, format in itertools.product(args.dims, args.dtypes, orientations, args.formats):
+            shape = (args.size,) * 3 + ((args.volumes,) if dim == 4 else ())
+            name = '%dD-%s-%s.%s' % (dim, dtype, codes, format)
+            path = os.path.join(root, name)
+            # eager and lazy runs are different cases when compared
+            case = name + (' lazy' if args.lazy else '')
+            synthetic_nifti(path, shape, dtype, codes)
+            file_mb = os.path.getsize(path) / 2**20
+            stages = bench_case(path, args.volumes // 2 if dim == 4 else None, args.lazy, args.repeat)
+            os.remove(path)
+            results['results'].append({'case': case, 'dim': dim, 'dtype': dtype, 'orientation': codes, 'format': format,
+                                       'shape': list(shape), 'file_mb': file_mb, 'stages': stages})
+            print('%-40s' % case + ''.join('%9.1f ms %5.1fM' % (1000 * stages[stage]['best_s'], stages[stage]['peak_mb'])
+                                         for stage in STAGES), flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+        print('Results written to %s' % args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            return 1 if compare(results, json.load(f), args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Load test of the slice server: requests/s and latency percentiles of concurrent keep-alive clients'''
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import nibabel as nib
+
+VIEWER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'brain_mri_viewer', 'brain_mri_viewer.py')
+
+
+def synthetic_nifti(path, size, seed=0):
+    '''
+    Writes a random int16 NifTi file of shape (size, size, size)
+    '''
+    rng = np.random.default_rng(seed)
+    mri_data = rng.normal(800, 400, size=(size, size, size)).astype(np.int16)
+    nib.save(nib.Nifti1Image(mri_data, np.eye(4)), path)
+
+
+def free_port():
+    '''
+    Returns a TCP port that is free on localhost
+    '''
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def request(reader, writer, target, etag=None):
+    '''
+    Sends one GET request on a keep-alive connection and reads the response
+
+    Returns:
+    status -- HTTP status code
+    etag -- ETag of the response
+    '''
+    lines = ['GET %s HTTP/1.1' % target, 'Host: localhost']
+    if etag is not None:
+        lines.append('If-None-Match: %s' % etag)
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        headers[name.strip().lower()] = value.strip()
+    await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers.get('etag')
+
+
+async def client(port, targets, etags, latencies, conditional=False):
+    '''
+    One keep-alive connection sending its requests one after the other, storing
+    the ETags of the responses (or sending them back when conditional)
+    '''
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    for target in targets:
+        start = time.perf_counter()
+        status, etag = await request(reader, writer, target, etags.get(target) if conditional else None)
+        latencies.append(time.perf_counter() - start)
+        if status not in (200, 304):
+            raise RuntimeError('%s answered %d' % (target, status))
+        if etag is not None:
+            etags.setdefault(target, etag)
+    writer.close()
+
+
+async def load_test(port, targets, connections, etags, conditional=False):
+    '''
+    Splits the requests across concurrent connections
+
+    Returns:
+    elapsed -- wall time of all the requests
+    latencies -- list of the latency of each request
+    '''
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(port, targets[i::connections], etags, latencies, conditional) for i in range(connections)])
+    return time.perf_counter() - start, latencies
+
+
+def report(name, n, elapsed, latencies):
+    latencies = 1000 * np.asarray(latencies)
+    print('%-12s %6d %10.0f %8.2f %8.2f %8.2f' % (name, n, n / elapsed, *np.percentile(latencies, [50, 95, 99])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Slice server load test')
+    parser.add_argument('--size', type=int, default=256, help='edge of the synthetic cubic int16 volume')
+    parser.add_argument('--requests', type=int, default=2000, help='number of slice requests')
+    parser.add_argument('--connections', type=int, default=16, help='number of concurrent keep-alive connections')
+    parser.add_argument('--format', type=str, choices=['png', 'raw'], default='png', help='format of the slices')
+    parser.add_argument('--workers', type=int, default=None, help='rendering threads of the server')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        synthetic_nifti(os.path.join(root, 'synthetic.nii'), args.size)
+        port = free_port()
+        command = [sys.executable, VIEWER, 'serve', root, '--port', str(port)]
+        if args.workers:
+            command += ['--workers', str(args.workers)]
+        server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+        try:
+            server.stdout.readline()
+            rng = np.random.default_rng(0)
+            views = rng.choice(['sag', 'cor', 'axi'], args.requests)
+            indices = rng.integers(0, args.size, args.requests)
+            levels = rng.choice([600, 800, 1000], args.requests)
+            targets = ['/slice?file=synthetic.nii&axis=%s&index=%d&level=%d&width=1600&format=%s' % (view, index, level, args.format)
+                       for view, index, level in zip(views, indices, levels)]
+
+            print('volume %d^3 int16, %d connections, %s slices' % (args.size, args.connections, args.format))
+            print('%-12s %6s %10s %8s %8s %8s' % ('phase', 'n', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+            # the first request loads the volume into the cache of the server
+            elapsed, latencies = asyncio.run(load_test(port, targets[:1], 1, {}))
+            report('cold', 1, elapsed, latencies)
+            etags = {}
+            elapsed, latencies = asyncio.run(load_test(port, targets, args.connections, etags))
+            report('render', len(targets), elapsed, latencies)
+            elapsed, latencies = asyncio.run(load_test(port, targets, args.connections, etags, True))
+            report('conditional', len(targets), elapsed, latencies)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
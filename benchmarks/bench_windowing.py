@@ -0,0 +1,76 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Micro-benchmark of the windowing kernel (voxels/s) against the original implementation
+(its reference and correctness tests are in tests/test_windowing.py)'''
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'brain_mri_viewer'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+from view_slices import windowing
+# the original implementation is kept once, with the tests that check the kernel against it
+from test_windowing import windowing_reference
+
+
+def synthetic_volume(size, dtype, seed=0):
+    '''
+    Generates a random volume of shape (size, size, size) with values of a typical scanner range
+    '''
+    rng = np.random.default_rng(seed)
+    mri_data = rng.normal(800, 400, size=(size, size, size))
+    if np.dtype(dtype).kind == 'u':
+        mri_data = np.abs(mri_data)
+    return mri_data.astype(dtype)
+
+
+def time_it(func, repeat):
+    '''
+    Returns the best wall time of repeat calls of func
+    '''
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Windowing kernel micro-benchmark')
+    parser.add_argument('--size', type=int, default=128, help='edge of the synthetic cubic volume')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed repetitions')
+    parser.add_argument('--dtypes', nargs='+', default=['float64', 'float32', 'int16', 'uint16', 'uint8'])
+    args = parser.parse_args()
+
+    wl, ww = 800, 1600
+    print('%-8s %14s %14s %14s %8s' % ('dtype', 'reference', 'kernel', 'kernel out=', 'speedup'))
+    for dtype in args.dtypes:
+        mri_data = synthetic_volume(args.size, dtype)
+        out = np.empty(mri_data.shape, dtype=np.float64 if mri_data.dtype.kind != 'f' else mri_data.dtype)
+        t_ref = time_it(lambda: windowing_reference(mri_data, wl, ww), args.repeat)
+        t_new = time_it(lambda: windowing(mri_data, wl, ww), args.repeat)
+        t_out = time_it(lambda: windowing(mri_data, wl, ww, out=out), args.repeat)
+        print('%-8s %10.3g v/s %10.3g v/s %10.3g v/s %7.1fx' % (dtype, mri_data.size / t_ref, mri_data.size / t_new, mri_data.size / t_out, t_ref / t_out))
+
+
+if __name__ == "__main__":
+    main()
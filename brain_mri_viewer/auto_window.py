@@ -0,0 +1,327 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Automatic window presets computed from the intensity histogram of an MRI
+(percentile clipping, Otsu foreground and tissue peaks), stored in a
+sidecar JSON file so they are reused when the MRI is opened again
+'''
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+PRESETS_VERSION = 1
+PRESET_NAMES = ['percentile', 'foreground', 'tissue', 'full']
+
+def otsu_threshold(histogram, centers):
+    '''
+    Computes the Otsu threshold of a histogram (the split maximizing the
+    between-class variance), for all the splits at once
+
+    Arguments:
+    histogram -- counts of the bins
+    centers -- intensity of the bin centers
+
+    Returns:
+    threshold -- intensity separating the background from the foreground
+    '''
+    histogram = histogram.astype(np.float64)
+    w0 = np.cumsum(histogram)
+    w1 = w0[-1] - w0
+    s0 = np.cumsum(histogram * centers)
+    s1 = s0[-1] - s0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = w0 * w1 * (s0 / w0 - s1 / w1) ** 2
+    variance[~np.isfinite(variance)] = 0
+    return float(centers[int(np.argmax(variance))])
+
+
+def histogram_percentile(histogram, centers, width, q):
+    '''
+    Returns the q-th percentiles (0-100) of a histogram, interpolated inside the bins
+    '''
+    cumulative = np.cumsum(histogram)
+    target = np.asarray(q, dtype=np.float64) / 100 * cumulative[-1]
+    i = np.minimum(np.searchsorted(cumulative, target), len(histogram) - 1)
+    before = np.where(i > 0, cumulative[i - 1], 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.where(histogram[i] > 0, (target - before) / histogram[i], 0.0)
+    return centers[i] - width / 2 + fraction * width
+
+
+def tissue_peaks(histogram, centers, min_distance=0, smooth=9, min_height=0.1):
+    '''
+    Finds the modes of a (foreground) histogram: local maxima of the smoothed
+    histogram higher than min_height of the largest one, highest first, and
+    farther than min_distance from the higher ones (noise on the flank of a
+    tissue peak is not another tissue)
+
+    Arguments:
+    histogram -- counts of the bins
+    centers -- intensity of the bin centers
+    min_distance -- minimum distance in intensity between 2 peaks
+    smooth -- width in bins of the moving average
+    min_height -- minimum height of a peak relative to the mode
+
+    Returns:
+    peaks -- intensities of the peaks
+    smoothed -- smoothed histogram
+    '''
+    kernel = np.ones(smooth) / smooth
+    # 2 moving averages are a triangular kernel, without the ripples of a box
+    smoothed = np.convolve(np.convolve(histogram.astype(np.float64), kernel, mode='same'), kernel, mode='same')
+    inner = smoothed[1:-1]
+    maxima = np.flatnonzero((inner > smoothed[:-2]) & (inner >= smoothed[2:]) & (inner >= min_height * smoothed.max())) + 1
+    peaks = []
+    for peak in centers[maxima[np.argsort(smoothed[maxima])[::-1]]]:
+        if all(abs(peak - other) > min_distance for other in peaks):
+            peaks.append(peak)
+    return np.asarray(peaks), smoothed
+
+
+def compute_presets(stats, bins=512):
+    '''
+    Computes the window presets of an MRI from its intensity histogram (no
+    pass over the voxels)
+
+    percentile -- 1st to 99th percentile of all the voxels
+    foreground -- Otsu threshold to the 99.5th percentile of the voxels above it (ignores the background)
+    tissue -- centered on the main tissue peaks of the foreground (the 2 highest
+              modes at a quarter and three quarters of the window, or 3 times
+              the width at half maximum of a single mode)
+    full -- minimum to maximum intensity
+
+    Arguments:
+    stats -- IntensityStats of the MRI
+    bins -- number of bins the histogram is reduced to (less noisy modes)
+
+    Returns:
+    presets -- dict of name: (window level, window width)
+    '''
+    presets = {'percentile': stats.window(), 'full': ((stats.min + stats.max) / 2, max(stats.max - stats.min, 1))}
+    # the histogram is reduced to the bins covering [min, max]
+    first = int((stats.min - stats.low) // stats.width)
+    last = min(int((stats.max - stats.low) // stats.width) + 1, stats.bins)
+    histogram = stats.histogram[first:last]
+    factor = max(1, -(-len(histogram) // bins))
+    histogram = np.pad(histogram, (0, -len(histogram) % factor)).reshape(-1, factor).sum(axis=1)
+    width = stats.width * factor
+    centers = stats.low + first * stats.width + (np.arange(len(histogram)) + 0.5) * width
+    if len(histogram) < 3 or not histogram.sum():
+        presets['foreground'] = presets['tissue'] = presets['percentile']
+        return {name: tuple(float(v) for v in presets[name]) for name in PRESET_NAMES}
+
+    threshold = otsu_threshold(histogram, centers)
+    foreground = np.where(centers > threshold, histogram, 0)
+    if not foreground.sum():
+        foreground = histogram
+    high = float(histogram_percentile(foreground, centers, width, 99.5))
+    presets['foreground'] = ((threshold + high) / 2, max(high - threshold, width))
+
+    peaks, smoothed = tissue_peaks(foreground, centers, 0.1 * (high - threshold))
+    if len(peaks) >= 2:
+        low_peak, high_peak = sorted(peaks[:2])
+        presets['tissue'] = ((low_peak + high_peak) / 2, max(2 * (high_peak - low_peak), width))
+    elif len(peaks) == 1:
+        half = smoothed >= smoothed.max() / 2
+        fwhm = (np.flatnonzero(half)[-1] - np.flatnonzero(half)[0] + 1) * width
+        presets['tissue'] = (float(peaks[0]), max(3 * fwhm, width))
+    else:
+        presets['tissue'] = presets['foreground']
+    return {name: tuple(float(v) for v in presets[name]) for name in PRESET_NAMES}
+
+
+def sidecar_path(in_path):
+    '''
+    Returns the sidecar JSON file of the presets, next to the NifTi file
+    '''
+    return in_path + '.window.json'
+
+
+def cache_path(in_path, cache_dir=None):
+    '''
+    Returns the presets file in the cache directory, used when the sidecar cannot be written
+    '''
+    from chunk_store import DEFAULT_CACHE_DIR
+    name = hashlib.sha1(os.path.abspath(in_path).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir or DEFAULT_CACHE_DIR, 'windows', os.path.basename(in_path) + '.' + name + '.json')
+
+
+def read_presets(in_path, volume=None, cache_dir=None):
+    '''
+    Reads the presets of a NifTi file (and volume) saved for its current version
+
+    Returns:
+    presets -- dict of name: (window level, window width), or None if there are none
+    '''
+    from chunk_store import source_key
+    source = source_key(in_path)
+    for path in (sidecar_path(in_path), cache_path(in_path, cache_dir)):
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if saved.get('version') != PRESETS_VERSION or saved.get('source') != source:
+            continue
+        presets = saved.get('volumes', {}).get(str(volume))
+        if presets is not None:
+            return {name: tuple(window) for name, window in presets.items()}
+    return None
+
+
+def save_presets(in_path, presets, volume=None, cache_dir=None):
+    '''
+    Adds the presets of a volume to the sidecar JSON file (or to the cache
+    directory if the directory of the NifTi file is read-only)
+
+    Returns:
+    path -- file where the presets were written
+    '''
+    from chunk_store import source_key
+    source = source_key(in_path)
+    for path in (sidecar_path(in_path), cache_path(in_path, cache_dir)):
+        saved = {}
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if saved.get('version') != PRESETS_VERSION or saved.get('source') != source:
+            saved = {'version': PRESETS_VERSION, 'source': source, 'volumes': {}}
+        saved['volumes'][str(volume)] = {name: list(window) for name, window in presets.items()}
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            # written aside and renamed, so readers never see a partial file
+            tmp_path = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(saved, f, indent=1)
+            os.replace(tmp_path, path)
+            return path
+        except OSError:
+            continue
+    return None
+
+
+def load_presets(in_path, volume=None, stats=None, cache_dir=None):
+    '''
+    Returns the window presets of an MRI, reading them from the sidecar when
+    it matches the file, otherwise computing and saving them
+
+    Arguments:
+    in_path -- NifTi file path
+    volume -- selected volume of a 4D MRI
+    stats -- function returning the IntensityStats of the MRI, only called if the presets are computed
+    cache_dir -- cache directory used when the sidecar cannot be written
+
+    Returns:
+    presets -- dict of name: (window level, window width)
+    '''
+    presets = read_presets(in_path, volume, cache_dir)
+    if presets is None:
+        presets = compute_presets(stats())
+        save_presets(in_path, presets, volume, cache_dir)
+    return presets
+
+
+def presets_job(in_path, volume=0):
+    '''
+    Worker job: computes and saves the presets of one NifTi file (one streaming pass, memory-mapped)
+
+    Returns:
+    presets -- dict of name: (window level, window width)
+    elapsed -- time of the job
+    '''
+    import nibabel as nib
+    from brain_mri_viewer import MRI
+
+    start = time.perf_counter()
+    mri = MRI(nib.load(in_path))
+    volume = volume if len(mri.mri.shape) == 4 else None
+    mri.extract_info(volume, lazy=True)
+    presets = compute_presets(mri.intensity_stats())
+    save_presets(in_path, presets, volume)
+    return presets, time.perf_counter() - start
+
+
+def run_presets(inputs, workers=None, volume=0, force=False):
+    '''
+    Computes the presets of all the NifTi files with a process pool, skipping
+    the files whose saved presets are up to date
+
+    Arguments:
+    inputs -- list of files, directories or glob patterns
+    workers -- number of worker processes (default: number of CPUs)
+    volume -- volume of the 4D MRIs
+    force -- computes also the presets that are up to date
+
+    Returns:
+    failed -- number of files whose presets could not be computed
+    '''
+    import nibabel as nib
+    from batch import find_nifti
+
+    jobs = []
+    skipped = 0
+    for in_path, _ in find_nifti(inputs):
+        if not force:
+            try:
+                ndim = len(nib.load(in_path).shape)
+            except Exception:
+                ndim = None
+            if ndim is not None and read_presets(in_path, volume if ndim == 4 else None) is not None:
+                skipped += 1
+                continue
+        jobs.append(in_path)
+
+    print('%d files to analyze, %d up to date' % (len(jobs), skipped))
+    start = time.perf_counter()
+    done = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(presets_job, in_path, volume): in_path for in_path in jobs}
+        for future in as_completed(futures):
+            in_path = futures[future]
+            try:
+                presets, elapsed = future.result()
+            except Exception as error:
+                failed += 1
+                print(' FAILED %s: %s' % (in_path, error))
+                continue
+            done += 1
+            print(' %s (%.2f s): %s' % (in_path, elapsed, ', '.join('%s %g/%g' % (name, level, width) for name, (level, width) in presets.items())))
+
+    elapsed = time.perf_counter() - start
+    if done:
+        print('Analyzed %d files in %.2f s: %.2f files/s' % (done, elapsed, done / elapsed))
+    return failed
+
+
+def presets_main(argv=None):
+    parser = argparse.ArgumentParser(prog='brain_mri_viewer presets', description='Computes the automatic window presets of NifTi files and saves them next to the files')
+    parser.add_argument('inputs', nargs='+', help='NifTi files, directories or glob patterns')
+    parser.add_argument('-j', '--workers', type=int, default=None, dest='workers', help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('-vol', '--volume', type=int, default=0, dest='volume', help='volume to analyze if MRI contains more than 1')
+    parser.add_argument('-f', '--force', action='store_true', dest='force', help='computes also the presets that are up to date')
+    args = parser.parse_args(argv)
+
+    failed = run_presets(args.inputs, args.workers, args.volume, args.force)
+    return 1 if failed else 0
@@ -0,0 +1,220 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import glob
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+NIFTI_EXTENSIONS = ('.nii', '.nii.gz')
+
+def find_nifti(inputs):
+    '''
+    Expands the input paths (files, directories or glob patterns) to NifTi files
+
+    Arguments:
+    inputs -- list of files, directories or glob patterns
+
+    Returns:
+    files -- list of (NifTi file path, path relative to its input) tuples
+    '''
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                for name in sorted(names):
+                    if name.endswith(NIFTI_EXTENSIONS):
+                        file = os.path.join(root, name)
+                        files.append((file, os.path.relpath(file, path)))
+        else:
+            for file in sorted(glob.glob(path)) or [path]:
+                files.append((file, os.path.basename(file)))
+    return files
+
+
+def montage_path(rel_path, out_dir, keep_extension=False):
+    '''
+    Returns the PNG path of the montage of a NifTi file
+
+    Arguments:
+    rel_path -- path of the NifTi file relative to its input
+    out_dir -- output directory
+    keep_extension -- keeps the NifTi extension in the name (e.g. scan.nii.gz_montage.png)
+    '''
+    for ext in NIFTI_EXTENSIONS[::-1]:
+        if rel_path.endswith(ext) and not keep_extension:
+            rel_path = rel_path[:-len(ext)]
+            break
+    return os.path.join(out_dir, rel_path + '_montage.png')
+
+
+def montage_paths(files, out_dir):
+    '''
+    Assigns the PNG path of the montage of each NifTi file. Files whose
+    montages would overwrite each other (e.g. scan.nii and scan.nii.gz) keep
+    their extension in the name; files that still collide (the same relative
+    path under 2 inputs) get no path
+
+    Arguments:
+    files -- list of (NifTi file path, path relative to its input) tuples from find_nifti
+    out_dir -- output directory
+
+    Returns:
+    out_paths -- list with the PNG path of each file, or None for the colliding files
+    '''
+    out_paths = [montage_path(rel_path, out_dir) for _, rel_path in files]
+    counts = Counter(out_paths)
+    out_paths = [montage_path(rel_path, out_dir, keep_extension=True) if counts[out_path] > 1 else out_path
+                 for (_, rel_path), out_path in zip(files, out_paths)]
+    counts = Counter(out_paths)
+    return [out_path if counts[out_path] == 1 else None for out_path in out_paths]
+
+
+def is_up_to_date(in_path, out_path):
+    '''
+    Checks if the output exists and is newer than the input
+    '''
+    return os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(in_path)
+
+
+def render_montage(in_path, out_path, nslices=1, volume=0, dpi=100, raster=False, isotropic=False):
+    '''
+    Renders the montage of the mid slices of a NifTi file to PNG with the Agg backend,
+    or directly with the rasterizer (one pixel per voxel, no figure)
+
+    Arguments:
+    in_path -- NifTi file path
+    out_path -- PNG file path
+    nslices -- number of slices per view
+    volume -- volume to render if the MRI contains more than 1
+    dpi -- resolution of the PNG
+    raster -- uses the rasterizer instead of matplotlib
+    isotropic -- resamples the rasterized slices of anisotropic MRIs to square pixels
+
+    Returns:
+    n_voxels -- number of voxels of the rendered volume
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    import nibabel as nib
+    from brain_mri_viewer import MRI
+
+    mri = MRI(nib.load(in_path))
+    # the montage needs only the mid slices, not the intensity statistics
+    mri.extract_info(volume if len(mri.mri.shape) == 4 else None, lazy=True, stats=False)
+    mri.check_coord()
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+
+    if raster:
+        from rasterizer import montage_image, write_image
+        write_image(out_path, montage_image(mri.mri_data, mri.mri_shape, nslices, spacing=mri.mri_spacing if isotropic else None))
+        return int(mri.mri_data.size)
+
+    from matplotlib.figure import Figure
+    from view_slices import plot_montage
+    fig = Figure(figsize=(3 * max(nslices, 3), 3 * (3 if nslices > 1 else 1)), facecolor='black')
+    plot_montage(fig, mri.mri_data, mri.mri_shape, nslices, spacing=mri.mri_spacing)
+    for ax in fig.axes:
+        ax.title.set_color('white')
+    fig.savefig(out_path, dpi=dpi, facecolor='black')
+    return int(mri.mri_data.size)
+
+
+def render_job(in_path, out_path, nslices, volume, dpi, raster, isotropic=False):
+    '''
+    Worker job: renders one montage and returns its timing
+    '''
+    start = time.perf_counter()
+    n_voxels = render_montage(in_path, out_path, nslices, volume, dpi, raster, isotropic)
+    return n_voxels, time.perf_counter() - start
+
+
+def run_batch(inputs, out_dir, workers=None, nslices=1, volume=0, dpi=100, force=False, raster=False, isotropic=False):
+    '''
+    Renders the montages of all the NifTi files with a process pool, skipping
+    the outputs that are already up to date
+
+    Arguments:
+    inputs -- list of files, directories or glob patterns
+    out_dir -- directory where the PNG files are written
+    workers -- number of worker processes (default: number of CPUs)
+    nslices -- number of slices per view
+    volume -- volume to render if the MRI contains more than 1
+    dpi -- resolution of the PNG
+    force -- renders also the up to date outputs
+    raster -- uses the rasterizer instead of matplotlib
+    isotropic -- resamples the rasterized slices of anisotropic MRIs to square pixels
+
+    Returns:
+    failed -- number of files that could not be rendered
+    '''
+    jobs = []
+    skipped = failed = 0
+    files = find_nifti(inputs)
+    for (in_path, rel_path), out_path in zip(files, montage_paths(files, out_dir)):
+        if out_path is None:
+            # concurrent workers would write the same PNG
+            failed += 1
+            print(' FAILED %s: its montage %s collides with another input' % (in_path, montage_path(rel_path, out_dir, keep_extension=True)))
+        elif not force and is_up_to_date(in_path, out_path):
+            skipped += 1
+        else:
+            jobs.append((in_path, out_path))
+
+    print('%d files to render, %d up to date' % (len(jobs), skipped))
+    start = time.perf_counter()
+    total_voxels = 0
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(render_job, in_path, out_path, nslices, volume, dpi, raster, isotropic): (in_path, out_path)
+                   for in_path, out_path in jobs}
+        for future in as_completed(futures):
+            in_path, out_path = futures[future]
+            try:
+                n_voxels, elapsed = future.result()
+            except Exception as error:
+                failed += 1
+                print(' FAILED %s: %s' % (in_path, error))
+                continue
+            done += 1
+            total_voxels += n_voxels
+            print(' %s -> %s (%.2f s, %.3g voxels/s)' % (in_path, out_path, elapsed, n_voxels / elapsed))
+
+    elapsed = time.perf_counter() - start
+    if done:
+        print('Rendered %d files in %.2f s: %.2f files/s, %.3g voxels/s' % (done, elapsed, done / elapsed, total_voxels / elapsed))
+    return failed
+
+
+def batch_main(argv=None):
+    parser = argparse.ArgumentParser(prog='brain_mri_viewer batch', description='Renders headless mid-slice montages of NifTi files to PNG')
+    parser.add_argument('inputs', nargs='+', help='NifTi files, directories or glob patterns')
+    parser.add_argument('-o', '--output', type=str, default='montages', dest='out_dir', help='output directory')
+    parser.add_argument('-j', '--workers', type=int, default=None, dest='workers', help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('-n', '--nslices', type=int, default=1, dest='nslices', help='number of slices per view')
+    parser.add_argument('-vol', '--volume', type=int, default=0, dest='volume', help='volume to render if MRI contains more than 1')
+    parser.add_argument('--dpi', type=int, default=100, dest='dpi', help='resolution of the PNG files')
+    parser.add_argument('-r', '--raster', action='store_true', dest='raster', help='renders one pixel per voxel without matplotlib (much faster)')
+    parser.add_argument('--isotropic', action='store_true', dest='isotropic', help='resamples the rasterized slices of anisotropic MRIs to square pixels (matplotlib montages always use the voxel aspect)')
+    parser.add_argument('-f', '--force', action='store_true', dest='force', help='renders also the outputs that are up to date')
+    args = parser.parse_args(argv)
+
+    failed = run_batch(args.inputs, args.out_dir, args.workers, args.nslices, args.volume, args.dpi, args.force, args.raster, args.isotropic)
+    return 1 if failed else 0
@@ -0,0 +1,204 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+from collections import deque
+from matplotlib.transforms import Bbox
+from profiler import span, instant, complete
+
+class Region:
+    '''
+    Part of the figure redrawn by blitting: its bounding box, the background
+    cached without the animated artists, and the animated artists drawn on it
+    '''
+    def __init__(self, ax, artists, pad_artists=()):
+        self.ax = ax
+        self.artists = list(artists)
+        self.pad_artists = list(pad_artists)
+        self.bbox = None
+        self.background = None
+
+    def update_bbox(self, renderer):
+        # text drawn outside the axes (e.g. the slider value) is included with room to grow
+        boxes = [self.ax.bbox] + [artist.get_window_extent(renderer).expanded(2.0, 1.2) for artist in self.pad_artists]
+        self.bbox = Bbox.union(boxes)
+
+
+class BlitManager:
+    '''
+    Redraws only the changed images and sliders of a figure by blitting over
+    cached backgrounds. Slider events are coalesced: callbacks are queued and
+    run once per timer tick with the latest slider values. Idle callbacks
+    (e.g. refining a preview) run once no update was requested for idle_interval
+
+    Arguments:
+    fig -- matplotlib figure
+    show_fps -- shows a frames per second and latency overlay
+    interval -- coalescing interval in ms
+    idle_interval -- delay in ms after the last update before the idle callbacks run
+    '''
+    def __init__(self, fig, show_fps=False, interval=10, idle_interval=300):
+        self.fig = fig
+        self.canvas = fig.canvas
+        self.regions = []
+        self.artist_region = {}
+        self.pending = {}
+        self.dirty = set()
+        self.first_request = None
+        self.timer = self.canvas.new_timer(interval=interval)
+        self.timer.single_shot = True
+        self.timer.add_callback(self.flush)
+        self.timer_started = False
+        self.idle_pending = {}
+        self.idle_timer = self.canvas.new_timer(interval=idle_interval)
+        self.idle_timer.single_shot = True
+        self.idle_timer.add_callback(self.on_idle)
+        self.frame_times = deque(maxlen=30)
+        self.latencies = deque(maxlen=30)
+        self.fps_text = None
+        if show_fps:
+            fps_ax = fig.add_axes([0.35, 0.94, 0.3, 0.06])
+            fps_ax.axis('off')
+            self.fps_text = fps_ax.text(0.5, 0.5, '', color='yellow', ha='center', va='center', fontsize=9, transform=fps_ax.transAxes)
+            self.add_region(fps_ax, [self.fps_text])
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def add_region(self, ax, artists, pad_artists=()):
+        '''
+        Registers animated artists drawn on top of an axes
+        '''
+        region = Region(ax, artists, pad_artists)
+        for artist in artists:
+            artist.set_animated(True)
+            self.artist_region[artist] = region
+        self.regions.append(region)
+        return region
+
+    def add_image(self, image):
+        '''
+        Registers an image redrawn by blitting
+        '''
+        return self.add_region(image.axes, [image])
+
+    def add_slider(self, slider):
+        '''
+        Registers a slider redrawn by blitting instead of a full canvas redraw
+        '''
+        slider.drawon = False
+        artists = [slider.poly, slider.valtext]
+        if hasattr(slider, '_handle'):
+            artists.append(slider._handle)
+        return self.add_region(slider.ax, artists, [slider.valtext])
+
+    def on_changed(self, slider, func):
+        '''
+        Connects a slider to an update function returning the changed artists;
+        rapid slider events are coalesced so func only renders the latest value
+        '''
+        def request(val):
+            self.dirty.add(self.artist_region[slider.valtext])
+            self.request(func)
+
+        return slider.on_changed(request)
+
+    def request(self, func):
+        '''
+        Queues an update function until the next timer tick
+        '''
+        self.pending[func] = None
+        if self.first_request is None:
+            self.first_request = time.perf_counter()
+        if not self.timer_started:
+            self.timer_started = True
+            self.timer.start()
+
+    def request_idle(self, func):
+        '''
+        Queues an update function until the updates stop for idle_interval
+        '''
+        self.idle_pending[func] = None
+        # restarting the timer postpones it while updates keep coming
+        self.idle_timer.stop()
+        self.idle_timer.start()
+
+    def on_idle(self):
+        pending, self.idle_pending = list(self.idle_pending), {}
+        for func in pending:
+            self.request(func)
+
+    def flush(self):
+        '''
+        Runs the queued update functions and blits the changed regions
+        '''
+        self.timer_started = False
+        pending, self.pending = list(self.pending), {}
+        for func in pending:
+            with span(getattr(func, '__name__', 'update')):
+                artists = func()
+            for artist in artists or []:
+                self.dirty.add(self.artist_region[artist])
+        dirty, self.dirty = self.dirty, set()
+
+        if self.first_request is not None:
+            now = time.perf_counter()
+            self.latencies.append(now - self.first_request)
+            self.frame_times.append(now)
+            # latency from the first queued slider event until its update ran
+            complete('slider latency', self.first_request, now - self.first_request)
+            self.first_request = None
+            if self.fps_text is not None:
+                self.fps_text.set_text(self.fps_label())
+                dirty.add(self.artist_region[self.fps_text])
+
+        if any(region.background is None for region in dirty) or not self.canvas.supports_blit:
+            self.canvas.draw_idle()
+            return
+        for region in dirty:
+            self.canvas.restore_region(region.background)
+        # restoring a background erases the artists of the regions overlapping it
+        for region in self.regions:
+            if any(region is other or region.bbox.overlaps(other.bbox) for other in dirty):
+                for artist in region.artists:
+                    self.fig.draw_artist(artist)
+        for region in dirty:
+            self.canvas.blit(region.bbox)
+        self.canvas.flush_events()
+
+    def fps_label(self):
+        '''
+        Returns the frames per second and mean latency of the last updates
+        '''
+        fps = 0.0
+        if len(self.frame_times) > 1:
+            fps = (len(self.frame_times) - 1) / max(self.frame_times[-1] - self.frame_times[0], 1e-9)
+        latency = 1000 * sum(self.latencies) / max(len(self.latencies), 1)
+        return '%.1f fps | %.1f ms' % (fps, latency)
+
+    def on_draw(self, event):
+        '''
+        Caches the backgrounds after a full redraw (e.g. on resize) and draws the animated artists on them
+        '''
+        if event.canvas is not self.canvas:
+            return
+        instant('draw')
+        renderer = event.renderer
+        for region in self.regions:
+            region.update_bbox(renderer)
+            region.background = self.canvas.copy_from_bbox(region.bbox)
+        for region in self.regions:
+            for artist in region.artists:
+                self.fig.draw_artist(artist)
@@ -15,88 +15,142 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from re import M
 import numpy as np
 import argparse
 import os
 import sys
-import matplotlib.pyplot as plt
 import nibabel as nib
-from matplotlib.widgets import Slider, Button
-from view_slices import *
+# matplotlib is imported by the viewers only when a figure is opened
+from view_slices import VIEWS, slice_cache, plot_montage, view_slices, multi_view, view_slices_window, multi_view_window
+from reorient import ras_affine, reorient_to_ras, ras_shape, voxel_spacing
+from intensity_stats import volume_stats
+from profiler import span, profiled
 
 class MRI:
     def __init__(self, mri):
         self.mri = mri
+        self.stats = None
+        self.series = False
 
-    def extract_info(self):
+    @profiled('MRI.extract_info')
+    def extract_info(self, volume=None, lazy=False, series=False, stats=True):
         ''' 
         Extract general information from MRI 
 
         Arguments: 
         mri -- MRI NifTi file
+        volume -- volume to extract if the MRI contains more than 1
+        lazy -- keeps the MRI memory-mapped and in its native dtype instead of loading it as float64
+        series -- keeps all the volumes of a 4D MRI as an array proxy, read slice by slice while they are played
+        stats -- computes the intensity statistics now (otherwise on the first call of intensity_stats)
 
         Returns:
         mri_header --contains general information from the MRI
         mri_affine -- affine matrix
         mri_coord -- MRI coordinate system
         mri_data --  MRI array
+        min_voxel -- minimum intensity of the MRI array
+        max_voxel -- maximum intensity of the MRI array
+        stats -- IntensityStats of the MRI array (computed in the same single pass)
         '''
         self.mri_header = self.mri.header
         self.mri_affine = self.mri.affine
         self.mri_coord = nib.aff2axcodes(self.mri_affine)
         x, y, z = self.mri_coord
-        self.mri_data = self.mri.get_fdata()
-        self.max_voxel = np.max(self.mri_data)
+        chunked = lazy and getattr(self.mri, 'chunked', False)
+        self.series = series
+        if chunked:
+            # chunked stores are read chunk by chunk when slices are displayed, and
+            # their intensity range was computed at conversion
+            self.mri_data = self.mri.dataobj if volume is None else self.mri.dataobj.volume(volume)
+            self.min_voxel, self.max_voxel = self.mri.intensity_range(volume)
+        elif series:
+            # the 4D MRI is never loaded, its volumes are read slice by slice while they are played
+            self.mri_data = self.mri.dataobj
+        elif lazy:
+            # slicing the proxy reads only the selected volume, and uncompressed
+            # files stay memory-mapped (scaled MRIs are returned as float)
+            with span('read dataobj'):
+                if volume is None:
+                    self.mri_data = np.asanyarray(self.mri.dataobj)
+                else:
+                    self.mri_data = np.asanyarray(self.mri.dataobj[..., volume])
+        else:
+            # decompression and the float64 cast of the whole MRI
+            with span('get_fdata'):
+                self.mri_data = self.mri.get_fdata()
+            if volume is not None:
+                self.mri_data = self.mri_data[..., volume]
+        if stats and not chunked:
+            # min and max come with the rest of the statistics in a single pass
+            self.intensity_stats()
+
+
+    @profiled('MRI.intensity_stats')
+    def intensity_stats(self):
+        ''' 
+        Computes the intensity statistics of the MRI (min, max, mean, std,
+        histogram and percentiles) once, streaming over the MRI array
+
+        Returns:
+        stats -- IntensityStats of the MRI array
+        '''
+        if self.stats is None:
+            # 4D series are summarized over all their volumes, streamed one volume at a time
+            self.stats = volume_stats(self.mri_data)
+            # python scalars, so 2*max_voxel cannot overflow a native integer dtype
+            self.min_voxel, self.max_voxel = self.stats.min, self.stats.max
+        return self.stats
 
 
+    @profiled('MRI.check_coord')
     def check_coord(self):
         ''' 
         Check the MRI's coordinate system and transforms it to RAS in case it is other
 
         Arguments: 
-        mri_coord -- MRI coordinate system
+        mri_affine -- affine matrix
         mri_data --  MRI array
 
         Returns:
         mri_data --  MRI array transformed to RAS coordinate system
         mri_shape -- shape of the MRI array in RAS coordinate system
+        mri_ras_affine -- affine matrix of the MRI array in RAS coordinate system
+        mri_spacing -- voxel spacing (x, y, z) in mm of the MRI array in RAS coordinate system
 
-        Note: types of coordinate systems that check: RAS, LAS, LSA, ALS, RSP, LPS, LIP, LIA
+        Note: any of the 48 axis orientations is handled from the affine, as a
+        strided view of the data (no copy); array proxies are reoriented lazily
         '''
-        if self.mri_coord == ('L', 'I', 'P'):
-            self.mri_data = np.flip(self.mri_data, axis=0)
-            self.mri_data = np.flip(self.mri_data, axis=1)
-            self.mri_data = np.flip(self.mri_data, axis=2)
-            self.mri_data = np.swapaxes(self.mri_data, 1, 2)
-
-        if self.mri_coord == ('L', 'A', 'S'):
-            self.mri_data = np.flip(self.mri_data, axis=0)
-
-        if self.mri_coord == ('L', 'S', 'A'):
-            self.mri_data = np.flip(self.mri_data, axis=0) 
-            self.mri_data = np.swapaxes(self.mri_data, 1, 2) 
-
-        if self.mri_coord == ('A', 'L', 'S'):
-            self.mri_data = np.flip(self.mri_data, axis=1) 
-            self.mri_data = np.swapaxes(mri_data, 0, 1)
-
-        if self.mri_coord == ('R', 'S', 'P'):
-            mri_data = np.flip(self.mri_data, axis=2) 
-            mri_data = np.swapaxes(self.mri_data, 1, 2)
+        self.mri_ras_affine = ras_affine(self.mri_affine, self.mri_data.shape)
+        self.mri_data = reorient_to_ras(self.mri_data, self.mri_affine)
+        self.mri_shape = np.asarray(self.mri_data.shape)
+        self.mri_spacing = voxel_spacing(self.mri_ras_affine)
 
-        if self.mri_coord == ('L', 'P', 'S'):
-            self.mri_data = np.flip(self.mri_data, axis=0)
-            self.mri_data = np.flip(self.mri_data, axis=1)
 
-        if self.mri_coord == ('L', 'I', 'A'):
-            self.mri_data = np.flip(self.mri_data, axis=0)
-            self.mri_data = np.flip(self.mri_data, axis=1)
-            self.mri_data = np.swapaxes(self.mri_data, 1, 2)
+    @profiled('MRI.display_header')
+    def display_header(self):
+        ''' 
+        Display the information of the MRI header (header, affine, coordinate
+        system and voxel size), which needs no voxel data
 
-        self.mri_shape = np.asarray(self.mri_data.shape)
+        Arguments: 
+        mri -- MRI NifTi file
+        '''
+        print("""
+        ============================
+        ===== Brain MRI Viewer =====
+        ============================""")
+        print("\n")
+        print('MRI header\n', self.mri.header) 
+        print("\n")
+        print('MRI affine\n', self.mri.affine)
+        print("\n")
+        print('MRI coordinate system\n', nib.aff2axcodes(self.mri.affine))
+        print("\n")
+        print('MRI voxel size: ', tuple(float(z) for z in self.mri.header.get_zooms()))
 
 
+    @profiled('MRI.display_info')
     def display_info(self):
         ''' 
         Display general information from the MRI
@@ -106,95 +160,205 @@ class MRI:
         mri_affine -- affine matrix
         mri_coord -- MRI coordinate system
         mri_data --  MRI array
+        min_voxel -- minimum intensity of the MRI array
+        max_voxel -- maximum intensity of the MRI array
         '''
         # Display MRI general info
-        print("""
-        ============================
-        ===== Brain MRI Viewer =====
-        ============================""")
-        print("\n")
-        print('MRI header\n', self.mri_header) 
-        print("\n")
-        print('MRI affine\n', self.mri_affine)
-        print("\n")
-        print('MRI coordinate system\n', self.mri_coord)
-        print("\n")
+        self.display_header()
         # print('MRI data\n', mri_data)
         # print("\n")
         print('MRI data type: ', type(self.mri_data))
         print('MRI dtype: ', self.mri_data.dtype)
-        print('min voxel intensity: ', np.min(self.mri_data))
-        print('max voxel intensity: ', np.max(self.mri_data))
+        print('min voxel intensity: ', self.min_voxel)
+        print('max voxel intensity: ', self.max_voxel)
         print('MRI shape: ', self.mri_data.shape)
         print('MRI dim: ', self.mri_data.ndim)
 
 
-    def visualize_img(mri_data, mri_shape):
+    @profiled('MRI.visualize_img')
+    def visualize_img(self, nslices=1, overlay=None):
         '''
         Outputs an image of the mid slices of the MRI in each view (sagittal, coronal and axial)
 
         Arguments:
         mri_data --  MRI array
         mri_shape -- shape of the MRI array
+        nslices -- number of slices per view
+        overlay -- Overlay of a label map drawn on top of the slices
         '''
-
-        sag_mid = mri_data[mri_shape[0]//2, :, :]
-        cor_mid = mri_data[:, mri_shape[1]//2, :]
-        axi_mid = mri_data[:, :, mri_shape[2]//2]
-
-        slices = [sag_mid, cor_mid, axi_mid]
+        import matplotlib.pyplot as plt
         plt.style.use('dark_background')
-        fig, axes = plt.subplots(1,len(slices))
-        for i, slice in enumerate(slices):
-            axes[i].imshow(slice.T, cmap='gray', origin='lower')
-            axes[i].axis('off')
-
-        axes[0].set_title('Sagittal view')
-        axes[1].set_title('Coronal view')
-        axes[2].set_title('Axial view')
+        fig = plt.figure()
+        plot_montage(fig, self.mri_data, self.mri_shape, nslices, overlay, self.mri_spacing)
         plt.show()
 
 
 def main():
-    parser = argparse.ArgumentParser(description=' ========== Brain MRI Viewer by Enrique Mondragon Estrada 2022 ==========', usage='%(prog)s [--input] [options]')
-    parser.add_argument('-in', '--input', type=str, required=True, help='MRIs file path', dest='in_path')
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        from batch import batch_main
+        sys.exit(batch_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'convert':
+        from chunk_store import convert_main
+        sys.exit(convert_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'tmap':
+        from temporal import tmap_main
+        sys.exit(tmap_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        from serve import serve_main
+        sys.exit(serve_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'index':
+        from catalog import index_main
+        sys.exit(index_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'query':
+        from catalog import query_main
+        sys.exit(query_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'presets':
+        from auto_window import presets_main
+        sys.exit(presets_main(sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(description=' ========== Brain MRI Viewer by Enrique Mondragon Estrada 2022 ==========', usage='%(prog)s [--input] [options]\n       %(prog)s batch [inputs] [options]\n       %(prog)s convert [inputs] [options]\n       %(prog)s tmap [input] [options]\n       %(prog)s serve [directory] [options]\n       %(prog)s index [inputs] [options]\n       %(prog)s query [filters]\n       %(prog)s presets [inputs] [options]')
+    parser.add_argument('-in', '--input', type=str, nargs='+', required=True, help='MRIs file path (several files are compared side by side with linked sliders)', dest='in_paths')
     parser.add_argument('-v', '--view', type=str, choices=['multiview', 'sag', 'cor', 'axi'], default='multiview', dest='view', help='select view [sag, cor, axi, multiview]')
     parser.add_argument('-img', '--image', action='store_true', dest='img', help='shows MRIs image')
     parser.add_argument('-w', '--window', action='store_true', dest='window', help='enables the option for MRI windowing')
     parser.add_argument('-vol', '--volume', type=int, action='store', dest='volume', help='volume to display if MRI contains more than 1' )
+    parser.add_argument('--cache-mb', type=int, default=256, dest='cache_mb', help='memory budget in MB of the cache of displayed slices')
+    parser.add_argument('--prefetch', type=int, default=4, dest='prefetch', help='number of slices prefetched in the scrolling direction (0 disables it)')
+    parser.add_argument('--fps', action='store_true', dest='fps', help='shows the frames per second and latency of the slider updates')
+    parser.add_argument('-s', '--store', action='store_true', dest='store', help='opens the MRI from its chunked store (converted on first use), reading only the displayed chunks')
+    parser.add_argument('--cache-dir', type=str, default=None, dest='cache_dir', help='directory of the chunked stores')
+    parser.add_argument('-l', '--lazy', action='store_true', dest='lazy', help='memory-maps the MRI and reads only the selected volume in its native dtype')
+    parser.add_argument('--pyramid', type=str, choices=['auto', 'on', 'off'], default='auto', dest='pyramid', help='displays downsampled levels while scrubbing (auto: MRIs with a dimension above 512)')
+    parser.add_argument('-p', '--projection', type=str, choices=['mip', 'minip', 'aip'], default=None, dest='projection', help='displays maximum, minimum or mean intensity projections with a slab thickness slider')
+    parser.add_argument('--oblique', action='store_true', dest='oblique', help='displays an oblique plane that can be rotated and moved along its normal')
+    parser.add_argument('--overlay', type=str, default=None, dest='overlay', help='label map (e.g. FreeSurfer aseg) drawn on top of the slices')
+    parser.add_argument('--opacity', type=float, default=0.4, dest='opacity', help='initial opacity of the overlay labels')
+    parser.add_argument('--lut', type=str, default=None, dest='lut', help='color lookup table of the overlay (default: $FREESURFER_HOME/FreeSurferColorLUT.txt or generated colors)')
+    parser.add_argument('-i', '--info', action='store_true', dest='info', help='prints the header, affine and orientation of the MRI without reading its voxels or opening any window')
+    parser.add_argument('--stats', action='store_true', dest='stats', help='prints the intensity statistics of the MRI without opening any window')
+    parser.add_argument('--frame-rate', type=float, default=10, dest='frame_rate', help='frames per second when playing the volumes of a 4D MRI')
+    parser.add_argument('--buffer', type=int, default=32, dest='buffer', help='number of volumes of a 4D MRI preloaded while playing')
+    parser.add_argument('--save-pyramid', action='store_true', dest='save_pyramid', help='persists the pyramid next to the MRI file so it is not rebuilt')
+    parser.add_argument('--profile', type=str, nargs='?', const='', default=None, dest='profile', metavar='TRACE', help='prints the time and memory of each stage and slider update when exiting, and writes them as a Chrome trace JSON file if a path is given')
     
     args = parser.parse_args()
 
-    mri = nib.load(args.in_path)
+    if args.profile is not None:
+        import atexit
+        import profiler
+        atexit.register(profiler.enable(args.profile or None).report)
+
+    args.in_path = args.in_paths[0]
+    if len(args.in_paths) > 1:
+        if args.overlay:
+            parser.error('--overlay takes the label map of a single MRI, it cannot be used with several --input files')
+        from compare import compare_main
+        views = VIEWS if args.view == 'multiview' else [args.view]
+        compare_main(args.in_paths, views, args.volume, args.lazy, args.window, args.fps, args.cache_mb, args.prefetch)
+        return
+
+    if args.info:
+        # nib.load parses only the header, the voxels stay on disk
+        mri = MRI(nib.load(args.in_path))
+        mri.display_header()
+        print('MRI dtype: ', mri.mri.header.get_data_dtype())
+        print('MRI shape: ', mri.mri.shape)
+        print('MRI shape in RAS: ', ras_shape(mri.mri.affine, mri.mri.shape))
+        print('MRI dim: ', len(mri.mri.shape))
+        return
+
+    if args.store:
+        from chunk_store import open_store
+        with span('open_store'):
+            mri = open_store(args.in_path, args.cache_dir)
+        args.lazy = True
+    else:
+        # an open file is read incrementally while the volumes of compressed 4D MRIs are played
+        with span('nib.load'):
+            mri = nib.load(args.in_path, keep_file_open=True)
     view = args.view 
 
     mri = MRI(mri)
-    mri.extract_info()
-    mri.check_coord()
-    mri.display_info()
-
+    mri_dim = mri.mri.header['dim'][0]
+    n_volumes = mri.mri.shape[-1]
 
-    if mri.mri_header['dim'][0]==3:
-        mri.mri_data=mri.mri_data
-    elif mri.mri_header['dim'][0]==4 and args.volume==None:
+    # 4D MRIs without a selected volume are played
+    series = mri_dim==4 and args.volume==None and not args.img
+    if mri_dim==4 and args.volume==None and args.img:
         print("\n Missing information!")
-        print(" This MRI contatins :", mri.mri_shape[-1], "volumes")
-        print(" You should select one volume within the range [0, ", mri.mri_shape[-1]-1, "] \n")
+        print(" This MRI contatins :", n_volumes, "volumes")
+        print(" You should select one volume within the range [0, ", n_volumes-1, "] \n")
         parser.print_help()
         sys.exit()
-    elif mri.mri_header['dim'][0]==4 and (args.volume>=mri.mri_shape[-1] or args.volume<=-1):
+    elif mri_dim==4 and not series and (args.volume>=n_volumes or args.volume<=-1):
         print("\n Invalid volume!")
-        print(" This MRI contatins :", mri.mri_shape[-1], "volumes")
-        print(" You should select one volume within the range [0, ", mri.mri_shape[-1]-1, "] \n")
+        print(" This MRI contatins :", n_volumes, "volumes")
+        print(" You should select one volume within the range [0, ", n_volumes-1, "] \n")
         parser.print_help()
         sys.exit()
-    else:
-         mri.mri_data=mri.mri_data[:,:,:,args.volume]
+
+    mri.extract_info(args.volume if mri_dim==4 else None, args.lazy, series)
+    mri.check_coord()
+    mri.display_info()
+
+    if args.stats:
+        print("\n")
+        print(mri.intensity_stats().report())
+        return
+
+    # every viewer mode draws the overlay, so it is built before the viewers
+    overlay = None
+    if args.overlay:
+        # the label map goes through the same RAS reorientation as the MRI
+        from overlay import Overlay
+        with span('overlay'):
+            labels = MRI(nib.load(args.overlay))
+            labels.extract_info(0 if len(labels.mri.shape) == 4 else None, lazy=True)
+            labels.check_coord()
+            if labels.mri_data.shape[:3] != mri.mri_data.shape[:3]:
+                print("\n Invalid overlay!")
+                print(" The overlay shape", labels.mri_data.shape[:3], "does not match the MRI shape", mri.mri_data.shape[:3], "\n")
+                sys.exit()
+            overlay = Overlay(labels.mri_data, args.lut, args.opacity)
+
+    if series:
+        from playback import play_series
+        # the gray scale and the window cover all the volumes, so brighter volumes are not clipped
+        window = mri.intensity_stats().window() if args.window else None
+        views = VIEWS if args.view == 'multiview' else [args.view]
+        with span('viewer'):
+            play_series(mri.mri_shape, mri.mri_data, views, (mri.min_voxel, mri.max_voxel), window, args.buffer, args.frame_rate, args.fps, mri.mri_spacing, overlay)
+        return
+
+    if args.projection and not args.img:
+        from projection import view_projection
+        window = mri.intensity_stats().window() if args.window else None
+        views = VIEWS if args.view == 'multiview' else [args.view]
+        with span('viewer'):
+            view_projection(mri.mri_shape, mri.mri_data, views, args.projection, (mri.min_voxel, mri.max_voxel), window, args.fps, mri.mri_spacing, overlay)
+        return
+
+    if args.oblique and not args.img:
+        from oblique import view_oblique
+        window = mri.intensity_stats().window() if args.window else None
+        # oblique planes cross every chunk, so chunked MRIs are read whole
+        with span('viewer'):
+            view_oblique(mri.mri_shape, np.asarray(mri.mri_data), 256, (mri.min_voxel, mri.max_voxel), window, args.fps, overlay)
+        return
+
+    pyramid = None
+    if args.pyramid == 'on' or (args.pyramid == 'auto' and max(mri.mri_shape) > 512):
+        from pyramid import Pyramid
+        pyramid_path = None
+        if args.save_pyramid:
+            pyramid_path = args.in_path + ('.vol%d' % args.volume if mri_dim==4 else '') + '.pyramid.npz'
+        with span('pyramid'):
+            pyramid = Pyramid(mri.mri_data, path=pyramid_path, source=args.in_path)
 
     if args.window and args.img == False:
         print("\n")
-        print('MRI slope: ', mri.dataobj.slope) 
-        print('MRI interception: ', mri.dataobj.inter)
+        print('MRI slope: ', mri.mri.dataobj.slope) 
+        print('MRI interception: ', mri.mri.dataobj.inter)
 
         def rescale(a ,x, b):
             return a * x + b
@@ -213,24 +377,36 @@ def main():
 
             note: currently not using it
             '''
-            intercept = mri.dataobj.inter
-            slope = mri.dataobj.slope
+            intercept = mri.mri.dataobj.inter
+            slope = mri.mri.dataobj.slope
             mri_hu = rescale(mri_data, slope, intercept)
             return mri_hu
     
 
-        mri_hu = hounsfield(mri, mri.mri_data)
-        if args.view != 'multiview':
-            view_slices_window(mri.mri_shape, mri.mri_data, view, mri.max_voxel)
-        else:
-            multi_view_window(mri.mri_shape, mri.mri_data, mri.max_voxel)
+        # window presets from the histogram, saved next to the MRI so they are not computed again;
+        # the default window spans from the 1st to the 99th percentile
+        from auto_window import load_presets
+        with span('window presets'):
+            presets = load_presets(args.in_path, args.volume if mri_dim==4 else None, mri.intensity_stats)
+        window = presets['percentile']
+        cache = slice_cache(mri.mri_data, args.cache_mb, args.prefetch, pyramid)
+        with span('viewer'):
+            if args.view != 'multiview':
+                view_slices_window(mri.mri_shape, mri.mri_data, view, mri.max_voxel, cache, args.fps, pyramid, mri.min_voxel, window, overlay, mri.mri_spacing, presets)
+            else:
+                multi_view_window(mri.mri_shape, mri.mri_data, mri.max_voxel, cache, args.fps, pyramid, mri.min_voxel, window, overlay, mri.mri_spacing, presets)
+        print(cache.report())
     else:
         if args.img:
-            mri.visualize_img()
-        elif args.view != 'multiview':
-            view_slices(mri.mri_shape, mri.mri_data, view)
-        else:
-            multi_view(mri.mri_shape, mri.mri_data)
+            mri.visualize_img(overlay=overlay)
+            return
+        cache = slice_cache(mri.mri_data, args.cache_mb, args.prefetch, pyramid)
+        with span('viewer'):
+            if args.view != 'multiview':
+                view_slices(mri.mri_shape, mri.mri_data, view, cache, args.fps, pyramid, overlay, mri.mri_spacing)
+            else:
+                multi_view(mri.mri_shape, mri.mri_data, cache, args.fps, pyramid, overlay, mri.mri_spacing)
+        print(cache.report())
   
     
 if __name__ == "__main__":
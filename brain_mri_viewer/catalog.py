@@ -0,0 +1,275 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Catalog of the headers of NifTi datasets in a SQLite index (index and query commands)'''
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DEFAULT_DB = os.path.join(os.path.expanduser('~'), '.cache', 'brain_mri_viewer', 'index.sqlite')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scans (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    dim INTEGER,
+    nx INTEGER, ny INTEGER, nz INTEGER,
+    volumes INTEGER,
+    dtype TEXT,
+    orientation TEXT,
+    vx REAL, vy REAL, vz REAL,
+    affine TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS scans_shape ON scans (nx, ny, nz);
+CREATE INDEX IF NOT EXISTS scans_orientation ON scans (orientation);
+'''
+
+COLUMNS = ['path', 'mtime', 'size', 'dim', 'nx', 'ny', 'nz', 'volumes', 'dtype', 'orientation', 'vx', 'vy', 'vz', 'affine', 'error']
+
+def connect(db_path=None):
+    '''
+    Opens the index database, creating it if needed
+
+    Arguments:
+    db_path -- SQLite file of the index (default: ~/.cache/brain_mri_viewer/index.sqlite)
+
+    Returns:
+    conn -- sqlite3 connection
+    '''
+    db_path = db_path or DEFAULT_DB
+    if os.path.dirname(db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def read_header(path, stat):
+    '''
+    Reads the fields of a NifTi header printed by the viewer, without reading any voxel
+
+    Arguments:
+    path -- NifTi file path
+    stat -- os.stat_result of the file
+
+    Returns:
+    row -- dict of the columns of the index (error is set instead of the fields if the header is invalid)
+    '''
+    import nibabel as nib
+    row = dict.fromkeys(COLUMNS)
+    row.update(path=path, mtime=stat.st_mtime, size=stat.st_size)
+    try:
+        # nib.load parses the header only, the data stays an unread proxy
+        mri = nib.load(path)
+        shape = mri.header.get_data_shape()
+        zooms = mri.header.get_zooms()
+        row.update(
+            dim=len(shape),
+            nx=shape[0], ny=shape[1] if len(shape) > 1 else 1, nz=shape[2] if len(shape) > 2 else 1,
+            volumes=shape[3] if len(shape) > 3 else 1,
+            dtype=str(mri.header.get_data_dtype()),
+            orientation=''.join(nib.aff2axcodes(mri.affine)),
+            vx=float(zooms[0]), vy=float(zooms[1]) if len(zooms) > 1 else None, vz=float(zooms[2]) if len(zooms) > 2 else None,
+            affine=json.dumps(mri.affine.tolist()))
+    except Exception as error:
+        row['error'] = '%s: %s' % (type(error).__name__, error)
+    return row
+
+
+def check_file(path, known):
+    '''
+    Stats a file and reads its header if it is new or changed since it was indexed
+
+    Arguments:
+    path -- NifTi file path
+    known -- (mtime, size) of the file in the index, or None
+
+    Returns:
+    row -- dict of the columns of the index, or None if the file is unchanged
+    '''
+    stat = os.stat(path)
+    if known is not None and known == (stat.st_mtime, stat.st_size):
+        return None
+    return read_header(path, stat)
+
+
+def index(inputs, db_path=None, workers=16, commit_every=500):
+    '''
+    Indexes the headers of the NifTi files of the inputs. Files are read by
+    a thread pool (opening and parsing headers is I/O bound), the rows are
+    committed as they arrive so an interrupted run keeps its progress, and
+    files whose mtime and size are unchanged are not opened again (unless
+    their header could not be read). Indexed
+    files that were removed from the directories are deleted from the index
+
+    Arguments:
+    inputs -- list of files, directories or glob patterns
+    db_path -- SQLite file of the index
+    workers -- number of reading threads
+    commit_every -- number of rows per transaction
+
+    Returns:
+    failed -- number of files whose header could not be read
+    '''
+    from batch import find_nifti
+    conn = connect(db_path)
+    # files that failed are read again (and counted as failed) until they are fixed
+    known = {path: (mtime, size) if error is None else None for path, mtime, size, error in conn.execute('SELECT path, mtime, size, error FROM scans')}
+    paths = [os.path.abspath(file) for file, _ in find_nifti(inputs)]
+    seen = set(paths)
+    roots = tuple(os.path.join(os.path.abspath(path), '') for path in inputs if os.path.isdir(path))
+    stale = [path for path in known if path.startswith(roots) and path not in seen] if roots else []
+
+    start = time.perf_counter()
+    insert = 'INSERT OR REPLACE INTO scans (%s) VALUES (%s)' % (', '.join(COLUMNS), ', '.join('?' * len(COLUMNS)))
+    rows = []
+    updated = unchanged = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(check_file, path, known.get(path)): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                row = future.result()
+            except OSError as error:
+                failed += 1
+                print(' FAILED %s: %s' % (futures[future], error))
+                continue
+            if row is None:
+                unchanged += 1
+                continue
+            if row['error']:
+                failed += 1
+                print(' FAILED %s: %s' % (row['path'], row['error']))
+            updated += 1
+            rows.append([row[column] for column in COLUMNS])
+            if len(rows) >= commit_every:
+                with conn:
+                    conn.executemany(insert, rows)
+                rows = []
+    with conn:
+        conn.executemany(insert, rows)
+        conn.executemany('DELETE FROM scans WHERE path = ?', [(path,) for path in stale])
+    conn.close()
+
+    elapsed = time.perf_counter() - start
+    print('Indexed %d files in %.2f s (%.0f files/s): %d new or changed, %d unchanged, %d removed, %d failed' % (
+        len(paths), elapsed, len(paths) / max(elapsed, 1e-9), updated, unchanged, len(stale), failed))
+    return failed
+
+
+def parse_shape(text):
+    '''
+    Parses a shape such as 256x256x176 (or 256,256,176)
+    '''
+    return tuple(int(n) for n in text.replace(',', 'x').split('x'))
+
+
+def query(db_path=None, shape=None, orientation=None, volumes=None, dim=None, dtype=None, voxel_size=None, tolerance=0.01, pattern=None):
+    '''
+    Finds the indexed files matching all the given filters
+
+    Arguments:
+    db_path -- SQLite file of the index
+    shape -- spatial shape (nx, ny, nz), or (nx, ny) for the first axes only
+    orientation -- axis codes such as 'RAS' or 'LPS'
+    volumes -- number of volumes of 4D MRIs
+    dim -- number of dimensions (3 or 4)
+    dtype -- data type on disk such as 'int16'
+    voxel_size -- (vx, vy, vz) voxel size in mm, or (v,) for isotropic voxels
+    tolerance -- tolerance of the voxel size in mm
+    pattern -- glob pattern of the path
+
+    Returns:
+    rows -- list of dicts of the columns of the matching files
+    '''
+    conditions, values = ['error IS NULL'], []
+    if shape:
+        for column, n in zip(['nx', 'ny', 'nz'], shape):
+            conditions.append('%s = ?' % column)
+            values.append(n)
+    if orientation:
+        conditions.append('orientation = ?')
+        values.append(orientation.upper())
+    if volumes is not None:
+        conditions.append('volumes = ?')
+        values.append(volumes)
+    if dim is not None:
+        conditions.append('dim = ?')
+        values.append(dim)
+    if dtype:
+        conditions.append('dtype = ?')
+        values.append(dtype)
+    if voxel_size:
+        if len(voxel_size) == 1:
+            voxel_size = voxel_size * 3
+        for column, size in zip(['vx', 'vy', 'vz'], voxel_size):
+            conditions.append('ABS(%s - ?) <= ?' % column)
+            values += [size, tolerance]
+    if pattern:
+        conditions.append('path GLOB ?')
+        values.append(pattern)
+    conn = connect(db_path)
+    cursor = conn.execute('SELECT %s FROM scans WHERE %s ORDER BY path' % (', '.join(COLUMNS), ' AND '.join(conditions)), values)
+    rows = [dict(zip(COLUMNS, row)) for row in cursor]
+    conn.close()
+    return rows
+
+
+def format_row(row):
+    shape = 'x'.join(str(n) for n in [row['nx'], row['ny'], row['nz']] + ([row['volumes']] if row['dim'] == 4 else []))
+    voxel_size = 'x'.join('%g' % v for v in [row['vx'], row['vy'], row['vz']] if v is not None)
+    return '%-18s %-4s %-8s %-14s %s' % (shape, row['orientation'], row['dtype'], voxel_size, row['path'])
+
+
+def index_main(argv=None):
+    parser = argparse.ArgumentParser(prog='brain_mri_viewer index', description='Indexes the headers of NifTi files in a SQLite database, re-reading only new or changed files')
+    parser.add_argument('inputs', nargs='+', help='NifTi files, directories or glob patterns')
+    parser.add_argument('--db', type=str, default=None, dest='db', help='SQLite file of the index (default: %s)' % DEFAULT_DB)
+    parser.add_argument('-j', '--workers', type=int, default=16, dest='workers', help='number of reading threads')
+    args = parser.parse_args(argv)
+
+    failed = index(args.inputs, args.db, args.workers)
+    return 1 if failed else 0
+
+
+def query_main(argv=None):
+    parser = argparse.ArgumentParser(prog='brain_mri_viewer query', description='Finds indexed NifTi files by shape, orientation, volumes, dtype or voxel size')
+    parser.add_argument('--db', type=str, default=None, dest='db', help='SQLite file of the index (default: %s)' % DEFAULT_DB)
+    parser.add_argument('--shape', type=parse_shape, default=None, dest='shape', help='spatial shape, e.g. 256x256x176')
+    parser.add_argument('--orientation', type=str, default=None, dest='orientation', help='axis codes, e.g. RAS or LPS')
+    parser.add_argument('--volumes', type=int, default=None, dest='volumes', help='number of volumes of 4D MRIs')
+    parser.add_argument('--dim', type=int, choices=[3, 4], default=None, dest='dim', help='number of dimensions')
+    parser.add_argument('--dtype', type=str, default=None, dest='dtype', help='data type on disk, e.g. int16 or float32')
+    parser.add_argument('--voxel-size', type=float, nargs='+', default=None, dest='voxel_size', help='voxel size in mm (1 value for isotropic voxels, or 3)')
+    parser.add_argument('--tolerance', type=float, default=0.01, dest='tolerance', help='tolerance of the voxel size in mm')
+    parser.add_argument('--path', type=str, default=None, dest='pattern', help='glob pattern of the path, e.g. "*/sub-01/*"')
+    parser.add_argument('-q', '--paths-only', action='store_true', dest='paths_only', help='prints only the paths (e.g. for xargs)')
+    args = parser.parse_args(argv)
+    if args.voxel_size and len(args.voxel_size) not in (1, 3):
+        parser.error('--voxel-size takes 1 or 3 values')
+
+    rows = query(args.db, args.shape, args.orientation, args.volumes, args.dim, args.dtype, args.voxel_size, args.tolerance, args.pattern)
+    for row in rows:
+        print(row['path'] if args.paths_only else format_row(row))
+    if not args.paths_only:
+        print('%d files' % len(rows))
+    return 0
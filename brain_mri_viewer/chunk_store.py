@@ -0,0 +1,309 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Chunked compressed store of NifTi files, reoriented to RAS, for instant reopening'''
+
+import argparse
+import hashlib
+import io
+import itertools
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import nibabel as nib
+from reorient import expand_key, ras_affine, reorient_to_ras
+
+STORE_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'brain_mri_viewer')
+
+def source_key(in_path):
+    '''
+    Returns the path, size and modification time identifying a NifTi file
+    '''
+    stat = os.stat(in_path)
+    return {'path': os.path.abspath(in_path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def store_path(in_path, cache_dir=None):
+    '''
+    Returns the store directory of a NifTi file in the cache directory
+    '''
+    name = hashlib.sha1(os.path.abspath(in_path).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir or DEFAULT_CACHE_DIR, os.path.basename(in_path) + '.' + name + '.store')
+
+
+def is_valid(path, in_path):
+    '''
+    Checks if a store exists and was converted from the current version of the NifTi file
+    '''
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return meta.get('version') == STORE_VERSION and meta.get('source') == source_key(in_path)
+
+
+def chunk_name(index):
+    return 'c' + '_'.join(str(i) for i in index) + '.npy.z'
+
+
+def encode_chunk(chunk, level):
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(chunk), allow_pickle=False)
+    return zlib.compress(buffer.getvalue(), level)
+
+
+def decode_chunk(data):
+    return np.load(io.BytesIO(zlib.decompress(data)), allow_pickle=False)
+
+
+def convert(in_path, path=None, chunk=64, level=3, workers=None):
+    '''
+    Transcodes a NifTi file once into a chunked store: a directory of zlib
+    compressed .npy tiles of the MRI reoriented to RAS, plus its header,
+    affine and intensity range. 4D MRIs are converted one volume at a time
+
+    Arguments:
+    in_path -- NifTi file path
+    path -- store directory (default: in the cache directory)
+    chunk -- edge of the cubic chunks
+    level -- zlib compression level
+    workers -- number of threads compressing the chunks
+
+    Returns:
+    path -- store directory
+    '''
+    path = path or store_path(in_path)
+    source = source_key(in_path)
+    mri = nib.load(in_path, keep_file_open=True)
+    affine = ras_affine(mri.affine, mri.shape)
+    n_volumes = mri.shape[3] if len(mri.shape) == 4 else 1
+
+    tmp_path = path + '.tmp%d' % os.getpid()
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    min_voxel, max_voxel = [], []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for t in range(n_volumes):
+            # one volume is decompressed at a time, in file order
+            volume = np.asanyarray(mri.dataobj[..., t] if len(mri.shape) == 4 else mri.dataobj)
+            volume = reorient_to_ras(volume, mri.affine)
+            min_voxel.append(np.min(volume).item())
+            max_voxel.append(np.max(volume).item())
+
+            def write(index):
+                tile = volume[tuple(slice(i * chunk, (i + 1) * chunk) for i in index)]
+                if len(mri.shape) == 4:
+                    # 4D tiles keep a volume axis of length 1
+                    tile, index = tile[..., None], index + (t,)
+                with open(os.path.join(tmp_path, chunk_name(index)), 'wb') as f:
+                    f.write(encode_chunk(tile, level))
+
+            grid = [range(-(-n // chunk)) for n in volume.shape]
+            list(executor.map(write, itertools.product(*grid)))
+    dtype = volume.dtype
+    shape = volume.shape + ((n_volumes,) if len(mri.shape) == 4 else ())
+
+    header = mri.header.copy()
+    header.set_data_shape(shape)
+    header.set_data_dtype(dtype)
+    header.set_slope_inter(1, 0)
+    header.set_sform(affine)
+    header.set_qform(affine)
+    with open(os.path.join(tmp_path, 'header.bin'), 'wb') as f:
+        f.write(header.binaryblock)
+    meta = {'version': STORE_VERSION, 'source': source, 'shape': list(shape), 'dtype': dtype.str,
+            'chunk': chunk, 'affine': affine.tolist(), 'source_axcodes': list(nib.aff2axcodes(mri.affine)),
+            'min': min_voxel, 'max': max_voxel}
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+class ChunkStore:
+    '''
+    Array-like view of a chunked store: indexing (ints and slices) decompresses
+    only the chunks it touches, and recently used chunks are kept in memory
+
+    Arguments:
+    path -- store directory
+    max_bytes -- memory budget of the decompressed chunks
+    '''
+    # voxels are stored already scaled
+    slope = 1.0
+    inter = 0.0
+
+    def __init__(self, path, max_bytes=256 * 2**20):
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.path = path
+        self.shape = tuple(self.meta['shape'])
+        self.ndim = len(self.shape)
+        self.dtype = np.dtype(self.meta['dtype'])
+        self.chunk = self.meta['chunk']
+        self.max_bytes = max_bytes
+        self.chunks = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def read_chunk(self, index):
+        '''
+        Returns a decompressed chunk, from memory when it was recently used
+        '''
+        with self.lock:
+            tile = self.chunks.get(index)
+            if tile is not None:
+                self.chunks.move_to_end(index)
+                return tile
+        with open(os.path.join(self.path, chunk_name(index)), 'rb') as f:
+            tile = decode_chunk(f.read())
+        with self.lock:
+            if index not in self.chunks:
+                self.chunks[index] = tile
+                self.nbytes += tile.nbytes
+                while self.nbytes > self.max_bytes and len(self.chunks) > 1:
+                    self.nbytes -= self.chunks.popitem(last=False)[1].nbytes
+        return tile
+
+    def __getitem__(self, key):
+        key = expand_key(key, self.ndim)
+        # spatial axes are chunked, the volume axis has one chunk per volume
+        sizes = [self.chunk] * 3 + [1] * (self.ndim - 3)
+        indices = [np.arange(n)[k] for n, k in zip(self.shape, key)]
+        out = np.empty([len(np.atleast_1d(i)) for i in indices], dtype=self.dtype)
+        ranges = [np.unique(np.atleast_1d(i) // size) for i, size in zip(indices, sizes)]
+        for index in itertools.product(*ranges):
+            src, dst = [], []
+            for i, c, size in zip(indices, index, sizes):
+                i = np.atleast_1d(i)
+                inside = np.nonzero(i // size == c)[0]
+                dst.append(inside)
+                src.append(i[inside] - c * size)
+            tile = self.read_chunk(tuple(int(c) for c in index))
+            out[np.ix_(*dst)] = tile[np.ix_(*src)]
+        return out.reshape([len(i) for i in indices if np.ndim(i)])
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+    def volume(self, t):
+        '''
+        Returns a lazy 3D view of one volume of a 4D store
+        '''
+        return StoreVolume(self, t)
+
+
+class StoreVolume:
+    '''
+    Lazy 3D view of one volume of a 4D ChunkStore
+    '''
+    def __init__(self, store, t):
+        self.store = store
+        self.t = t
+        self.shape = store.shape[:3]
+        self.ndim = 3
+        self.dtype = store.dtype
+
+    def __getitem__(self, key):
+        return self.store[expand_key(key, 3) + (self.t,)]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+
+class StoreImage:
+    '''
+    Minimal NifTi image interface (header, affine, dataobj, get_fdata) of a
+    chunked store, so it goes through the same MRI pipeline as nibabel images
+
+    Arguments:
+    path -- store directory
+    '''
+    chunked = True
+
+    def __init__(self, path):
+        self.dataobj = ChunkStore(path)
+        with open(os.path.join(path, 'header.bin'), 'rb') as f:
+            self.header = nib.Nifti1Header(f.read())
+        self.affine = np.array(self.dataobj.meta['affine'])
+        self.shape = self.dataobj.shape
+
+    def get_fdata(self):
+        return np.asarray(self.dataobj, dtype=np.float64)
+
+    def intensity_range(self, volume=None):
+        '''
+        Returns the (min, max) intensity of the MRI (or of one volume) computed at conversion
+        '''
+        meta = self.dataobj.meta
+        if volume is None:
+            return min(meta['min']), max(meta['max'])
+        return meta['min'][volume], meta['max'][volume]
+
+
+def open_store(in_path, cache_dir=None, chunk=64):
+    '''
+    Opens the chunked store of a NifTi file, converting it first if it is missing
+    or was converted from a different version of the file (path, size or mtime)
+
+    Arguments:
+    in_path -- NifTi file path
+    cache_dir -- directory of the stores
+    chunk -- edge of the cubic chunks
+
+    Returns:
+    mri -- StoreImage of the NifTi file
+    '''
+    path = store_path(in_path, cache_dir)
+    if not is_valid(path, in_path):
+        start = time.perf_counter()
+        print('Converting %s to chunked store %s' % (in_path, path))
+        convert(in_path, path, chunk)
+        print('Converted in %.2f s' % (time.perf_counter() - start))
+    return StoreImage(path)
+
+
+def convert_main(argv=None):
+    parser = argparse.ArgumentParser(prog='brain_mri_viewer convert', description='Converts NifTi files to chunked stores that reopen instantly')
+    parser.add_argument('inputs', nargs='+', help='NifTi files')
+    parser.add_argument('--cache-dir', type=str, default=None, dest='cache_dir', help='directory of the stores (default: %s)' % DEFAULT_CACHE_DIR)
+    parser.add_argument('--chunk', type=int, default=64, dest='chunk', help='edge of the cubic chunks')
+    parser.add_argument('--level', type=int, default=3, dest='level', help='zlib compression level')
+    parser.add_argument('-f', '--force', action='store_true', dest='force', help='converts also the stores that are up to date')
+    args = parser.parse_args(argv)
+
+    for in_path in args.inputs:
+        path = store_path(in_path, args.cache_dir)
+        if not args.force and is_valid(path, in_path):
+            print('%s: up to date (%s)' % (in_path, path))
+            continue
+        start = time.perf_counter()
+        convert(in_path, path, args.chunk, args.level)
+        print('%s -> %s (%.2f s)' % (in_path, path, time.perf_counter() - start))
+    return 0
@@ -0,0 +1,254 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Side by side comparison of several MRIs (e.g. T1, T2, FLAIR, follow-up) with linked sliders'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from view_slices import VIEWS, VIEW_TITLES, SliceImage, slice_cache
+from profiler import span
+
+def load_shared(path, volume=None, lazy=False):
+    '''
+    Worker job: loads an MRI with the MRI class, reorients it to RAS and
+    copies it into a new shared memory block, so only its name and metadata
+    are sent back to the viewer process (the voxels are never pickled)
+
+    Arguments:
+    path -- NifTi file path
+    volume -- volume to load if the MRI contains more than 1 (default: 0)
+    lazy -- memory-maps the MRI in its native dtype instead of loading it as float64
+
+    Returns:
+    info -- dict with the name of the shared memory block, the shape and dtype
+            of the array, its RAS affine, voxel spacing, intensity range and default window
+    '''
+    import nibabel as nib
+    from brain_mri_viewer import MRI
+
+    mri = MRI(nib.load(path))
+    mri.extract_info((volume or 0) if len(mri.mri.shape) == 4 else None, lazy)
+    mri.check_coord()
+    mri_data = np.asanyarray(mri.mri_data)
+    shm = shared_memory.SharedMemory(create=True, size=max(mri_data.nbytes, 1))
+    # memory-mapped files are read straight into the shared block
+    shared = np.ndarray(mri_data.shape, mri_data.dtype, buffer=shm.buf)
+    shared[...] = mri_data
+    del shared
+    shm.close()
+    stats = mri.intensity_stats()
+    return {'path': path, 'name': shm.name, 'shape': mri_data.shape, 'dtype': mri_data.dtype.str,
+            'ras_affine': mri.mri_ras_affine, 'spacing': mri.mri_spacing,
+            'min_voxel': stats.min, 'max_voxel': stats.max, 'window': stats.window()}
+
+
+class Scan:
+    '''
+    MRI of the comparison viewer, attached to the shared memory block filled by a worker
+
+    Arguments:
+    info -- dict returned by load_shared
+    '''
+    def __init__(self, info):
+        self.path = info['path']
+        self.shm = shared_memory.SharedMemory(name=info['name'])
+        self.mri_data = np.ndarray(info['shape'], np.dtype(info['dtype']), buffer=self.shm.buf)
+        self.mri_shape = np.asarray(info['shape'])
+        self.ras_affine = info['ras_affine']
+        self.spacing = info['spacing']
+        self.min_voxel, self.max_voxel = info['min_voxel'], info['max_voxel']
+        self.window = info['window']
+
+    def close(self):
+        '''
+        Frees the shared memory block
+        '''
+        self.mri_data = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # arrays of the figure still map the block, it is released when the process exits
+            pass
+        self.shm.unlink()
+
+
+def load_scans(paths, volume=None, lazy=False, workers=None):
+    '''
+    Loads the MRIs in parallel worker processes into shared memory
+
+    Arguments:
+    paths -- list of NifTi file paths
+    volume -- volume to load from 4D MRIs (default: 0)
+    lazy -- memory-maps the MRIs in their native dtype instead of loading them as float64
+    workers -- number of worker processes (default: one per MRI, up to the number of CPUs)
+
+    Returns:
+    scans -- list of Scan objects, in the order of paths (if an MRI cannot be
+             loaded, the error of the first one is raised and no block is left)
+    '''
+    # the workers register their blocks with the tracker of this process, which
+    # unregisters them when the viewer unlinks them (instead of the exiting workers)
+    resource_tracker.ensure_running()
+    workers = workers or min(len(paths), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(load_shared, path, volume, lazy) for path in paths]
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if errors:
+        # the blocks of the MRIs that were loaded are freed before failing
+        for future in futures:
+            if future.exception() is None:
+                Scan(future.result()).close()
+        raise errors[0]
+    return [Scan(future.result()) for future in futures]
+
+
+def linked_slice(reference, scan, view, slice):
+    '''
+    Finds the slice of a scan at the same position (in mm, through the RAS
+    affines) as a slice of the reference scan, clipped to the scan
+
+    Arguments:
+    reference -- Scan whose slider is displayed
+    scan -- linked Scan
+    view -- string containing the view (sag, cor or axi)
+    slice -- index of the slice of the reference scan
+
+    Returns:
+    slice -- index of the slice of the scan
+    '''
+    axis = VIEWS.index(view)
+    voxel = np.append((reference.mri_shape[:3] - 1) / 2, 1.0)
+    voxel[axis] = slice
+    position = np.linalg.solve(scan.ras_affine, reference.ras_affine.dot(voxel))
+    return int(np.clip(np.around(position[axis]), 0, scan.mri_shape[axis] - 1))
+
+
+def view_compare(scans, views, window=False, show_fps=False, cache_mb=256, prefetch=4):
+    '''
+    Outputs a figure with one row per MRI and one column per view, where the
+    slice sliders move every MRI to the same position and the window sliders
+    change the window of every MRI relative to its own default window (so
+    different contrasts stay comparable). The panels changed by one slider
+    event are redrawn together in a single blit
+
+    Arguments:
+    scans -- list of Scan objects, the first one is the reference of the slice sliders
+    views -- list of the views to display
+    window -- enables the linked windowing sliders
+    show_fps -- shows the frames per second and latency of the slider updates
+    cache_mb -- memory budget in MB of the cache of displayed slices of each MRI
+    prefetch -- number of slices prefetched in the scrolling direction (0 disables it)
+    '''
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import Slider
+    from blitting import BlitManager
+
+    reference = scans[0]
+    caches = [slice_cache(scan.mri_data, cache_mb, prefetch) for scan in scans]
+
+    def scan_window(scan, level, width):
+        if not window:
+            return None
+        wl, ww = scan.window
+        return (wl + level * ww, max(width * ww, 1e-6))
+
+    plt.style.use('dark_background')
+    fig, axes = plt.subplots(len(scans), len(views), squeeze=False)
+    plt.subplots_adjust(left=0.2 if window else 0.05, right=0.98, top=0.95, bottom=0.08 + 0.04*len(views), hspace=0.25)
+    blit = BlitManager(fig, show_fps)
+    images = {}
+    for i, scan in enumerate(scans):
+        for j, view in enumerate(views):
+            slice = linked_slice(reference, scan, view, int(reference.mri_shape[VIEWS.index(view)])//2)
+            images[i, view] = SliceImage(axes[i, j], caches[i], view, scan.mri_shape, slice,
+                                         scan_window(scan, 0, 1), spacing=scan.spacing)
+            images[i, view].add_to(blit)
+            axes[i, j].set_title('%s - %s' % (os.path.basename(scan.path), VIEW_TITLES[view]), fontsize=8)
+            axes[i, j].axis('off')
+
+    slice_sliders = {}
+    for k, view in enumerate(views):
+        axislice = plt.axes([0.25, 0.02 + 0.04*(len(views) - 1 - k), 0.65, 0.03])
+        slice_sliders[view] = Slider(ax=axislice,
+            label=VIEW_TITLES[view].split()[0] + ' slices ',
+            valmin=0,
+            valmax=int(reference.mri_shape[VIEWS.index(view)])-1,
+            valstep=1,
+            valinit=int(reference.mri_shape[VIEWS.index(view)])//2)
+
+    if window:
+        # level offset and width scale in units of the default window of each MRI
+        axiwindow_width = plt.axes([0.05, 0.3, 0.0225, 0.6])
+        swidth=Slider(ax=axiwindow_width,
+            label='Window \n width ',
+            valmin=0.05,
+            valmax=4,
+            valinit=1,
+            orientation="vertical")
+        axiwindow_level = plt.axes([0.12, 0.3, 0.0225, 0.6])
+        slevel=Slider(ax=axiwindow_level,
+            label='Window \n level ',
+            valmin=-1,
+            valmax=1,
+            valinit=0,
+            orientation="vertical")
+
+    def current_window(scan):
+        return scan_window(scan, slevel.val, swidth.val) if window else None
+
+    def show(i, view):
+        slice = linked_slice(reference, scans[i], view, int(slice_sliders[view].val))
+        return images[i, view].show(slice, current_window(scans[i]))
+
+    def slice_updater(view):
+        def update_linked_slices():
+            return [artist for i in range(len(scans)) for artist in show(i, view)]
+        return update_linked_slices
+
+    def update_linked_window():
+        return [artist for i in range(len(scans)) for view in views for artist in show(i, view)]
+
+    for view, slider in slice_sliders.items():
+        blit.add_slider(slider)
+        blit.on_changed(slider, slice_updater(view))
+    if window:
+        for slider in (swidth, slevel):
+            blit.add_slider(slider)
+            blit.on_changed(slider, update_linked_window)
+
+    plt.show()
+    for cache in caches:
+        cache.close()
+
+
+def compare_main(paths, views, volume=None, lazy=False, window=False, show_fps=False, cache_mb=256, prefetch=4):
+    '''
+    Loads the MRIs in parallel and opens the comparison viewer, freeing the shared memory on exit
+    '''
+    with span('load scans', n=len(paths)):
+        scans = load_scans(paths, volume, lazy)
+    for scan in scans:
+        print('%s: shape %s, %s, spacing %s mm' % (scan.path, tuple(int(n) for n in scan.mri_shape),
+                                                   scan.mri_data.dtype, tuple(round(float(s), 3) for s in scan.spacing)))
+    try:
+        with span('viewer'):
+            view_compare(scans, views, window, show_fps, cache_mb, prefetch)
+    finally:
+        for scan in scans:
+            scan.close()
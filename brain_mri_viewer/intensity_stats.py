@@ -0,0 +1,170 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Single-pass streaming intensity statistics (min, max, mean, std, histogram and percentiles) of MRIs'''
+
+import numpy as np
+
+REPORT_PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+
+class IntensityStats:
+    '''
+    Accumulates the intensity statistics of an MRI chunk by chunk, in a single
+    pass and bounded memory. The mean and variance of the chunks are merged
+    exactly (Chan et al.), and the histogram has a fixed number of bins whose
+    range doubles (merging pairs of bins) when a chunk falls outside it, so
+    the range does not need to be known in advance. Non finite voxels are skipped
+
+    Arguments:
+    bins -- number of histogram bins (even)
+    '''
+    def __init__(self, bins=4096):
+        self.bins = bins
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.low = None
+        self.width = None
+        self.histogram = np.zeros(bins, dtype=np.int64)
+
+    def update(self, mri_chunk):
+        '''
+        Adds the voxels of a chunk of the MRI
+        '''
+        mri_chunk = np.asarray(mri_chunk).ravel()
+        if mri_chunk.dtype.kind == 'f':
+            mri_chunk = mri_chunk[np.isfinite(mri_chunk)]
+        if mri_chunk.size == 0:
+            return
+        chunk_min, chunk_max = mri_chunk.min().item(), mri_chunk.max().item()
+        n = mri_chunk.size
+        values = mri_chunk.astype(np.float64)
+        mean = values.mean()
+        values -= mean
+        m2 = np.dot(values, values)
+
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+        self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+        self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+
+        self._extend(chunk_min, chunk_max)
+        values += mean - self.low
+        values /= self.width
+        index = values.astype(np.intp)
+        np.clip(index, 0, self.bins - 1, out=index)
+        self.histogram += np.bincount(index, minlength=self.bins)
+
+    def _extend(self, low, high):
+        # doubles the histogram range until it covers [low, high]
+        if self.low is None:
+            self.low = low
+            self.width = (high - low) / self.bins if high > low else 1.0 / self.bins
+        while high > self.low + self.width * self.bins or low < self.low:
+            merged = self.histogram.reshape(-1, 2).sum(axis=1)
+            self.histogram = np.zeros(self.bins, dtype=np.int64)
+            if low < self.low:
+                self.low -= self.width * self.bins
+                self.histogram[self.bins // 2:] = merged
+            else:
+                self.histogram[:self.bins // 2] = merged
+            self.width *= 2
+
+    @property
+    def std(self):
+        return (self.m2 / self.count) ** 0.5 if self.count else 0.0
+
+    def percentile(self, q):
+        '''
+        Returns the q-th percentile (0-100), interpolated inside the histogram bins
+
+        Arguments:
+        q -- percentile or sequence of percentiles
+
+        Returns:
+        value -- intensity (or list of intensities) of the percentiles
+        '''
+        if np.ndim(q):
+            return [self.percentile(p) for p in q]
+        if not self.count:
+            return None
+        cumulative = np.cumsum(self.histogram)
+        target = q / 100 * self.count
+        i = min(int(np.searchsorted(cumulative, target)), self.bins - 1)
+        before = cumulative[i - 1] if i else 0
+        fraction = (target - before) / self.histogram[i] if self.histogram[i] else 0.0
+        value = self.low + (i + fraction) * self.width
+        return float(min(max(value, self.min), self.max))
+
+    def window(self, low=1, high=99):
+        '''
+        Returns the (window level, window width) spanning two percentiles
+        '''
+        min_window, max_window = self.percentile((low, high))
+        if max_window <= min_window:
+            min_window, max_window = self.min, self.max
+        return (min_window + max_window) / 2, max(max_window - min_window, 1)
+
+    def as_dict(self):
+        '''
+        Returns the statistics as a dict (with the report percentiles)
+        '''
+        return {'count': self.count, 'min': self.min, 'max': self.max, 'mean': self.mean, 'std': self.std,
+                'percentiles': dict(zip(REPORT_PERCENTILES, self.percentile(REPORT_PERCENTILES))),
+                'bins': self.bins, 'bin_width': self.width, 'low': self.low}
+
+    def report(self):
+        '''
+        Returns the statistics as printable lines
+        '''
+        stats = self.as_dict()
+        lines = ['Intensity statistics of %d voxels' % stats['count'],
+                 'min / max: %g / %g' % (stats['min'], stats['max']),
+                 'mean / std: %g / %g' % (stats['mean'], stats['std']),
+                 'percentiles: ' + ', '.join('p%d %g' % item for item in stats['percentiles'].items()),
+                 'histogram: %d bins of width %g from %g' % (stats['bins'], stats['bin_width'], stats['low'])]
+        return '\n'.join(lines)
+
+
+def volume_stats(mri_data, slab=8, bins=4096):
+    '''
+    Computes the intensity statistics of an MRI in a single pass, slab by slab
+    along the third axis, so memory-mapped or lazy MRIs are never loaded at once.
+    4D MRIs are summarized over all their volumes, read one volume at a time
+
+    Arguments:
+    mri_data --  3D or 4D MRI array (it can be memory-mapped or lazy)
+    slab -- number of slices read at a time
+    bins -- number of histogram bins
+
+    Returns:
+    stats -- IntensityStats of the MRI
+    '''
+    stats = IntensityStats(bins)
+    if len(mri_data.shape) < 3:
+        stats.update(mri_data)
+        return stats
+    volumes = [()] if len(mri_data.shape) < 4 else [(t,) for t in range(mri_data.shape[3])]
+    for volume in volumes:
+        for start in range(0, mri_data.shape[2], slab):
+            stats.update(mri_data[(np.s_[:], np.s_[:], np.s_[start:start+slab]) + volume])
+    return stats
@@ -0,0 +1,303 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Oblique reslicing of MRIs along arbitrary planes with trilinear interpolation'''
+
+from collections import OrderedDict
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.widgets import Slider
+from blitting import BlitManager
+from view_slices import windowing, window_sliders
+
+try:
+    from scipy.ndimage import map_coordinates
+except ImportError:
+    map_coordinates = None
+
+def plane_basis(azimuth, elevation):
+    '''
+    Computes the normal and the in-plane axes of an oblique plane. Azimuth 0
+    and elevation 0 is the sagittal plane, azimuth 90 the coronal plane and
+    elevation 90 the axial plane, with the in-plane axes of the orthogonal views
+
+    Arguments:
+    azimuth -- rotation of the normal around the S axis in degrees
+    elevation -- angle of the normal above the RA plane in degrees
+
+    Returns:
+    normal -- unit normal of the plane (RAS voxel axes)
+    u -- unit horizontal axis of the plane
+    v -- unit vertical axis of the plane
+    '''
+    azimuth, elevation = np.radians(azimuth), np.radians(elevation)
+    normal = np.array([np.cos(elevation) * np.cos(azimuth), np.cos(elevation) * np.sin(azimuth), np.sin(elevation)])
+    up = np.array([0.0, 0.0, 1.0]) if abs(normal[2]) < 0.99 else np.array([0.0, 1.0, 0.0])
+    u = np.cross(up, normal)
+    u /= np.linalg.norm(u)
+    v = np.cross(normal, u)
+    return normal, u, v
+
+
+def trilinear(mri_data, coords, cval=0.0):
+    '''
+    Samples the MRI at voxel coordinates with trilinear interpolation
+    (vectorized NumPy: 8 flat gathers and 7 linear interpolations), points
+    outside the MRI are set to cval
+
+    Arguments:
+    mri_data --  3D MRI array (in memory or memory-mapped)
+    coords -- (3, ...) float array of voxel coordinates
+    cval -- value of the points outside the MRI
+
+    Returns:
+    samples -- float32 array with the shape of the coordinates
+    '''
+    shape = np.asarray(mri_data.shape[:3])
+    coords = coords.reshape(3, -1)
+    inside = np.all((coords >= 0) & (coords <= (shape - 1)[:, None]), axis=0)
+
+    # reversed axes (e.g. reoriented views) are flipped back to positive strides
+    flips = [axis for axis in range(3) if mri_data.strides[axis] < 0]
+    if flips:
+        mri_data = np.flip(mri_data, flips)
+        coords = coords.copy()
+        for axis in flips:
+            coords[axis] = shape[axis] - 1 - coords[axis]
+
+    # flat offset of the lower corner, the other 7 corners are at fixed offsets from it
+    strides = np.asarray(mri_data.strides[:3]) // mri_data.itemsize
+    flat = np.lib.stride_tricks.as_strided(mri_data, shape=(int(np.dot(shape - 1, strides)) + 1,), strides=(mri_data.itemsize,))
+    offsets = np.zeros(coords.shape[1], dtype=np.intp)
+    fractions = []
+    for axis in range(3):
+        base = np.clip(np.floor(coords[axis]), 0, max(shape[axis] - 2, 0))
+        fractions.append((coords[axis] - base).astype(np.float32))
+        offsets += base.astype(np.intp) * strides[axis]
+    steps = strides * (shape > 1)
+
+    def corner(dx, dy, dz):
+        return flat[offsets + (dx*steps[0] + dy*steps[1] + dz*steps[2])].astype(np.float32)
+
+    def lerp(low, high, fraction):
+        high -= low
+        high *= fraction
+        high += low
+        return high
+
+    fx, fy, fz = fractions
+    c00 = lerp(corner(0, 0, 0), corner(0, 0, 1), fz)
+    c01 = lerp(corner(0, 1, 0), corner(0, 1, 1), fz)
+    c10 = lerp(corner(1, 0, 0), corner(1, 0, 1), fz)
+    c11 = lerp(corner(1, 1, 0), corner(1, 1, 1), fz)
+    samples = lerp(lerp(c00, c01, fy), lerp(c10, c11, fy), fx)
+    samples[~inside] = cval
+    return samples
+
+
+class ObliqueSlicer:
+    '''
+    Reslices an MRI along oblique planes through its center. The in-plane
+    sampling grid of each orientation is computed once and cached, so
+    translating the plane along its normal only adds an offset to the grid,
+    and rotating it back to a recent orientation reuses its grid.
+    scipy.ndimage.map_coordinates is used when available, otherwise the
+    NumPy trilinear kernel
+
+    Arguments:
+    mri_data --  3D MRI array (in memory or memory-mapped)
+    size -- number of pixels of each side of the resliced plane
+    extent -- side of the plane in voxels (default: the largest dimension of the MRI)
+    max_grids -- number of plane orientations kept in the cache
+    '''
+    def __init__(self, mri_data, size=256, extent=None, max_grids=16):
+        self.mri_data = mri_data
+        self.size = size
+        self.extent = extent or max(mri_data.shape[:3])
+        self.center = (np.asarray(mri_data.shape[:3]) - 1) / 2
+        self.max_grids = max_grids
+        self.grids = OrderedDict()
+        self.coords = np.empty((3, size, size), dtype=np.float32)
+        steps = (np.arange(size, dtype=np.float32) - (size - 1) / 2) * (self.extent / size)
+        self.rows, self.cols = np.meshgrid(steps, steps, indexing='ij')
+
+    def grid(self, azimuth, elevation):
+        '''
+        Returns the cached in-plane grid (3, size, size) of voxel offsets from the plane center
+        '''
+        key = (round(float(azimuth), 3), round(float(elevation), 3))
+        if key in self.grids:
+            self.grids.move_to_end(key)
+            return self.grids[key]
+        normal, u, v = plane_basis(*key)
+        grid = (u[:, None, None] * self.cols + v[:, None, None] * self.rows).astype(np.float32)
+        self.grids[key] = (normal, grid)
+        while len(self.grids) > self.max_grids:
+            self.grids.popitem(last=False)
+        return normal, grid
+
+    def reslice(self, azimuth=0, elevation=0, offset=0, cval=0.0):
+        '''
+        Samples the oblique plane
+
+        Arguments:
+        azimuth -- rotation of the normal around the S axis in degrees
+        elevation -- angle of the normal above the RA plane in degrees
+        offset -- distance in voxels of the plane from the center of the MRI along its normal
+        cval -- value of the points outside the MRI
+
+        Returns:
+        mri_slice -- (size, size) float32 image, rows along the vertical axis of the plane
+        '''
+        normal, grid = self.grid(azimuth, elevation)
+        origin = (self.center + offset * normal).astype(np.float32)
+        np.add(grid, origin[:, None, None], out=self.coords)
+        if map_coordinates is not None:
+            return map_coordinates(self.mri_data, self.coords, output=np.float32, order=1, mode='constant', cval=cval, prefilter=False)
+        return trilinear(self.mri_data, self.coords, cval).reshape(self.size, self.size)
+
+    def nearest(self, label_data):
+        '''
+        Samples a label map (with the shape of the MRI) on the last resliced
+        plane with nearest neighbour interpolation, points outside are background
+
+        Arguments:
+        label_data -- 3D integer label map
+
+        Returns:
+        label_slice -- (size, size) array of labels
+        '''
+        voxels = np.rint(self.coords).astype(np.intp)
+        shape = np.asarray(label_data.shape[:3])[:, None, None]
+        inside = np.all((voxels >= 0) & (voxels < shape), axis=0)
+        voxels *= inside
+        label_slice = np.asarray(label_data)[voxels[0], voxels[1], voxels[2]]
+        label_slice[~inside] = 0
+        return label_slice
+
+
+class ObliqueOverlay:
+    '''
+    Labels of an Overlay on the oblique plane, redrawn when the plane moves
+    or the opacity changes
+
+    Arguments:
+    ax -- matplotlib axes of the oblique plane
+    overlay -- Overlay of the MRI
+    slicer -- ObliqueSlicer of the MRI
+    extent -- extent of the oblique image
+    '''
+    def __init__(self, ax, overlay, slicer, extent):
+        self.overlay = overlay
+        self.slicer = slicer
+        self.label_slice = slicer.nearest(overlay.label_data)
+        self.image = ax.imshow(overlay.colorize(self.label_slice), origin='lower', interpolation='nearest', zorder=2,
+                               extent=extent, aspect=ax.get_aspect())
+        overlay.images.append(self)
+
+    def show(self):
+        '''
+        Samples the labels of the last resliced plane
+
+        Returns:
+        artists -- list with the overlay image
+        '''
+        self.label_slice = self.slicer.nearest(self.overlay.label_data)
+        return self.redraw()
+
+    def redraw(self):
+        self.image.set_data(self.overlay.colorize(self.label_slice))
+        return [self.image]
+
+
+def view_oblique(mri_shape, mri_data, size=256, intensity_range=None, window=None, show_fps=False, overlay=None):
+    '''
+    Outputs a figure where an oblique plane of the MRI can be rotated (azimuth and
+    elevation of its normal) and moved along its normal
+
+    Arguments:
+    mri_shape -- shape of the MRI array
+    mri_data --  3D MRI array (in memory or memory-mapped)
+    size -- number of pixels of each side of the resliced plane
+    intensity_range -- (min, max) intensity of the MRI, range of the gray scale and windowing sliders
+    window -- initial (window level, window width), or None for no windowing
+    show_fps -- shows the frames per second and latency of the slider updates
+    overlay -- Overlay of a label map resliced along the same plane (None for no overlay)
+    '''
+    slicer = ObliqueSlicer(mri_data, size)
+    cval = intensity_range[0] if intensity_range is not None else 0.0
+
+    def display(azimuth, elevation, offset, window):
+        mri_slice = slicer.reslice(azimuth, elevation, offset, cval)
+        if window is not None:
+            mri_slice = windowing(mri_slice, *window)
+        return mri_slice
+
+    plt.style.use('dark_background')
+    plt.subplots_adjust(left=0.25, bottom=0.25)
+    vmin, vmax = intensity_range if window is None and intensity_range is not None else (None, None)
+    half = slicer.extent / 2
+    l = plt.imshow(display(0, 0, 0, window), cmap='gray', origin='lower', vmin=vmin, vmax=vmax,
+                   extent=(-half, half, -half, half))
+    plt.axis('off')
+    oblique_overlay = ObliqueOverlay(plt.gca(), overlay, slicer, l.get_extent()) if overlay is not None else None
+
+    axiazimuth = plt.axes([0.25, 0.14, 0.65, 0.03])
+    sazimuth=Slider(ax=axiazimuth,
+        label='Azimuth ',
+        valmin=-180,
+        valmax=180,
+        valstep=1,
+        valinit=0)
+    axielevation = plt.axes([0.25, 0.1, 0.65, 0.03])
+    selevation=Slider(ax=axielevation,
+        label='Elevation ',
+        valmin=-90,
+        valmax=90,
+        valstep=1,
+        valinit=0)
+    axioffset = plt.axes([0.25, 0.06, 0.65, 0.03])
+    soffset=Slider(ax=axioffset,
+        label='Offset ',
+        valmin=-int(half),
+        valmax=int(half),
+        valstep=1,
+        valinit=0)
+    swidth, slevel = window_sliders(window, intensity_range, 0.1, 0.2) if window is not None else (None, None)
+
+    blit = BlitManager(plt.gcf(), show_fps)
+    if oblique_overlay is not None:
+        blit.add_region(l.axes, [l, oblique_overlay.image])
+    else:
+        blit.add_image(l)
+
+    def update():
+        current_window = None if swidth is None else (np.around(slevel.val), np.around(swidth.val))
+        l.set_data(display(sazimuth.val, selevation.val, soffset.val, current_window))
+        if oblique_overlay is not None:
+            return [l] + oblique_overlay.show()
+        return [l]
+
+    for slider in (sazimuth, selevation, soffset, swidth, slevel):
+        if slider is not None:
+            blit.add_slider(slider)
+            blit.on_changed(slider, update)
+
+    if overlay is not None:
+        # the plane has no slice sliders, jumping to a label prints its slices
+        overlay.add_controls(plt.gcf(), blit, {})
+    plt.show()
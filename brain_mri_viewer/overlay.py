@@ -0,0 +1,320 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Label map overlays (e.g. FreeSurfer aseg/aparc) with a color lookup table and a per-slice label index'''
+
+import os
+import numpy as np
+from matplotlib.colors import hsv_to_rgb
+from matplotlib.widgets import Slider, TextBox
+from view_slices import VIEWS, get_slice
+
+def read_lut(path):
+    '''
+    Reads a FreeSurfer color lookup table (lines "label name R G B A")
+
+    Arguments:
+    path -- path of the lookup table (e.g. $FREESURFER_HOME/FreeSurferColorLUT.txt)
+
+    Returns:
+    colors -- dict of label: (R, G, B) in [0, 255]
+    names -- dict of label: name
+    '''
+    colors, names = {}, {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 5 or not fields[0].isdigit():
+                continue
+            label = int(fields[0])
+            names[label] = fields[1]
+            colors[label] = tuple(int(c) for c in fields[2:5])
+    return colors, names
+
+
+def default_lut_path():
+    '''
+    Returns the lookup table of the FreeSurfer installation, if any
+    '''
+    path = os.path.join(os.environ.get('FREESURFER_HOME', ''), 'FreeSurferColorLUT.txt')
+    return path if os.path.isfile(path) else None
+
+
+def label_colors(labels):
+    '''
+    Generates distinct colors for labels without a lookup table (hues spaced by the golden ratio)
+
+    Arguments:
+    labels -- array of labels
+
+    Returns:
+    colors -- dict of label: (R, G, B) in [0, 255]
+    '''
+    hues = (np.asarray(labels, dtype=np.float64) * 0.618033988749895) % 1
+    rgb = hsv_to_rgb(np.stack([hues, np.full_like(hues, 0.75), np.ones_like(hues)], axis=-1))
+    return {int(label): tuple(int(c) for c in np.round(255 * color)) for label, color in zip(labels, rgb)}
+
+
+class LabelIndex:
+    '''
+    Index of the labels of a label map, built in one pass over its labeled
+    voxels: for each view, the number of voxels and the 2D bounding box of
+    every label in every slice, and for each label the slice of each view
+    where its cross-section is largest. Empty slices are known without
+    reading them, and jumping to a label is a dict lookup
+
+    Arguments:
+    label_data -- 3D integer label map (0 is background)
+    '''
+    def __init__(self, label_data):
+        label_data = np.asarray(label_data)
+        coords = np.nonzero(label_data)
+        values = label_data[coords]
+        if values.dtype.kind in 'iu' and values.size and values.min() >= 0 and values.max() < 2**16:
+            # small non-negative labels are ranked with a table instead of sorting the voxels
+            self.labels = np.flatnonzero(np.bincount(values))
+            rank = np.zeros(int(self.labels[-1]) + 1, dtype=np.intp)
+            rank[self.labels] = np.arange(len(self.labels))
+            inverse = rank[values]
+        else:
+            self.labels, inverse = np.unique(values, return_inverse=True)
+        self.rank = {int(label): i for i, label in enumerate(self.labels)}
+        self.counts = {}
+        self.label_boxes = {}
+        self.boxes = {}
+        self.centers = {}
+        n_labels = len(self.labels)
+        for axis, view in enumerate(VIEWS):
+            n = label_data.shape[axis]
+            # one group per (label, slice), reduced with unbuffered ufuncs
+            group = inverse * n + coords[axis]
+            counts = np.bincount(group, minlength=n_labels * n).reshape(n_labels, n)
+            boxes = np.empty((4, n_labels * n), dtype=np.intp)
+            boxes[0::2] = np.iinfo(np.intp).max
+            boxes[1::2] = -1
+            for i, other in enumerate([coords[i] for i in range(3) if i != axis]):
+                np.minimum.at(boxes[2*i], group, other)
+                np.maximum.at(boxes[2*i+1], group, other)
+            boxes = boxes.reshape(4, n_labels, n)
+            self.counts[view] = counts
+            self.label_boxes[view] = boxes
+            self.centers[view] = counts.argmax(axis=1)
+            # union of the boxes of each slice, None for empty slices
+            if not n_labels:
+                self.boxes[view] = [None] * n
+                continue
+            union = np.stack([boxes[0].min(axis=0), boxes[1].max(axis=0), boxes[2].min(axis=0), boxes[3].max(axis=0)], axis=1)
+            self.boxes[view] = [tuple(int(c) for c in box) if box[1] >= 0 else None for box in union]
+
+    def labels_in(self, view, slice):
+        '''
+        Returns the dict of label: (min, max of the 1st axis, min, max of the 2nd axis) boxes of a slice
+        '''
+        present = np.flatnonzero(self.counts[view][:, slice])
+        return {int(self.labels[i]): tuple(int(c) for c in self.label_boxes[view][:, i, slice]) for i in present}
+
+    def bbox(self, view, slice):
+        '''
+        Returns the bounding box of all the labels of a slice, or None if it is empty
+        '''
+        return self.boxes[view][slice]
+
+    def jump(self, label):
+        '''
+        Returns the slice of each view with the largest cross-section of a label (None if it is absent)
+        '''
+        i = self.rank.get(int(label))
+        if i is None:
+            return None
+        return {view: int(self.centers[view][i]) for view in VIEWS}
+
+
+class Overlay:
+    '''
+    Label map drawn on top of the slices with a color lookup table. Only the
+    bounding box of the labels of each slice is colored, and empty slices are
+    hidden without reading them
+
+    Arguments:
+    label_data -- 3D integer label map with the shape of the MRI (0 is background)
+    lut_path -- FreeSurfer color lookup table (default: the FreeSurfer installation, or generated colors)
+    opacity -- opacity of the labels between 0 and 1
+    '''
+    def __init__(self, label_data, lut_path=None, opacity=0.4):
+        label_data = np.asanyarray(label_data)
+        if label_data.dtype.kind == 'f':
+            label_data = np.rint(label_data).astype(np.int32)
+        self.label_data = label_data
+        self.index = LabelIndex(label_data)
+        self.opacity = opacity
+        self.images = []
+        lut_path = lut_path or default_lut_path()
+        colors, self.names = read_lut(lut_path) if lut_path else ({}, {})
+        missing = [label for label in self.index.labels if int(label) not in colors]
+        colors.update(label_colors(missing))
+
+        # table indexed by the label, or by its rank for negative or very large labels
+        # (row 0 is the transparent background)
+        self.dense = len(self.index.labels) == 0 or (self.index.labels[0] > 0 and self.index.labels[-1] < 2**16)
+        keys = self.index.labels if self.dense else np.arange(1, len(self.index.labels) + 1)
+        self.lut = np.zeros((int(keys[-1]) + 1 if len(keys) else 1, 4), dtype=np.uint8)
+        for key, label in zip(keys, self.index.labels):
+            self.lut[key, :3] = colors[int(label)]
+        self.set_opacity(opacity)
+
+    def set_opacity(self, opacity):
+        '''
+        Changes the opacity of all the labels
+        '''
+        self.opacity = opacity
+        self.lut[1:, 3] = int(round(255 * opacity))
+
+    def rgba(self, view, slice):
+        '''
+        Colors the labels of a slice, oriented as the displayed slices
+
+        Arguments:
+        view -- string containing the view (sag, cor or axi)
+        slice -- index of the slice
+
+        Returns:
+        image -- RGBA uint8 image of the bounding box of the labels, or None if the slice is empty
+        extent -- extent of the image in voxels of the slice
+        '''
+        box = self.index.bbox(view, slice)
+        if box is None:
+            return None, None
+        a0, a1, b0, b1 = box
+        label_slice = np.asarray(get_slice(self.label_data, view, slice)[a0:a1+1, b0:b1+1]).T
+        return self.colorize(label_slice), (a0 - 0.5, a1 + 0.5, b0 - 0.5, b1 + 0.5)
+
+    def colorize(self, label_slice):
+        '''
+        Colors a 2D array of labels of the label map (e.g. resampled along an oblique plane)
+
+        Returns:
+        image -- RGBA uint8 image, transparent on the background
+        '''
+        if not self.dense:
+            label_slice = np.where(label_slice == 0, 0, np.searchsorted(self.index.labels, label_slice) + 1)
+        return self.lut[label_slice]
+
+    def add_image(self, ax, view, slice):
+        '''
+        Adds the overlay of one view to the axes of its slice
+
+        Returns:
+        overlay_image -- OverlayImage of the view
+        '''
+        overlay_image = OverlayImage(ax, self, view, slice)
+        self.images.append(overlay_image)
+        return overlay_image
+
+    def name(self, label):
+        return self.names.get(int(label), str(int(label)))
+
+    def find(self, text):
+        '''
+        Returns the label of a number or a (case insensitive) name of the lookup table, or None
+        '''
+        text = text.strip()
+        if text.lstrip('-').isdigit():
+            return int(text)
+        matches = [label for label, name in self.names.items() if name.lower() == text.lower()]
+        return matches[0] if matches else None
+
+    def add_controls(self, fig, blit, sliders):
+        '''
+        Adds the opacity slider and the "jump to label" text box to a viewer figure
+
+        Arguments:
+        fig -- matplotlib figure of the viewer
+        blit -- BlitManager of the figure
+        sliders -- dict of view: slice slider of the displayed views
+        '''
+        axiopacity = fig.add_axes([0.13, 0.955, 0.17, 0.025])
+        sopacity=Slider(ax=axiopacity,
+            label='Opacity ',
+            valmin=0,
+            valmax=1,
+            valinit=self.opacity)
+
+        def update_opacity():
+            self.set_opacity(sopacity.val)
+            return [artist for overlay_image in self.images for artist in overlay_image.redraw()]
+
+        blit.add_slider(sopacity)
+        blit.on_changed(sopacity, update_opacity)
+
+        axilabel = fig.add_axes([0.78, 0.95, 0.12, 0.035])
+        tlabel = TextBox(axilabel, 'Label ')
+
+        def jump(text):
+            label = self.find(text) if text.strip() else None
+            slices = self.index.jump(label) if label is not None else None
+            if slices is None:
+                if text.strip():
+                    print('Label %s is not in the overlay' % text.strip())
+                return
+            print('Label %s: %s' % (self.name(label), ', '.join('%s %d' % (view, slice) for view, slice in slices.items())))
+            for view, slider in sliders.items():
+                slider.set_val(slices[view])
+
+        tlabel.on_submit(jump)
+        # widgets without a reference are garbage collected with their callbacks
+        self.controls = (sopacity, tlabel)
+
+
+class OverlayImage:
+    '''
+    Overlay of the labels of the displayed slice of one view, hidden on empty slices
+
+    Arguments:
+    ax -- matplotlib axes of the slice
+    overlay -- Overlay of the MRI
+    view -- string containing the view (sag, cor or axi)
+    slice -- index of the initial slice
+    '''
+    def __init__(self, ax, overlay, view, slice):
+        self.overlay = overlay
+        self.view = view
+        self.slice = slice
+        xlim, ylim = ax.get_xlim(), ax.get_ylim()
+        self.image = ax.imshow(np.zeros((1, 1, 4), dtype=np.uint8), origin='lower', interpolation='nearest', zorder=2,
+                               aspect=ax.get_aspect())
+        # the empty initial image must not change the limits (nor the pixel aspect) of the slice
+        ax.set_xlim(xlim)
+        ax.set_ylim(ylim)
+        self.show(slice)
+
+    def show(self, slice):
+        '''
+        Displays the labels of a slice
+
+        Returns:
+        artists -- list with the overlay image
+        '''
+        self.slice = int(slice)
+        return self.redraw()
+
+    def redraw(self):
+        image, extent = self.overlay.rgba(self.view, self.slice)
+        self.image.set_visible(image is not None)
+        if image is not None:
+            self.image.set_data(image)
+            self.image.set_extent(extent)
+        return [self.image]
@@ -0,0 +1,303 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Playback of 4D MRIs (e.g. fMRI runs) with a time slider, play/pause button and a preloaded ring buffer of frames'''
+
+import threading
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.widgets import Slider, Button
+from blitting import BlitManager
+from view_slices import VIEWS, VIEW_TITLES, get_slice, windowing, slice_aspect
+
+class FrameBuffer:
+    '''
+    Ring buffer of the frames (displayed slices) of the next volumes of a 4D
+    MRI, filled ahead of the playback position by a background thread. Only
+    `size` frames are kept, so memory does not depend on the number of volumes.
+    Frames are loaded for the current parameters (displayed slices and window),
+    frames of other parameters are stale and loaded again
+
+    Arguments:
+    loader -- function (t, params) returning the frame of volume t
+    n_frames -- number of volumes
+    size -- number of frames kept
+    params -- hashable parameters passed to the loader
+    '''
+    def __init__(self, loader, n_frames, size=32, params=None):
+        self.loader = loader
+        self.n_frames = n_frames
+        self.size = max(1, min(size, n_frames))
+        self.slots = [None] * self.size
+        self.params = params
+        self.position = 0
+        self.hits = 0
+        self.misses = 0
+        self.loaded = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.closed = False
+        self.thread = threading.Thread(target=self._load_loop, daemon=True)
+        self.thread.start()
+
+    def _frame(self, t):
+        # frame of volume t if its slot holds it for the current parameters
+        slot = self.slots[t % self.size]
+        if slot is not None and slot[0] == t and slot[1] == self.params:
+            return slot[2]
+        return None
+
+    def _ahead(self, t):
+        # the buffered volumes are the next `size` ones from the position (looping at the end)
+        return (t - self.position) % self.n_frames < self.size
+
+    def set_params(self, params):
+        '''
+        Changes the loader parameters, making the buffered frames stale
+        '''
+        with self.lock:
+            self.params = params
+            self.wakeup.notify()
+
+    def ready(self, t):
+        '''
+        Checks if the frame of volume t is already loaded
+        '''
+        with self.lock:
+            return self._frame(t) is not None
+
+    def get(self, t):
+        '''
+        Returns the frame of volume t, loading it on a miss
+
+        Arguments:
+        t -- index of the volume
+
+        Returns:
+        frame -- frame returned by the loader
+        '''
+        with self.lock:
+            self.position = t % self.n_frames
+            self.wakeup.notify()
+            params = self.params
+            frame = self._frame(t)
+            if frame is not None:
+                self.hits += 1
+                return frame
+            self.misses += 1
+        frame = self.loader(t, params)
+        with self.lock:
+            if params == self.params:
+                self.slots[t % self.size] = (t, params, frame)
+        return frame
+
+    def _load_loop(self):
+        while True:
+            with self.lock:
+                while not self.closed:
+                    t = next((t % self.n_frames for t in range(self.position, self.position + self.size)
+                              if self._frame(t % self.n_frames) is None), None)
+                    if t is not None:
+                        break
+                    self.wakeup.wait()
+                if self.closed:
+                    return
+                params = self.params
+            frame = self.loader(t, params)
+            with self.lock:
+                if params == self.params and self._ahead(t):
+                    self.slots[t % self.size] = (t, params, frame)
+                    self.loaded += 1
+
+    def close(self):
+        '''
+        Stops the loading thread
+        '''
+        with self.lock:
+            self.closed = True
+            self.wakeup.notify()
+
+    def report(self):
+        '''
+        Returns the statistics of the buffer as a printable line
+        '''
+        with self.lock:
+            requests = self.hits + self.misses
+            hit_rate = 100 * self.hits / requests if requests else 0.0
+            return 'Frame buffer: %d hits, %d misses (hit rate %.0f%%), %d preloaded, %d frames' % (
+                self.hits, self.misses, hit_rate, self.loaded, self.size)
+
+
+def series_slice(mri_data, view, slice, t):
+    '''
+    Extracts a single 2D slice of one volume of a 4D MRI, reading only that slice from array proxies
+
+    Arguments:
+    mri_data --  4D MRI array or array proxy
+    view -- string containing the view (sag, cor or axi)
+    slice -- index of the slice
+    t -- index of the volume
+
+    Returns:
+    mri_slice -- 2D slice of the volume
+    '''
+    key = [np.s_[:]] * 3 + [t]
+    key[VIEWS.index(view)] = slice
+    return np.asarray(mri_data[tuple(key)])
+
+
+def series_frame(mri_data, views, t, slices, window=None):
+    '''
+    Loads the displayed slices of each view for one volume of a 4D MRI
+
+    Arguments:
+    mri_data --  4D MRI array or array proxy
+    views -- list of the displayed views
+    t -- index of the volume
+    slices -- index of the displayed slice of each view
+    window -- (window level, window width) tuple, or None for no windowing
+
+    Returns:
+    frame -- tuple with the 2D slice to display of each view
+    '''
+    frame = []
+    # several views read the volume once instead of one partial read per view
+    volume = np.asarray(mri_data[..., t]) if len(views) > 1 else None
+    for view, slice in zip(views, slices):
+        if volume is None:
+            mri_slice = series_slice(mri_data, view, slice, t)
+        else:
+            mri_slice = get_slice(volume, view, slice)
+        if window is not None:
+            mri_slice = windowing(mri_slice, *window)
+        frame.append(mri_slice.T)
+    return tuple(frame)
+
+
+def play_series(mri_shape, mri_data, views, intensity_range, window=None, buffer_size=32, frame_rate=10, show_fps=False, spacing=None, overlay=None):
+    '''
+    Outputs a figure where the volumes of a 4D MRI can be browsed with a time
+    slider or played, in 1 view or in the 3 views (sagittal, coronal and axial)
+
+    Arguments:
+    mri_shape -- shape of the 4D MRI array
+    mri_data --  4D MRI array or array proxy (volumes are read slice by slice)
+    views -- list of the views to display
+    intensity_range -- (min, max) intensity of the whole series, used for the gray scale of every volume
+    window -- (window level, window width) applied to every volume, or None for no windowing
+    buffer_size -- number of volumes preloaded ahead of the displayed one
+    frame_rate -- playback frames per second
+    show_fps -- shows the frames per second and latency of the updates
+    spacing -- voxel spacing (x, y, z) in mm, sets the aspect of the pixels (None for square pixels)
+    overlay -- Overlay of a 3D label map drawn on top of the slices of every volume (None for no overlay)
+    '''
+    n_volumes = int(mri_shape[3])
+    slices = [int(mri_shape[VIEWS.index(view)])//2 for view in views]
+
+    def loader(t, params):
+        return series_frame(mri_data, views, t, *params)
+
+    buffer = FrameBuffer(loader, n_volumes, buffer_size, (tuple(slices), window))
+    if window is not None:
+        # windowing scales the voxels inside the window to [0, max_window]
+        min_window, max_window = window[0] - window[1]//2, window[0] + window[1]//2
+        vmin, vmax = min(0, min_window), max_window
+    else:
+        vmin, vmax = intensity_range
+
+    plt.style.use('dark_background')
+    fig, axes = plt.subplots(1, len(views), squeeze=False)
+    plt.subplots_adjust(bottom=0.1 + 0.04*len(views))
+    images = []
+    overlay_images = []
+    for ax, view, mri_slice, slice in zip(axes[0], views, buffer.get(0), slices):
+        images.append(ax.imshow(mri_slice, cmap='gray', origin='lower', vmin=vmin, vmax=vmax, aspect=slice_aspect(spacing, view)))
+        if overlay is not None:
+            overlay_images.append(overlay.add_image(ax, view, slice))
+        ax.axis('off')
+    blit = BlitManager(fig, show_fps)
+    for i, image in enumerate(images):
+        if overlay is not None:
+            blit.add_region(image.axes, [image, overlay_images[i].image])
+        else:
+            blit.add_image(image)
+
+    slice_sliders = []
+    for i, view in enumerate(views):
+        axislice = plt.axes([0.25, 0.06 + 0.04*(len(views) - i), 0.65, 0.03])
+        slice_sliders.append(Slider(ax=axislice,
+            label=VIEW_TITLES[view].split()[0] + ' slices ',
+            valmin=0,
+            valmax=int(mri_shape[VIEWS.index(view)])-1,
+            valstep=1,
+            valinit=slices[i]))
+    axitime = plt.axes([0.25, 0.06, 0.65, 0.03])
+    stime=Slider(ax=axitime,
+        label='Volume ',
+        valmin=0,
+        valmax=n_volumes-1,
+        valstep=1,
+        valinit=0)
+    axiplay = plt.axes([0.05, 0.05, 0.1, 0.05])
+    bplay = Button(axiplay, 'Play')
+
+    def show():
+        frame = buffer.get(int(stime.val))
+        for image, mri_slice in zip(images, frame):
+            image.set_data(mri_slice)
+        return images
+
+    def update_slices():
+        buffer.set_params((tuple(int(s.val) for s in slice_sliders), window))
+        # the label map is the same for every volume, it changes only with the slices
+        changed = [artist for overlay_image, slider in zip(overlay_images, slice_sliders)
+                   if overlay_image.slice != int(slider.val) for artist in overlay_image.show(slider.val)]
+        return show() + changed
+
+    for slider in slice_sliders:
+        blit.add_slider(slider)
+        blit.on_changed(slider, update_slices)
+    blit.add_slider(stime)
+    blit.on_changed(stime, show)
+
+    # playback advances only to volumes already preloaded, so a slow
+    # disk lowers the frame rate instead of blocking the figure
+    timer = fig.canvas.new_timer(interval=max(1, int(1000 / frame_rate)))
+    def tick():
+        t = (int(stime.val) + 1) % n_volumes
+        if buffer.ready(t):
+            stime.set_val(t)
+    timer.add_callback(tick)
+
+    playing = [False]
+    def play(event):
+        playing[0] = not playing[0]
+        if playing[0]:
+            bplay.label.set_text('Pause')
+            timer.start()
+        else:
+            bplay.label.set_text('Play')
+            timer.stop()
+        fig.canvas.draw_idle()
+    bplay.on_clicked(play)
+
+    if overlay is not None:
+        overlay.add_controls(fig, blit, dict(zip(views, slice_sliders)))
+    plt.show()
+    timer.stop()
+    buffer.close()
+    print(buffer.report())
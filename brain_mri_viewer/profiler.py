@@ -0,0 +1,250 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Timed spans of the pipeline stages and slider callbacks with memory sampling (--profile)'''
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# the active Profiler, None when profiling is disabled
+_profiler = None
+_NULL = contextlib.nullcontext()
+
+def rss_mb():
+    '''
+    Returns the current resident set size of the process in MB (None if unknown)
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb():
+    '''
+    Returns the peak resident set size of the process in MB (None if unknown)
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if os.uname().sysname == 'Darwin' else peak / 2**10
+
+
+class Span:
+    '''
+    Timed span of a Profiler, used as a context manager
+    '''
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.profiler.push(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        self.profiler.pop(self, duration)
+        return False
+
+
+class Profiler:
+    '''
+    Records timed spans and instant events of every thread, sampling the
+    resident memory at the end of each span and, with tracemalloc, the peak
+    of the Python allocations during the spans of the main thread
+
+    Arguments:
+    trace_path -- Chrome trace JSON file written by report (None for the summary table only)
+    memory -- traces the Python allocations with tracemalloc
+    '''
+    def __init__(self, trace_path=None, memory=True):
+        self.trace_path = trace_path
+        self.memory = memory
+        self.origin = time.perf_counter()
+        self.events = []
+        self.lock = threading.Lock()
+        self.stack = []
+        self.main_thread = threading.main_thread().ident
+        if memory:
+            tracemalloc.start()
+
+    def span(self, name, args):
+        return Span(self, name, args)
+
+    def push(self, span):
+        span.peak = 0
+        if self.memory and threading.get_ident() == self.main_thread:
+            # the peak of the enclosing span is kept before tracking the nested one
+            if self.stack:
+                self.stack[-1].peak = max(self.stack[-1].peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self.stack.append(span)
+
+    def pop(self, span, duration):
+        args = dict(span.args)
+        if self.memory and self.stack and self.stack[-1] is span:
+            current, peak = tracemalloc.get_traced_memory()
+            span.peak = max(span.peak, peak)
+            self.stack.pop()
+            if self.stack:
+                self.stack[-1].peak = max(self.stack[-1].peak, span.peak)
+            args['traced_mb'] = current / 2**20
+            args['traced_peak_mb'] = span.peak / 2**20
+        args['rss_mb'] = rss_mb()
+        self.add(span.name, span.start, duration, args)
+
+    def add(self, name, start, duration, args=None):
+        '''
+        Records a complete event (duration None for an instant event)
+        '''
+        with self.lock:
+            self.events.append((name, start - self.origin, duration, threading.get_ident(), args or {}))
+
+    def summary(self):
+        '''
+        Returns the table of the spans grouped by name (in order of first occurrence) and of the instant events
+        '''
+        groups = {}
+        for name, start, duration, tid, args in sorted(self.events, key=lambda event: event[1]):
+            groups.setdefault(name, []).append((start, duration, args))
+        lines = ['%-28s %6s %10s %10s %10s %10s %9s %9s' % ('span', 'calls', 'first s', 'total ms', 'mean ms', 'max ms', 'peak MB', 'RSS MB')]
+        for name, events in groups.items():
+            durations = [duration for _, duration, _ in events if duration is not None]
+            peaks = [args['traced_peak_mb'] for _, _, args in events if args.get('traced_peak_mb') is not None]
+            rss = [args['rss_mb'] for _, _, args in events if args.get('rss_mb') is not None]
+            if not durations:
+                lines.append('%-28s %6d %10.3f' % (name, len(events), events[0][0]))
+                continue
+            lines.append('%-28s %6d %10.3f %10.1f %10.2f %10.1f %9s %9s' % (
+                name, len(events), events[0][0], 1000 * sum(durations), 1000 * sum(durations) / len(durations),
+                1000 * max(durations), '%.1f' % max(peaks) if peaks else '-', '%.0f' % max(rss) if rss else '-'))
+        peak = peak_rss_mb()
+        if peak is not None:
+            lines.append('Peak RSS: %.0f MB' % peak)
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        '''
+        Returns the events in the Chrome trace event format (chrome://tracing or Perfetto)
+        '''
+        pid = os.getpid()
+        events = []
+        for name, start, duration, tid, args in self.events:
+            event = {'name': name, 'cat': 'brain_mri_viewer', 'ts': 1e6 * start, 'pid': pid, 'tid': tid, 'args': args}
+            if duration is None:
+                event.update(ph='i', s='t')
+            else:
+                event.update(ph='X', dur=1e6 * duration)
+            events.append(event)
+            if args.get('rss_mb') is not None:
+                memory = {'rss_mb': args['rss_mb']}
+                if 'traced_mb' in args:
+                    memory['traced_mb'] = args['traced_mb']
+                events.append({'name': 'memory', 'ph': 'C', 'ts': 1e6 * (start + (duration or 0)), 'pid': pid, 'args': memory})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def report(self):
+        '''
+        Prints the summary table and writes the Chrome trace
+        '''
+        print('\n' + self.summary())
+        if self.trace_path:
+            with open(self.trace_path, 'w') as f:
+                json.dump(self.chrome_trace(), f)
+            print('Chrome trace written to %s' % self.trace_path)
+
+
+def enable(trace_path=None, memory=True):
+    '''
+    Starts profiling (spans are no-ops until it is enabled)
+
+    Arguments:
+    trace_path -- Chrome trace JSON file written by the report
+    memory -- traces the Python allocations with tracemalloc
+
+    Returns:
+    profiler -- the active Profiler
+    '''
+    global _profiler
+    _profiler = Profiler(trace_path, memory)
+    return _profiler
+
+
+def disable():
+    '''
+    Stops profiling and returns the Profiler that was active
+    '''
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None and profiler.memory:
+        tracemalloc.stop()
+    return profiler
+
+
+def span(name, **args):
+    '''
+    Context manager timing a block; a shared no-op context when profiling is disabled
+    '''
+    if _profiler is None:
+        return _NULL
+    return _profiler.span(name, args)
+
+
+def instant(name, **args):
+    '''
+    Records an instant event (e.g. a figure draw)
+    '''
+    if _profiler is not None:
+        _profiler.add(name, time.perf_counter(), None, args)
+
+
+def complete(name, start, duration, **args):
+    '''
+    Records a span measured by the caller (start from time.perf_counter)
+    '''
+    if _profiler is not None:
+        _profiler.add(name, start, duration, args)
+
+
+def profiled(name):
+    '''
+    Decorator timing every call of a function as a span
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _profiler.span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,257 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Maximum, minimum and mean intensity projections (MIP, MinIP and AIP) with sliding slabs'''
+
+from collections import OrderedDict
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.widgets import Slider
+from blitting import BlitManager
+from view_slices import VIEWS, VIEW_TITLES, windowing, window_sliders, slice_aspect
+
+PROJECTIONS = {'mip': np.maximum, 'minip': np.minimum, 'aip': np.add}
+PROJECTION_TITLES = {'mip': 'MIP', 'minip': 'MinIP', 'aip': 'AIP'}
+
+def get_slab(mri_data, view, start, stop):
+    '''
+    Extracts the slices [start, stop) of the MRI in the given view
+
+    Arguments:
+    mri_data --  MRI array (it can be memory-mapped or lazy)
+    view -- string containing the view (sag, cor or axi)
+    start -- index of the first slice
+    stop -- index after the last slice
+
+    Returns:
+    mri_slab -- 3D array with the slices along the view axis
+    '''
+    key = [np.s_[:]] * 3
+    key[VIEWS.index(view)] = np.s_[start:stop]
+    return np.asarray(mri_data[tuple(key)])
+
+
+def projection(mri_data, view, mode='mip', slab=16):
+    '''
+    Projects the whole MRI along the axis of a view, reducing blocks of slab
+    slices at a time so memory-mapped or lazy MRIs are never loaded at once
+
+    Arguments:
+    mri_data --  MRI array (it can be memory-mapped or lazy)
+    view -- string containing the view (sag, cor or axi)
+    mode -- mip, minip or aip
+    slab -- number of slices reduced at a time
+
+    Returns:
+    mri_projection -- 2D projection (float64 for aip, the MRI dtype otherwise)
+    '''
+    ufunc = PROJECTIONS[mode]
+    axis = VIEWS.index(view)
+    n = mri_data.shape[axis]
+    mri_projection = None
+    for start in range(0, n, slab):
+        mri_slab = get_slab(mri_data, view, start, start + slab)
+        block = ufunc.reduce(mri_slab, axis=axis, dtype=np.float64 if mode == 'aip' else None)
+        mri_projection = block if mri_projection is None else ufunc(mri_projection, block, out=mri_projection)
+    if mode == 'aip':
+        mri_projection /= n
+    return mri_projection
+
+
+class SlidingProjection:
+    '''
+    Projections of slabs of fixed thickness k along the axis of a view
+    (van Herk/Gil-Werman): the slices are split in blocks of k, and the
+    prefix and suffix reductions of each block are computed once. Any slab
+    [i, i+k) then overlaps at most 2 blocks and is the reduction of one
+    suffix and one prefix slice, so moving the slab by one slice costs O(slice)
+    and crossing a block costs O(k) slices, instead of O(k) slices per move
+
+    Arguments:
+    mri_data --  MRI array (it can be memory-mapped or lazy)
+    view -- string containing the view (sag, cor or axi)
+    mode -- mip, minip or aip
+    thickness -- number of slices of the slab
+    max_blocks -- number of blocks kept in memory
+    '''
+    def __init__(self, mri_data, view, mode='mip', thickness=1, max_blocks=3):
+        self.mri_data = mri_data
+        self.view = view
+        self.mode = mode
+        self.ufunc = PROJECTIONS[mode]
+        self.axis = VIEWS.index(view)
+        self.n = mri_data.shape[self.axis]
+        self.k = max(1, min(int(thickness), self.n))
+        self.max_blocks = max_blocks
+        self.blocks = OrderedDict()
+
+    def block(self, b):
+        '''
+        Returns the (prefix, suffix) reductions of block b, slices on the first axis
+        '''
+        if b in self.blocks:
+            self.blocks.move_to_end(b)
+            return self.blocks[b]
+        mri_slab = get_slab(self.mri_data, self.view, b * self.k, (b + 1) * self.k)
+        mri_slab = np.moveaxis(mri_slab, self.axis, 0)
+        if self.mode == 'aip':
+            mri_slab = mri_slab.astype(np.float64)
+        prefix = self.ufunc.accumulate(mri_slab, axis=0)
+        suffix = self.ufunc.accumulate(mri_slab[::-1], axis=0)[::-1]
+        self.blocks[b] = (prefix, suffix)
+        while len(self.blocks) > self.max_blocks:
+            self.blocks.popitem(last=False)
+        return prefix, suffix
+
+    def get(self, start):
+        '''
+        Returns the projection of the slab of slices [start, start + thickness) (clipped to the MRI)
+
+        Arguments:
+        start -- index of the first slice of the slab
+
+        Returns:
+        mri_projection -- 2D projection (the mean for aip)
+        '''
+        low = max(0, min(int(start), self.n - 1))
+        high = min(low + self.k, self.n) - 1
+        b = low // self.k
+        prefix, suffix = self.block(b)
+        mri_projection = suffix[low - b * self.k]
+        if high >= (b + 1) * self.k:
+            next_prefix, next_suffix = self.block(b + 1)
+            mri_projection = self.ufunc(mri_projection, next_prefix[high - (b + 1) * self.k])
+        if self.mode == 'aip':
+            mri_projection = mri_projection / (high - low + 1)
+        return mri_projection
+
+
+def view_projection(mri_shape, mri_data, views, mode='mip', intensity_range=None, window=None, show_fps=False, spacing=None, overlay=None):
+    '''
+    Outputs a figure with the intensity projections of 1 view or of the 3 views
+    (sagittal, coronal and axial), with a slab thickness slider for sliding-slab
+    projections and the windowing sliders when a window is given
+
+    Arguments:
+    mri_shape -- shape of the MRI array
+    mri_data --  MRI array (it can be memory-mapped or lazy)
+    views -- list of the views to display
+    mode -- mip, minip or aip
+    intensity_range -- (min, max) intensity of the MRI, range of the windowing sliders
+    window -- initial (window level, window width), or None for no windowing
+    show_fps -- shows the frames per second and latency of the slider updates
+    spacing -- voxel spacing (x, y, z) in mm, sets the aspect of the pixels (None for square pixels)
+    overlay -- Overlay of a label map, the labels of the center slice of each slab are drawn on top (None for no overlay)
+    '''
+    max_thickness = int(max(mri_shape[VIEWS.index(view)] for view in views))
+    sliding = {view: SlidingProjection(mri_data, view, mode, max_thickness) for view in views}
+    full = {}
+
+    def display(view, start, window):
+        if sliding[view].k >= mri_shape[VIEWS.index(view)]:
+            # the whole MRI is projected once, block by block
+            if view not in full:
+                full[view] = projection(mri_data, view, mode)
+            mri_projection = full[view]
+        else:
+            mri_projection = sliding[view].get(start)
+        if window is not None:
+            mri_projection = windowing(mri_projection, *window)
+        return mri_projection.T
+
+    def center(view, start):
+        # center slice of the slab [start, start + thickness) clipped to the MRI
+        n = int(mri_shape[VIEWS.index(view)])
+        low = max(0, min(int(start), n - 1))
+        return (low + min(low + sliding[view].k, n) - 1) // 2
+
+    plt.style.use('dark_background')
+    fig, axes = plt.subplots(1, len(views), squeeze=False)
+    plt.subplots_adjust(left=0.25 if len(views) == 1 else 0.1, bottom=0.1 + 0.04*len(views))
+    images = []
+    overlay_images = []
+    for ax, view in zip(axes[0], views):
+        vmin, vmax = intensity_range if window is None and intensity_range is not None else (None, None)
+        images.append(ax.imshow(display(view, 0, window), cmap='gray', origin='lower', vmin=vmin, vmax=vmax,
+                                aspect=slice_aspect(spacing, view)))
+        if overlay is not None:
+            overlay_images.append(overlay.add_image(ax, view, center(view, 0)))
+        ax.set_title(PROJECTION_TITLES[mode] + ' ' + VIEW_TITLES[view].split()[0].lower())
+        ax.axis('off')
+    blit = BlitManager(fig, show_fps)
+    for i, image in enumerate(images):
+        if overlay is not None:
+            blit.add_region(image.axes, [image, overlay_images[i].image])
+        else:
+            blit.add_image(image)
+
+    slab_sliders = []
+    for i, view in enumerate(views):
+        axislab = plt.axes([0.25, 0.06 + 0.04*(len(views) - i), 0.65, 0.03])
+        slab_sliders.append(Slider(ax=axislab,
+            label=VIEW_TITLES[view].split()[0] + ' slab ',
+            valmin=0,
+            valmax=int(mri_shape[VIEWS.index(view)])-1,
+            valstep=1,
+            valinit=0))
+    axithickness = plt.axes([0.25, 0.06, 0.65, 0.03])
+    sthickness=Slider(ax=axithickness,
+        label='Slab thickness ',
+        valmin=1,
+        valmax=max_thickness,
+        valstep=1,
+        valinit=max_thickness)
+
+    swidth, slevel = (None, None)
+    if window is not None:
+        swidth, slevel = window_sliders(window, intensity_range, 0.05 if len(views) > 1 else 0.1, 0.92 if len(views) > 1 else 0.2)
+
+    def current_window():
+        if swidth is None:
+            return None
+        return (np.around(slevel.val), np.around(swidth.val))
+
+    def update_view(i):
+        def update():
+            images[i].set_data(display(views[i], int(slab_sliders[i].val), current_window()))
+            if overlay is not None:
+                return [images[i]] + overlay_images[i].show(center(views[i], slab_sliders[i].val))
+            return [images[i]]
+        return update
+
+    def update_all():
+        return [artist for i in range(len(views)) for artist in update_view(i)()]
+
+    def update_thickness():
+        # slabs of a new thickness need new blocks
+        for view in views:
+            sliding[view] = SlidingProjection(mri_data, view, mode, int(sthickness.val))
+        return update_all()
+
+    for i, slider in enumerate(slab_sliders):
+        blit.add_slider(slider)
+        blit.on_changed(slider, update_view(i))
+    blit.add_slider(sthickness)
+    blit.on_changed(sthickness, update_thickness)
+    for slider in (swidth, slevel):
+        if slider is not None:
+            blit.add_slider(slider)
+            blit.on_changed(slider, update_all)
+
+    if overlay is not None:
+        overlay.add_controls(fig, blit, dict(zip(views, slab_sliders)))
+    plt.show()
@@ -0,0 +1,144 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Multi-resolution pyramid of an MRI (2x block mean levels) for responsive display of large volumes'''
+
+import os
+import threading
+import numpy as np
+
+def block_mean(mri_data, factor):
+    '''
+    Downsamples the 3D MRI by the mean of factor^3 blocks, reading factor
+    slices at a time so that lazy or memory-mapped MRIs are never loaded at once.
+    Partial blocks at the borders are padded with the edge voxels
+
+    Arguments:
+    mri_data --  3D MRI array (it can be memory-mapped or lazy)
+    factor -- downsampling factor
+
+    Returns:
+    mri_level -- float32 downsampled MRI array
+    '''
+    shape = [-(-n // factor) for n in mri_data.shape[:3]]
+    mri_level = np.empty(shape, dtype=np.float32)
+    for i in range(shape[0]):
+        mri_slab = np.asarray(mri_data[i*factor:(i+1)*factor], dtype=np.float32)
+        pad = [(0, s * factor - n) for s, n in zip([1] + shape[1:], mri_slab.shape)]
+        if any(after for before, after in pad):
+            mri_slab = np.pad(mri_slab, pad, mode='edge')
+        mri_level[i] = mri_slab.reshape(factor, shape[1], factor, shape[2], factor).mean(axis=(0, 2, 4))
+    return mri_level
+
+
+class Pyramid:
+    '''
+    2x downsampled levels of a 3D MRI built on first open. Only the levels
+    with no dimension above max_size are kept, so memory scales with the
+    display size instead of the volume size; the first kept level is built
+    from the MRI in one streamed pass and the coarser ones from it.
+    Level 0 is the MRI itself
+
+    Arguments:
+    mri_data --  3D MRI array (it can be memory-mapped or lazy)
+    max_size -- largest dimension of the finest kept level
+    min_size -- the coarsest level has no dimension below it
+    background -- builds the levels in a background thread
+    path -- .npz file where the levels are persisted (loaded if it matches the MRI)
+    source -- NifTi file of the MRI, persisted levels older than it are rebuilt
+    '''
+    def __init__(self, mri_data, max_size=512, min_size=32, background=True, path=None, source=None):
+        self.mri_data = mri_data
+        self.shape = tuple(mri_data.shape[:3])
+        self.max_size = max_size
+        self.min_size = min_size
+        self.path = path
+        self.source = source
+        self.levels = {0: mri_data}
+        self.ready = threading.Event()
+        if path is not None and self.load(path):
+            self.ready.set()
+        elif background:
+            threading.Thread(target=self.build, daemon=True).start()
+        else:
+            self.build()
+
+    def build(self):
+        '''
+        Builds the downsampled levels (and persists them if a path was given)
+        '''
+        level = 1
+        while max(self.shape) / 2**level > self.max_size:
+            level += 1
+        mri_level = block_mean(self.mri_data, 2**level)
+        while True:
+            self.levels[level] = mri_level
+            if max(mri_level.shape) // 2 < self.min_size or min(mri_level.shape) < 2:
+                break
+            mri_level = block_mean(mri_level, 2)
+            level += 1
+        if self.path is not None:
+            self.save(self.path)
+        self.ready.set()
+
+    def save(self, path):
+        '''
+        Persists the downsampled levels to a .npz file
+        '''
+        levels = {'level_%d' % level: mri_level for level, mri_level in self.levels.items() if level > 0}
+        tmp_path = path + '.tmp%d.npz' % os.getpid()
+        np.savez(tmp_path, shape=np.asarray(self.shape), **levels)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        '''
+        Loads persisted levels if they were built from an MRI of the same shape
+        '''
+        try:
+            if self.source is not None and os.path.getmtime(path) < os.path.getmtime(self.source):
+                return False
+            with np.load(path) as saved:
+                if tuple(saved['shape']) != self.shape:
+                    return False
+                for name in saved.files:
+                    if name.startswith('level_'):
+                        self.levels[int(name[6:])] = saved[name]
+        except (OSError, ValueError, KeyError):
+            return False
+        return len(self.levels) > 1
+
+    def level_for(self, slice_shape, screen_size):
+        '''
+        Returns the coarsest available level that still has at least one voxel
+        per screen pixel when the slice is fitted (keeping its aspect ratio) in
+        the screen size, or 0 (full resolution) while the levels are being built
+
+        Arguments:
+        slice_shape -- (rows, columns) of the full resolution slice
+        screen_size -- (width, height) in pixels of the axes where it is displayed
+
+        Returns:
+        level -- pyramid level
+        '''
+        best = 0
+        if not self.ready.is_set():
+            return best
+        scale = min(screen_size[0] / slice_shape[1], screen_size[1] / slice_shape[0])
+        for level in sorted(self.levels):
+            if level and 2**level * scale <= 1:
+                best = level
+        return best
@@ -0,0 +1,189 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Direct slice to PNG/PPM rasterizer, without matplotlib figures'''
+
+import functools
+import io
+import struct
+import zlib
+import numpy as np
+from view_slices import VIEWS, get_slice, montage_slices, windowing, slice_spacing
+from resample import resample_slice
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+def to_uint8(mri_slice, wl=None, ww=None, vmin=None, vmax=None):
+    '''
+    Converts a 2D slice to an 8 bits image oriented as in the viewers
+    (transposed, origin at the bottom) and scaled to its min/max as imshow does
+
+    Arguments:
+    mri_slice -- 2D slice of the MRI array
+    wl -- window level (no windowing if None)
+    ww -- window width
+    vmin -- intensity mapped to 0 (default: min of the slice)
+    vmax -- intensity mapped to 255 (default: max of the slice)
+
+    Returns:
+    image -- 2D uint8 array, row 0 at the top
+    '''
+    mri_slice = np.asarray(mri_slice)
+    if wl is not None:
+        mri_slice = windowing(mri_slice, wl, ww)
+    image = np.empty(mri_slice.shape, dtype=np.float64)
+    if vmin is None:
+        vmin = np.min(mri_slice) if mri_slice.size else 0
+    if vmax is None:
+        vmax = np.max(mri_slice) if mri_slice.size else 0
+    np.subtract(mri_slice, vmin, out=image)
+    if vmax > vmin:
+        image *= 255.999 / (vmax - vmin)
+        np.clip(image, 0, 255, out=image)
+    else:
+        image[:] = 0
+    return image.astype(np.uint8).T[::-1]
+
+
+@functools.lru_cache(maxsize=16)
+def colormap_lut(cmap='gray'):
+    '''
+    Returns the 256 entries RGB table of a matplotlib colormap (no figure is created)
+
+    Arguments:
+    cmap -- colormap name
+
+    Returns:
+    lut -- (256, 3) uint8 array
+    '''
+    if cmap == 'gray':
+        return np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1)
+    import matplotlib
+    colors = matplotlib.colormaps[cmap](np.linspace(0, 1, 256))[:, :3]
+    return np.round(colors * 255).astype(np.uint8)
+
+
+def rasterize(mri_slice, wl=None, ww=None, cmap='gray'):
+    '''
+    Rasterizes a 2D slice to grayscale (cmap='gray') or colormapped RGB
+
+    Arguments:
+    mri_slice -- 2D slice of the MRI array
+    wl -- window level (no windowing if None)
+    ww -- window width
+    cmap -- colormap name
+
+    Returns:
+    image -- (H, W) uint8 array for gray, (H, W, 3) uint8 array otherwise
+    '''
+    image = to_uint8(mri_slice, wl, ww)
+    if cmap == 'gray':
+        return image
+    return colormap_lut(cmap)[image]
+
+
+def montage_image(mri_data, mri_shape, nslices=1, wl=None, ww=None, cmap='gray', spacing=None):
+    '''
+    Rasterizes the mid slices (or a grid of nslices per view) of the MRI, one view per row
+
+    Arguments:
+    mri_data --  MRI array
+    mri_shape -- shape of the MRI array
+    nslices -- number of slices per view
+    wl -- window level (no windowing if None)
+    ww -- window width
+    cmap -- colormap name
+    spacing -- voxel spacing (x, y, z) in mm, anisotropic slices are resampled to square pixels (None for one pixel per voxel)
+
+    Returns:
+    image -- uint8 montage image
+    '''
+    def tile(view, slice):
+        mri_slice = get_slice(mri_data, view, slice)
+        if spacing is not None:
+            mri_slice = resample_slice(mri_slice, slice_spacing(spacing, view))
+        return rasterize(mri_slice, wl, ww, cmap)
+
+    tiles = [[tile(view, slice) for slice in montage_slices(mri_shape, view, nslices)] for view in VIEWS]
+    if nslices == 1:
+        tiles = [[row[0] for row in tiles]]
+    height = max(tile.shape[0] for row in tiles for tile in row)
+    width = max(tile.shape[1] for row in tiles for tile in row)
+    image = np.zeros((height * len(tiles), width * len(tiles[0])) + tiles[0][0].shape[2:], dtype=np.uint8)
+    for i, row in enumerate(tiles):
+        for j, tile in enumerate(row):
+            # tiles are centered in their cell
+            top = i * height + (height - tile.shape[0]) // 2
+            left = j * width + (width - tile.shape[1]) // 2
+            image[top:top+tile.shape[0], left:left+tile.shape[1]] = tile
+    return image
+
+
+def png_chunk(tag, data):
+    '''
+    Builds one PNG chunk (length, tag, data and CRC)
+    '''
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+
+def encode_png(image, compress_level=3):
+    '''
+    Encodes a uint8 gray (H, W) or RGB (H, W, 3) image as PNG, with Pillow
+    when it is available or directly with zlib otherwise
+
+    Arguments:
+    image -- uint8 image
+    compress_level -- zlib compression level (0-9)
+
+    Returns:
+    png -- PNG file content (bytes)
+    '''
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    if Image is not None:
+        buffer = io.BytesIO()
+        Image.fromarray(image).save(buffer, format='PNG', compress_level=compress_level)
+        return buffer.getvalue()
+
+    height, width = image.shape[:2]
+    color_type = 2 if image.ndim == 3 else 0
+    # every scanline starts with filter type 0 (none)
+    raw = np.zeros((height, 1 + image[0].size), dtype=np.uint8)
+    raw[:, 1:] = image.reshape(height, -1)
+    header = struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', header)
+            + png_chunk(b'IDAT', zlib.compress(raw.tobytes(), compress_level)) + png_chunk(b'IEND', b''))
+
+
+def encode_ppm(image):
+    '''
+    Encodes a uint8 gray (PGM) or RGB (PPM) image in binary netpbm format
+    '''
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    magic = b'P6' if image.ndim == 3 else b'P5'
+    return magic + b'\n%d %d\n255\n' % (image.shape[1], image.shape[0]) + image.tobytes()
+
+
+def write_image(path, image):
+    '''
+    Writes a uint8 image to PNG, or to PPM/PGM depending on the file extension
+    '''
+    data = encode_ppm(image) if path.endswith(('.ppm', '.pgm')) else encode_png(image)
+    with open(path, 'wb') as f:
+        f.write(data)
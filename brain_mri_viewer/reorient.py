@@ -0,0 +1,170 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import numpy as np
+from nibabel.orientations import io_orientation, axcodes2ornt, ornt_transform, apply_orientation, inv_ornt_aff
+
+RAS = axcodes2ornt(('R', 'A', 'S'))
+
+def ras_transform(mri_affine):
+    '''
+    Computes the orientation transform from the MRI's voxel axes to RAS
+
+    Arguments:
+    mri_affine -- affine matrix
+
+    Returns:
+    transform -- (3, 2) array, row i holds the RAS axis of voxel axis i and whether it is flipped (-1)
+    '''
+    return ornt_transform(io_orientation(mri_affine), RAS)
+
+
+def ras_affine(mri_affine, mri_shape):
+    '''
+    Computes the affine matrix of the MRI once it is reoriented to RAS
+
+    Arguments:
+    mri_affine -- affine matrix
+    mri_shape -- shape of the MRI array before reorientation
+
+    Returns:
+    affine -- affine matrix of the RAS array
+    '''
+    transform = ras_transform(mri_affine)
+    return mri_affine.dot(inv_ornt_aff(transform, mri_shape[:3]))
+
+
+def voxel_spacing(mri_affine):
+    '''
+    Computes the voxel spacing of each array axis from an affine matrix (the
+    pixdim of the header for the spatial axes)
+
+    Arguments:
+    mri_affine -- affine matrix
+
+    Returns:
+    spacing -- (3,) array of the voxel size in mm along each array axis
+    '''
+    return np.sqrt(np.sum(np.asarray(mri_affine)[:3, :3] ** 2, axis=0))
+
+
+def ras_shape(mri_affine, mri_shape):
+    '''
+    Computes the shape of the MRI once it is reoriented to RAS, from the header only
+
+    Arguments:
+    mri_affine -- affine matrix
+    mri_shape -- shape of the MRI array before reorientation
+
+    Returns:
+    shape -- shape tuple of the RAS array (extra dimensions are kept last)
+    '''
+    shape = list(mri_shape)
+    for axis, (ras_axis, _) in enumerate(ras_transform(mri_affine)):
+        shape[int(ras_axis)] = mri_shape[axis]
+    return tuple(int(n) for n in shape)
+
+
+def reorient_to_ras(mri_data, mri_affine):
+    '''
+    Reorients the MRI to RAS for any of the 48 axis orientations without copying data.
+    Arrays are returned as strided views, other array-like objects (e.g. the
+    nibabel dataobj proxy) are wrapped so that only the requested slices are read
+
+    Arguments:
+    mri_data --  MRI array or array proxy
+    mri_affine -- affine matrix
+
+    Returns:
+    mri_data --  MRI array (or proxy) in RAS coordinate system
+    '''
+    transform = ras_transform(mri_affine)
+    if np.array_equal(transform, RAS):
+        return mri_data
+    if isinstance(mri_data, np.ndarray):
+        return apply_orientation(mri_data, transform)
+    return ReorientedProxy(mri_data, transform)
+
+
+class ReorientedProxy:
+    '''
+    Lazy RAS view of an array proxy: indexing is translated to the source
+    axes, so nothing is read until a slice is requested
+
+    Arguments:
+    proxy -- array-like object supporting basic indexing (int and slices)
+    transform -- orientation transform from ras_transform
+    '''
+    def __init__(self, proxy, transform):
+        self.proxy = proxy
+        self.transform = np.asarray(transform, dtype=int)
+        src_shape = tuple(proxy.shape)
+        shape = list(src_shape)
+        for src_axis, (axis, flip) in enumerate(self.transform):
+            shape[axis] = src_shape[src_axis]
+        self.src_shape = src_shape
+        self.shape = tuple(shape)
+        self.ndim = len(shape)
+        self.dtype = proxy.dtype
+
+    def __array__(self, dtype=None, copy=None):
+        data = apply_orientation(np.asanyarray(self.proxy), self.transform)
+        return data if dtype is None else data.astype(dtype)
+
+    def __getitem__(self, key):
+        key = expand_key(key, self.ndim)
+        src_key = list(key)
+        for src_axis, (axis, flip) in enumerate(self.transform):
+            src_key[src_axis] = key[axis]
+            if flip == -1:
+                src_key[src_axis] = flip_index(key[axis], self.src_shape[src_axis])
+        data = np.asanyarray(self.proxy[tuple(src_key)])
+
+        # remaining (not int-indexed) source axes are put in RAS order
+        out_axes = [self.transform[i, 0] if i < len(self.transform) else i
+                    for i in range(self.ndim) if not isinstance(src_key[i], (int, np.integer))]
+        return data.transpose(np.argsort(out_axes))
+
+
+def expand_key(key, ndim):
+    '''
+    Expands an index (ints, slices and one Ellipsis) to one entry per axis
+    '''
+    if not isinstance(key, tuple):
+        key = (key,)
+    if any(k is Ellipsis for k in key):
+        i = [k is Ellipsis for k in key].index(True)
+        key = key[:i] + (slice(None),) * (ndim - len(key) + 1) + key[i+1:]
+    key = key + (slice(None),) * (ndim - len(key))
+    for k in key:
+        if not isinstance(k, (int, np.integer, slice)):
+            raise IndexError('only integers, slices and Ellipsis are supported')
+    return key
+
+
+def flip_index(k, n):
+    '''
+    Maps an int or slice index along an axis of length n to the reversed axis
+    '''
+    if isinstance(k, slice):
+        r = range(*k.indices(n))
+        r = range(n - 1 - r.start, n - 1 - r.stop, -r.step)
+        if len(r) == 0:
+            return slice(0, 0)
+        return slice(r.start, r.stop if r.stop >= 0 else None, r.step)
+    k = int(k)
+    return n - 1 - (k + n if k < 0 else k)
@@ -0,0 +1,110 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Resampling of the slices of anisotropic MRIs to square pixels, one slice at a time'''
+
+import functools
+import numpy as np
+from slice_cache import SliceCache
+from view_slices import VIEWS, get_slice, slice_spacing
+
+@functools.lru_cache(maxsize=64)
+def linear_weights(n_in, n_out):
+    '''
+    Computes the linear interpolation of one axis resampled from n_in to n_out
+    samples (pixel centers aligned, edges clamped)
+
+    Arguments:
+    n_in -- number of input samples
+    n_out -- number of output samples
+
+    Returns:
+    i0 -- index of the lower neighbour of each output sample
+    i1 -- index of the upper neighbour of each output sample
+    w -- float32 weight of the upper neighbour
+    '''
+    x = np.clip((np.arange(n_out) + 0.5) * (n_in / n_out) - 0.5, 0, n_in - 1)
+    i0 = np.floor(x).astype(np.intp)
+    i1 = np.minimum(i0 + 1, n_in - 1)
+    return i0, i1, (x - i0).astype(np.float32)
+
+
+def isotropic_shape(shape, spacing, pixel=None):
+    '''
+    Computes the shape of a 2D slice resampled to square pixels
+
+    Arguments:
+    shape -- shape of the slice
+    spacing -- voxel spacing in mm of the 2 axes of the slice
+    pixel -- pixel size in mm of the output (default: the smallest spacing)
+
+    Returns:
+    shape -- shape of the resampled slice
+    '''
+    pixel = pixel or min(spacing)
+    return tuple(max(1, int(round(n * s / pixel))) for n, s in zip(shape, spacing))
+
+
+def resample_slice(mri_slice, spacing, pixel=None):
+    '''
+    Resamples a 2D slice to square pixels with separable linear interpolation:
+    each axis is a gather of 2 rows (or columns) and a lerp, so the work is
+    proportional to the size of the output slice
+
+    Arguments:
+    mri_slice -- 2D slice of the MRI array
+    spacing -- voxel spacing in mm of the 2 axes of the slice
+    pixel -- pixel size in mm of the output (default: the smallest spacing)
+
+    Returns:
+    mri_slice -- float32 resampled slice (the input as float32 if it is already isotropic)
+    '''
+    mri_slice = np.asarray(mri_slice, dtype=np.float32)
+    shape = isotropic_shape(mri_slice.shape, spacing, pixel)
+    # the axis that shrinks most is resampled first, so the second pass has less to read
+    for axis in sorted(range(2), key=lambda axis: shape[axis] / mri_slice.shape[axis]):
+        if shape[axis] == mri_slice.shape[axis]:
+            continue
+        i0, i1, w = linear_weights(mri_slice.shape[axis], shape[axis])
+        lower = np.take(mri_slice, i0, axis=axis)
+        upper = np.take(mri_slice, i1, axis=axis)
+        upper -= lower
+        upper *= w[:, None] if axis == 0 else w
+        lower += upper
+        mri_slice = lower
+    return mri_slice
+
+
+def isotropic_cache(mri_data, spacing, max_mb=64, pixel=None):
+    '''
+    Creates a SliceCache of the slices resampled to square pixels: each slice
+    is resampled when it is first requested and kept while it fits in the
+    memory budget, so the MRI is never resampled as a whole
+
+    Arguments:
+    mri_data -- MRI array in RAS coordinate system (it can be memory-mapped or lazy)
+    spacing -- voxel spacing (x, y, z) in mm of the RAS array
+    max_mb -- memory budget in MB of the resampled slices
+    pixel -- pixel size in mm of the output (default: the smallest spacing of each view)
+
+    Returns:
+    cache -- SliceCache whose get(view, slice) returns the float32 resampled slice
+    '''
+    def loader(view, slice, window, level):
+        return resample_slice(get_slice(mri_data, view, slice), slice_spacing(spacing, view), pixel)
+
+    return SliceCache(loader, dict(zip(VIEWS, mri_data.shape[:3])), max_mb * 2**20, prefetch=0)
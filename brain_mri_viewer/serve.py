@@ -0,0 +1,377 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Local HTTP server of windowed slices (PNG or raw uint8) of the NifTi files of a directory'''
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+
+FORMATS = {'png': 'image/png', 'raw': 'application/octet-stream'}
+REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+class HTTPError(Exception):
+    '''
+    Error answered to the client with its HTTP status
+    '''
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def load_volume(path, volume=None):
+    '''
+    Loads a NifTi file with the MRI pipeline of the viewer (memory-mapped
+    in its native dtype when possible and reoriented to RAS)
+
+    Arguments:
+    path -- NifTi file path
+    volume -- volume to load if the MRI contains more than 1 (default: 0)
+
+    Returns:
+    mri -- MRI object with mri_data, mri_shape and the intensity statistics
+    '''
+    import nibabel as nib
+    from brain_mri_viewer import MRI
+
+    mri = MRI(nib.load(path))
+    if len(mri.mri.shape) == 4:
+        volume = volume or 0
+        if not 0 <= volume < mri.mri.shape[3]:
+            raise HTTPError(400, 'volume %d out of range [0, %d]' % (volume, mri.mri.shape[3] - 1))
+    else:
+        volume = None
+    mri.extract_info(volume, lazy=True)
+    mri.check_coord()
+    # slices resampled to square pixels are cached with the MRI, and evicted with it
+    from resample import isotropic_cache
+    mri.isotropic = isotropic_cache(mri.mri_data, mri.mri_spacing)
+    return mri
+
+
+def volume_nbytes(mri):
+    '''
+    Returns the memory charged to a cached MRI: its array plus the slices
+    resampled to square pixels so far. A memory-mapped array is charged its
+    whole size (the size of the file), the most it can keep resident
+    '''
+    resampled = getattr(mri, 'isotropic', None)
+    return mri.mri_data.nbytes + (resampled.nbytes if resampled is not None else 0)
+
+
+class VolumeCache:
+    '''
+    In-process cache of the loaded MRIs shared by all the requests, evicting
+    the least recently used ones beyond a memory budget. Each MRI is loaded
+    once: concurrent requests of an MRI being loaded wait for the same load.
+    The budget counts the arrays (memory-mapped ones by their file size) and
+    the resampled slices cached with each MRI
+
+    Arguments:
+    loader -- function (path, volume) returning the MRI object
+    executor -- thread pool where the files are stat'ed and the MRIs are loaded
+    max_mb -- memory budget in MB (the last used MRI is always kept)
+    '''
+    def __init__(self, loader, executor, max_mb=1024):
+        self.loader = loader
+        self.executor = executor
+        self.max_bytes = max_mb * 2**20
+        self.volumes = OrderedDict()
+        self.loading = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, path, volume=None):
+        '''
+        Returns the MRI of a file, loading it in the thread pool on a miss
+
+        Arguments:
+        path -- NifTi file path
+        volume -- volume if the MRI contains more than 1
+
+        Returns:
+        mri -- MRI object
+        '''
+        loop = asyncio.get_running_loop()
+        # the event loop does not wait for the disk, even to stat the file
+        stat = await loop.run_in_executor(self.executor, os.stat, path)
+        key = (path, stat.st_mtime_ns, volume)
+        if key in self.volumes:
+            self.volumes.move_to_end(key)
+            self.hits += 1
+            self.evict()
+            return self.volumes[key]
+        if key in self.loading:
+            self.hits += 1
+            return await asyncio.shield(self.loading[key])
+
+        self.misses += 1
+        future = loop.run_in_executor(self.executor, self.loader, path, volume)
+        self.loading[key] = future
+        try:
+            mri = await future
+        finally:
+            del self.loading[key]
+        # older versions of a modified file are dropped
+        for old in [old for old in self.volumes if old[0] == path and old[2] == volume]:
+            del self.volumes[old]
+        self.volumes[key] = mri
+        self.evict()
+        return mri
+
+    def evict(self):
+        '''
+        Drops the least recently used MRIs beyond the memory budget. The sizes
+        are summed again because the resampled slices of an MRI grow as its
+        slices are requested
+        '''
+        self.nbytes = sum(volume_nbytes(mri) for mri in self.volumes.values())
+        while self.nbytes > self.max_bytes and len(self.volumes) > 1:
+            _, evicted = self.volumes.popitem(last=False)
+            self.nbytes -= volume_nbytes(evicted)
+
+
+def render_slice(mri, view, index, window, format='png', isotropic=False):
+    '''
+    Renders one windowed slice of an MRI, oriented as in the viewers
+
+    Arguments:
+    mri -- MRI object
+    view -- string containing the view (sag, cor or axi)
+    index -- index of the slice
+    window -- (window level, window width) tuple
+    format -- png or raw (uint8 pixels, row 0 at the top)
+    isotropic -- resamples anisotropic slices to square pixels (cached per slice)
+
+    Returns:
+    body -- bytes of the image
+    shape -- (rows, columns) of the image
+    '''
+    from view_slices import get_slice
+    from rasterizer import to_uint8, encode_png
+
+    wl, ww = window
+    # the windowing kernel maps the window to [min(0, lower bound), upper bound]
+    min_window, max_window = wl - ww // 2, wl + ww // 2
+    mri_slice = mri.isotropic.get(view, index) if isotropic else get_slice(mri.mri_data, view, index)
+    image = to_uint8(mri_slice, wl, ww, min(0, min_window), max_window)
+    body = encode_png(image, compress_level=1) if format == 'png' else np.ascontiguousarray(image).tobytes()
+    return body, image.shape
+
+
+class SliceServer:
+    '''
+    asyncio HTTP/1.1 server (keep-alive) of the slices of the NifTi files under a
+    root directory. MRIs are loaded once into a shared VolumeCache, slices are
+    rendered in a thread pool so the event loop only parses requests, and every
+    response has an ETag (the file version and the request parameters) so
+    conditional requests are answered with 304 without loading or rendering.
+
+    GET /files -- JSON list of the NifTi files
+    GET /info?file=F[&volume=T] -- JSON shape, dtype, intensity range and default window
+    GET /slice?file=F&axis={sag,cor,axi}&index=I[&level=L&width=W&format={png,raw}&volume=T&isotropic=1]
+
+    Arguments:
+    root -- directory of the NifTi files served
+    cache_mb -- memory budget in MB of the loaded MRIs
+    workers -- number of threads loading MRIs and rendering slices
+    '''
+    def __init__(self, root, cache_mb=1024, workers=None):
+        self.root = os.path.realpath(root)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.cache = VolumeCache(load_volume, self.executor, cache_mb)
+        self.requests = 0
+
+    def resolve(self, file):
+        '''
+        Returns the path of a file under the root, refusing paths outside it
+        '''
+        path = os.path.realpath(os.path.join(self.root, file))
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+            raise HTTPError(404, 'no such file: %s' % file)
+        return path
+
+    def etag(self, path, params):
+        '''
+        Strong validator of a response: file version plus the request parameters
+        '''
+        stat = os.stat(path)
+        key = '%s:%d:%d:%s' % (path, stat.st_mtime_ns, stat.st_size, sorted(params.items()))
+        return '"%s"' % hashlib.sha1(key.encode()).hexdigest()[:20]
+
+    async def files(self, query):
+        from batch import find_nifti
+        return 'application/json', json.dumps([rel_path for _, rel_path in find_nifti([self.root])]).encode(), {}
+
+    async def info(self, query):
+        path = self.resolve(param(query, 'file'))
+        mri = await self.cache.get(path, param(query, 'volume', int, None))
+        stats = mri.intensity_stats()
+        info = {'shape': [int(n) for n in mri.mri_shape], 'dtype': str(mri.mri_data.dtype),
+                'min': float(stats.min), 'max': float(stats.max), 'window': [float(v) for v in stats.window()],
+                'spacing': [float(v) for v in mri.mri_spacing]}
+        return 'application/json', json.dumps(info).encode(), {}
+
+    async def slice(self, query):
+        from view_slices import VIEWS
+        path = self.resolve(param(query, 'file'))
+        view = param(query, 'axis')
+        format = param(query, 'format', str, 'png')
+        if view not in VIEWS or format not in FORMATS:
+            raise HTTPError(400, 'axis must be one of %s and format one of %s' % (VIEWS, list(FORMATS)))
+        index = param(query, 'index', int)
+        level = param(query, 'level', float, None)
+        width = param(query, 'width', float, None)
+        isotropic = bool(param(query, 'isotropic', int, 0))
+        mri = await self.cache.get(path, param(query, 'volume', int, None))
+        n = int(mri.mri_shape[VIEWS.index(view)])
+        if not 0 <= index < n:
+            raise HTTPError(400, 'index %d out of range [0, %d]' % (index, n - 1))
+        default_level, default_width = mri.intensity_stats().window()
+        window = (default_level if level is None else level, default_width if width is None else max(width, 1))
+        loop = asyncio.get_running_loop()
+        body, shape = await loop.run_in_executor(self.executor, render_slice, mri, view, index, window, format, isotropic)
+        return FORMATS[format], body, {'X-Image-Shape': '%d,%d' % shape}
+
+    async def respond(self, method, target, headers):
+        '''
+        Routes one request
+
+        Returns:
+        status -- HTTP status code
+        content_type -- MIME type of the body
+        body -- response body (bytes)
+        extra -- dict of additional headers
+        '''
+        url = urlsplit(target)
+        routes = {'/files': self.files, '/info': self.info, '/slice': self.slice}
+        if url.path not in routes:
+            raise HTTPError(404, 'unknown path: %s' % url.path)
+        if method not in ('GET', 'HEAD'):
+            raise HTTPError(405, 'only GET and HEAD are supported')
+        query = parse_qs(url.query)
+
+        etag = None
+        if url.path != '/files':
+            # conditional requests are answered before loading or rendering anything
+            params = {name: values[-1] for name, values in query.items()}
+            etag = self.etag(self.resolve(param(query, 'file')), params)
+            if etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+                return 304, None, b'', {'ETag': etag}
+        content_type, body, extra = await routes[url.path](query)
+        if etag is not None:
+            extra['ETag'] = etag
+            extra['Cache-Control'] = 'no-cache'
+        return 200, content_type, body, extra
+
+    async def handle(self, reader, writer):
+        '''
+        Serves the requests of one connection until it is closed
+        '''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    break
+                method, target, version = parts
+                self.requests += 1
+                try:
+                    status, content_type, body, extra = await self.respond(method, target, headers)
+                except HTTPError as error:
+                    status, content_type, body, extra = error.status, 'text/plain', str(error).encode(), {}
+                except Exception as error:
+                    status, content_type, body, extra = 500, 'text/plain', repr(error).encode(), {}
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                lines = ['HTTP/1.1 %d %s' % (status, REASONS[status]), 'Content-Length: %d' % len(body),
+                         'Connection: %s' % ('keep-alive' if keep_alive else 'close')]
+                if content_type is not None:
+                    lines.append('Content-Type: %s' % content_type)
+                lines += ['%s: %s' % item for item in extra.items()]
+                writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+                if method != 'HEAD':
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        '''
+        Runs the server until it is cancelled
+        '''
+        server = await asyncio.start_server(self.handle, host, port)
+        print('Serving %s on http://%s:%d' % (self.root, host, server.sockets[0].getsockname()[1]), flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+def param(query, name, type=str, default=KeyError):
+    '''
+    Returns a parameter of the query string converted to type, or the default when it is missing
+    '''
+    if name not in query:
+        if default is KeyError:
+            raise HTTPError(400, 'missing parameter: %s' % name)
+        return default
+    try:
+        return type(query[name][-1])
+    except ValueError:
+        raise HTTPError(400, 'invalid parameter %s: %s' % (name, query[name][-1]))
+
+
+def serve_main(argv=None):
+    parser = argparse.ArgumentParser(prog='brain_mri_viewer serve', description='Serves windowed slices of the NifTi files of a directory over HTTP')
+    parser.add_argument('root', nargs='?', default='.', help='directory of the NifTi files')
+    parser.add_argument('--host', type=str, default='127.0.0.1', dest='host', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8000, dest='port', help='port to listen on')
+    parser.add_argument('--cache-mb', type=int, default=1024, dest='cache_mb', help='memory budget in MB of the loaded MRIs')
+    parser.add_argument('-j', '--workers', type=int, default=None, dest='workers', help='number of rendering threads (default: Python default of the thread pool)')
+    args = parser.parse_args(argv)
+
+    import matplotlib
+    matplotlib.use('Agg')
+    server = SliceServer(args.root, args.cache_mb, args.workers)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.executor.shutdown(wait=False)
+        print('%d requests, volume cache: %d hits, %d misses' % (server.requests, server.cache.hits, server.cache.misses))
+    return 0
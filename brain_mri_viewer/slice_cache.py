@@ -0,0 +1,159 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import threading
+from collections import OrderedDict
+
+class SliceCache:
+    '''
+    LRU cache of displayed slices keyed by (view, slice, window, level), bounded by a
+    memory budget, with a background thread that prefetches the next slices
+    in the direction the slider is being scrubbed
+
+    Arguments:
+    loader -- function (view, slice, window, level) returning the 2D slice to display
+              (for level > 0, slice is the index in the level, slice // 2**level)
+    n_slices -- dict with the number of slices of each view
+    max_bytes -- memory budget of the cached slices
+    prefetch -- number of slices loaded ahead of the current one (0 disables prefetching)
+    '''
+    def __init__(self, loader, n_slices, max_bytes=256 * 2**20, prefetch=4):
+        self.loader = loader
+        self.n_slices = n_slices
+        self.max_bytes = max_bytes
+        self.prefetch = prefetch
+        self.slices = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.evictions = 0
+        self.last_slice = {}
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.closed = False
+        self.thread = None
+        if prefetch > 0:
+            self.thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+            self.thread.start()
+
+    def get(self, view, slice, window=None, level=0):
+        '''
+        Returns the slice to display, loading it on a miss
+
+        Arguments:
+        view -- string containing the view (sag, cor or axi)
+        slice -- index of the full resolution slice
+        window -- hashable window parameters passed to the loader (None for no windowing)
+        level -- pyramid level of the slice (0 for full resolution)
+
+        Returns:
+        mri_slice -- 2D slice to display
+        '''
+        # the 2**level full resolution slices of a level slice share its entry
+        slice = int(slice) // 2**level
+        key = (view, slice, window, level)
+        with self.lock:
+            mri_slice = self.slices.get(key)
+            if mri_slice is not None:
+                self.slices.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._schedule(view, slice, window, level)
+
+        if mri_slice is None:
+            mri_slice = self.loader(view, slice, window, level)
+            with self.lock:
+                self._store(key, mri_slice)
+        return mri_slice
+
+    def _schedule(self, view, slice, window, level):
+        # queue the neighbours in the scrub direction, dropping older requests
+        direction = slice - self.last_slice.get((view, level), slice)
+        self.last_slice[view, level] = slice
+        if self.thread is None or direction == 0:
+            return
+        step = 1 if direction > 0 else -1
+        n_slices = -(-self.n_slices[view] // 2**level)
+        self.pending = [(view, s, window, level) for s in range(slice + step, slice + step * (self.prefetch + 1), step)
+                        if 0 <= s < n_slices and (view, s, window, level) not in self.slices]
+        self.wakeup.notify()
+
+    def _store(self, key, mri_slice):
+        if key in self.slices:
+            return
+        self.slices[key] = mri_slice
+        self.nbytes += mri_slice.nbytes
+        while self.nbytes > self.max_bytes and len(self.slices) > 1:
+            old_key, old_slice = self.slices.popitem(last=False)
+            self.nbytes -= old_slice.nbytes
+            self.evictions += 1
+
+    def _prefetch_loop(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.closed:
+                    self.wakeup.wait()
+                if self.closed:
+                    return
+                key = self.pending.pop(0)
+                if key in self.slices:
+                    continue
+            mri_slice = self.loader(*key)
+            with self.lock:
+                self.prefetched += 1
+                self._store(key, mri_slice)
+
+    def close(self):
+        '''
+        Stops the prefetching thread
+        '''
+        with self.lock:
+            self.closed = True
+            self.wakeup.notify()
+
+    def clear(self):
+        '''
+        Drops all the cached slices
+        '''
+        with self.lock:
+            self.slices.clear()
+            self.pending = []
+            self.nbytes = 0
+
+    def stats(self):
+        '''
+        Returns the hit/miss statistics of the cache
+
+        Returns:
+        stats -- dict with hits, misses, hit rate, prefetched slices, evictions, cached slices and bytes
+        '''
+        with self.lock:
+            requests = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / requests if requests else 0.0,
+                    'prefetched': self.prefetched, 'evictions': self.evictions,
+                    'slices': len(self.slices), 'bytes': self.nbytes}
+
+    def report(self):
+        '''
+        Returns the statistics of the cache as a printable line
+        '''
+        stats = self.stats()
+        return ('Slice cache: %(hits)d hits, %(misses)d misses (hit rate %(hit_rate).0f%%), %(prefetched)d prefetched, '
+                '%(evictions)d evicted, %(slices)d slices in %(mb).1f MB') % dict(stats, hit_rate=100 * stats['hit_rate'], mb=stats['bytes'] / 2**20)
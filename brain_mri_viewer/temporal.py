@@ -0,0 +1,188 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Voxelwise temporal maps (mean, std, tSNR and max) of 4D MRIs, streamed volume by volume'''
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import nibabel as nib
+
+MAPS = ['mean', 'std', 'tsnr', 'max']
+
+class TemporalAccumulator:
+    '''
+    Streaming (Welford) voxelwise mean, variance and maximum over the volumes
+    of a 4D MRI. Blocks of volumes are merged exactly into the running
+    statistics (Chan et al.), so memory stays at a few volumes whatever the
+    number of volumes is
+
+    Arguments:
+    shape -- shape of one volume (or of the part of it accumulated)
+    '''
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64)
+        self.max = np.full(shape, -np.inf, dtype=np.float64)
+
+    def update(self, mri_block):
+        '''
+        Adds a block of volumes (volumes on the last axis)
+        '''
+        n = mri_block.shape[-1]
+        np.maximum(self.max, np.max(mri_block, axis=-1), out=self.max)
+        block = np.array(mri_block, dtype=np.float64)
+        block_mean = block.mean(axis=-1)
+        block -= block_mean[..., None]
+        block_m2 = np.einsum('...t,...t->...', block, block)
+
+        total = self.count + n
+        delta = block_mean - self.mean
+        self.mean += delta * (n / total)
+        delta *= delta
+        delta *= self.count * n / total
+        self.m2 += block_m2
+        self.m2 += delta
+        self.count = total
+
+    def maps(self):
+        '''
+        Returns the temporal maps: mean, std (sample standard deviation), tSNR (mean/std) and max
+
+        Returns:
+        maps -- dict of float32 arrays
+        '''
+        std = np.sqrt(self.m2 / max(self.count - 1, 1))
+        tsnr = np.divide(self.mean, std, out=np.zeros_like(self.mean), where=std > 0)
+        return {'mean': self.mean.astype(np.float32), 'std': std.astype(np.float32),
+                'tsnr': tsnr.astype(np.float32), 'max': self.max.astype(np.float32)}
+
+
+def temporal_maps(mri_data, block=4, workers=None, slab=None):
+    '''
+    Computes the voxelwise temporal maps of a 4D MRI. Blocks of volumes are
+    read in file order (so compressed files are decompressed once) and the
+    accumulation is split in slabs of slices across a thread pool
+
+    Arguments:
+    mri_data --  4D MRI array or array proxy (e.g. the memory-mapped dataobj)
+    block -- number of volumes read at a time
+    workers -- number of threads (default: number of CPUs)
+    slab -- number of slices accumulated by each task (default: split evenly across the threads)
+
+    Returns:
+    maps -- dict with the mean, std, tsnr and max float32 arrays
+    '''
+    shape = mri_data.shape[:3]
+    n_volumes = mri_data.shape[3]
+    workers = workers or os.cpu_count() or 1
+    slab = slab or -(-shape[2] // workers)
+    slabs = [np.s_[start:start+slab] for start in range(0, shape[2], slab)]
+    accumulators = [TemporalAccumulator(shape[:2] + (len(range(shape[2])[z]),)) for z in slabs]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, n_volumes, block):
+            mri_block = np.asarray(mri_data[..., start:start+block])
+            list(executor.map(lambda i: accumulators[i].update(mri_block[:, :, slabs[i]]), range(len(slabs))))
+
+    maps = {name: np.empty(shape, dtype=np.float32) for name in MAPS}
+    for z, accumulator in zip(slabs, accumulators):
+        for name, map_slab in accumulator.maps().items():
+            maps[name][:, :, z] = map_slab
+    return maps
+
+
+def save_maps(maps, mri, prefix, names=MAPS):
+    '''
+    Exports temporal maps as NifTi files (<prefix>_<map>.nii.gz) with the affine of the 4D MRI
+
+    Arguments:
+    maps -- dict of temporal maps
+    mri -- 4D NifTi image the maps were computed from
+    prefix -- output path prefix
+    names -- maps to export
+
+    Returns:
+    paths -- list of the written files
+    '''
+    paths = []
+    for name in names:
+        header = mri.header.copy()
+        header.set_data_shape(maps[name].shape)
+        header.set_data_dtype(np.float32)
+        header.set_slope_inter(1, 0)
+        path = '%s_%s.nii.gz' % (prefix, name)
+        nib.save(nib.Nifti1Image(maps[name], mri.affine, header), path)
+        paths.append(path)
+    return paths
+
+
+def show_map(map_data, affine, window=False):
+    '''
+    Displays a temporal map in the multiview viewers
+
+    Arguments:
+    map_data -- 3D temporal map
+    affine -- affine matrix of the map
+    window -- enables the windowing sliders
+    '''
+    from reorient import reorient_to_ras, ras_affine, voxel_spacing
+    from intensity_stats import volume_stats
+    from view_slices import multi_view, multi_view_window
+
+    spacing = voxel_spacing(ras_affine(affine, map_data.shape))
+    map_data = reorient_to_ras(map_data, affine)
+    mri_shape = np.asarray(map_data.shape)
+    if window:
+        stats = volume_stats(map_data)
+        multi_view_window(mri_shape, map_data, stats.max, min_voxel=stats.min, window=stats.window(), spacing=spacing)
+    else:
+        multi_view(mri_shape, map_data, spacing=spacing)
+
+
+def tmap_main(argv=None):
+    parser = argparse.ArgumentParser(prog='brain_mri_viewer tmap', description='Computes voxelwise temporal mean, std, tSNR and max maps of 4D NifTi files')
+    parser.add_argument('input', help='4D NifTi file')
+    parser.add_argument('-o', '--output', type=str, default=None, dest='prefix', help='output path prefix of the NifTi maps (default: next to the input)')
+    parser.add_argument('-m', '--maps', nargs='+', choices=MAPS, default=MAPS, dest='maps', help='maps to export')
+    parser.add_argument('-j', '--workers', type=int, default=None, dest='workers', help='number of threads (default: number of CPUs)')
+    parser.add_argument('-b', '--block', type=int, default=4, dest='block', help='number of volumes read at a time')
+    parser.add_argument('--show', type=str, choices=MAPS, default=None, dest='show', help='displays a map in the multiview viewer')
+    parser.add_argument('-w', '--window', action='store_true', dest='window', help='enables windowing when displaying the map')
+    parser.add_argument('--no-save', action='store_true', dest='no_save', help='does not export the maps')
+    args = parser.parse_args(argv)
+
+    mri = nib.load(args.input, keep_file_open=True)
+    if len(mri.shape) != 4:
+        print('%s is not a 4D MRI' % args.input)
+        return 1
+    start = time.perf_counter()
+    maps = temporal_maps(mri.dataobj, args.block, args.workers)
+    print('%d volumes reduced in %.2f s' % (mri.shape[3], time.perf_counter() - start))
+
+    if not args.no_save:
+        prefix = args.prefix
+        if prefix is None:
+            prefix = args.input[:-len('.nii.gz')] if args.input.endswith('.nii.gz') else os.path.splitext(args.input)[0]
+        for path in save_maps(maps, mri, prefix, args.maps):
+            print(path)
+    if args.show:
+        show_map(maps[args.show], mri.affine, args.window)
+    return 0
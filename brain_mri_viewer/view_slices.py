@@ -15,12 +15,240 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import functools
 import numpy as np
-import matplotlib.pyplot as plt
-import nibabel as nib
-from matplotlib.widgets import Slider, Button
+from slice_cache import SliceCache
+from profiler import span
 
-def view_slices(mri_shape, mri_data, view):
+# pyplot and the widgets are imported by the viewers, so the slice helpers
+# load without a GUI backend (headless rendering, the server, --info)
+
+def get_slice(mri_data, view, slice):
+    ''' 
+    Extracts a single 2D slice of the MRI in the given view
+
+    Arguments: 
+    mri_data --  MRI array
+    view -- string containing the view (sag, cor or axi)
+    slice -- index of the slice
+
+    Returns:
+    mri_slice -- 2D slice of the MRI array (view of mri_data, not a copy)
+    '''
+    if view == 'sag':
+        return mri_data[slice, :, :]
+    if view == 'cor':
+        return mri_data[:, slice, :]
+    if view == 'axi':
+        return mri_data[:, :, slice]
+
+
+def window_slice(mri_data, view, slice, wl, ww):
+    ''' 
+    Computes windowing only for the displayed slice, so that each slider
+    event costs O(slice) instead of O(volume)
+
+    Arguments: 
+    mri_data --  MRI array
+    view -- string containing the view (sag, cor or axi)
+    slice -- index of the slice
+    wl -- window level
+    ww -- window width
+
+    Returns:
+    slice_window -- 2D slice with windowing applied
+    '''
+    return windowing(get_slice(mri_data, view, slice), wl, ww)
+
+
+def display_slice(mri_data, view, slice, window=None):
+    ''' 
+    Loads a slice ready to be displayed with imshow (windowed if requested and transposed)
+
+    Arguments: 
+    mri_data --  MRI array
+    view -- string containing the view (sag, cor or axi)
+    slice -- index of the slice
+    window -- (window level, window width) tuple, or None for no windowing
+
+    Returns:
+    mri_slice -- 2D slice to display
+    '''
+    if window is None:
+        return np.array(get_slice(mri_data, view, slice)).T
+    return window_slice(mri_data, view, slice, *window).T
+
+
+def slice_cache(mri_data, max_mb=256, prefetch=4, pyramid=None):
+    ''' 
+    Creates the cache of displayed slices of an MRI
+
+    Arguments: 
+    mri_data --  MRI array
+    max_mb -- memory budget of the cache in MB
+    prefetch -- number of slices prefetched in the scrub direction
+    pyramid -- Pyramid of the MRI, slices of level > 0 are read from its downsampled levels
+
+    Returns:
+    cache -- SliceCache of the MRI
+    '''
+    def loader(view, slice, window, level):
+        with span('load slice', view=view, slice=int(slice), level=level):
+            return load(view, slice, window, level)
+
+    def load(view, slice, window, level):
+        if level > 0:
+            mri_level = pyramid.levels[level]
+            slice = min(slice, mri_level.shape[VIEWS.index(view)] - 1)
+            return display_slice(mri_level, view, slice, window)
+        return display_slice(mri_data, view, slice, window)
+
+    return SliceCache(loader, dict(zip(VIEWS, mri_data.shape[:3])), max_mb * 2**20, prefetch)
+
+
+VIEWS = ['sag', 'cor', 'axi']
+VIEW_TITLES = {'sag': 'Sagittal view', 'cor': 'Coronal view', 'axi': 'Axial view'}
+
+
+def slice_spacing(spacing, view):
+    '''
+    Returns the voxel spacing of the 2 axes of the slices of a view, in the order of get_slice
+    '''
+    return tuple(spacing[i] for i in range(3) if i != VIEWS.index(view))
+
+
+def slice_aspect(spacing, view):
+    '''
+    Computes the imshow aspect of the displayed (transposed) slices of a view,
+    so anisotropic voxels are drawn with their physical proportions
+
+    Arguments:
+    spacing -- voxel spacing (x, y, z) in mm of the RAS array, or None for square pixels
+    view -- string containing the view (sag, cor or axi)
+
+    Returns:
+    aspect -- height / width of a displayed pixel
+    '''
+    if spacing is None:
+        return 1.0
+    cols, rows = slice_spacing(spacing, view)
+    return float(rows) / float(cols)
+
+
+class SliceImage:
+    '''
+    Image of the displayed slice of one view. With a pyramid, slider updates
+    show the level matching the pixel size of the axes and the full resolution
+    slice is loaded once the sliders stop (the extent stays in full resolution
+    voxels, so every level is drawn at the same place)
+
+    Arguments:
+    ax -- matplotlib axes where the slice is displayed
+    cache -- SliceCache of the displayed slices
+    view -- string containing the view (sag, cor or axi)
+    mri_shape -- shape of the MRI array
+    slice -- index of the initial slice
+    window -- initial (window level, window width) tuple, or None for no windowing
+    pyramid -- Pyramid of the MRI (None to always display full resolution slices)
+    overlay -- Overlay of a label map drawn on top of the slice (None for no overlay)
+    spacing -- voxel spacing (x, y, z) in mm, sets the aspect of the pixels (None for square pixels)
+    '''
+    def __init__(self, ax, cache, view, mri_shape, slice, window=None, pyramid=None, overlay=None, spacing=None):
+        self.cache = cache
+        self.view = view
+        self.pyramid = pyramid
+        self.blit = None
+        self.slice = slice
+        self.window = window
+        # displayed slices are transposed: rows are the last of the 2 remaining axes
+        cols, rows = [int(n) for i, n in enumerate(mri_shape[:3]) if i != VIEWS.index(view)]
+        self.slice_shape = (rows, cols)
+        self.image = ax.imshow(cache.get(view, slice, window), cmap='gray', origin='lower',
+                               extent=(-0.5, cols - 0.5, -0.5, rows - 0.5), aspect=slice_aspect(spacing, view))
+        self.overlay = overlay.add_image(ax, view, slice) if overlay is not None else None
+
+    def level(self):
+        if self.pyramid is None:
+            return 0
+        bbox = self.image.axes.bbox
+        return self.pyramid.level_for(self.slice_shape, (bbox.width, bbox.height))
+
+    def show(self, slice, window=None):
+        '''
+        Displays a slice, as a preview of the pyramid level of the axes size
+        while the sliders are moving
+
+        Returns:
+        artists -- list with the changed image
+        '''
+        self.slice = int(slice)
+        self.window = window
+        level = self.level()
+        self.image.set_data(self.cache.get(self.view, self.slice, window, level))
+        if level > 0 and self.blit is not None:
+            self.blit.request_idle(self.refine)
+        if self.overlay is not None and self.overlay.slice != self.slice:
+            return [self.image] + self.overlay.show(self.slice)
+        return [self.image]
+
+    def refine(self):
+        '''
+        Replaces the preview with the full resolution slice
+        '''
+        self.image.set_data(self.cache.get(self.view, self.slice, self.window))
+        return [self.image]
+
+    def add_to(self, blit):
+        '''
+        Registers the image (and its overlay) in a BlitManager, which also runs the refinement when idle
+        '''
+        self.blit = blit
+        if self.overlay is not None:
+            return blit.add_region(self.image.axes, [self.image, self.overlay.image])
+        return blit.add_image(self.image)
+
+def montage_slices(mri_shape, view, nslices=1):
+    ''' 
+    Computes evenly spaced slice indices of one view (the mid slice when nslices is 1)
+
+    Arguments: 
+    mri_shape -- shape of the MRI array
+    view -- string containing the view (sag, cor or axi)
+    nslices -- number of slices
+
+    Returns:
+    slices -- list of slice indices
+    '''
+    n = mri_shape[VIEWS.index(view)]
+    return [int(n * (i + 1) // (nslices + 1)) for i in range(nslices)]
+
+
+def plot_montage(fig, mri_data, mri_shape, nslices=1, overlay=None, spacing=None):
+    ''' 
+    Draws the mid slices (or a grid of nslices per view) of the MRI in each view (sagittal, coronal and axial)
+
+    Arguments: 
+    fig -- matplotlib figure where the montage is drawn
+    mri_data --  MRI array
+    mri_shape -- shape of the MRI array
+    nslices -- number of slices per view
+    overlay -- Overlay of a label map drawn on top of the slices (None for no overlay)
+    spacing -- voxel spacing (x, y, z) in mm, sets the aspect of the pixels (None for square pixels)
+    '''
+    if nslices == 1:
+        axes = np.asarray(fig.subplots(1, len(VIEWS))).reshape(len(VIEWS), 1)
+    else:
+        axes = np.asarray(fig.subplots(len(VIEWS), nslices)).reshape(len(VIEWS), nslices)
+    for row, view in enumerate(VIEWS):
+        for col, slice in enumerate(montage_slices(mri_shape, view, nslices)):
+            axes[row, col].imshow(get_slice(mri_data, view, slice).T, cmap='gray', origin='lower', aspect=slice_aspect(spacing, view))
+            if overlay is not None:
+                overlay.add_image(axes[row, col], view, slice)
+            axes[row, col].axis('off')
+        axes[row, 0].set_title(VIEW_TITLES[view])
+
+
+def view_slices(mri_shape, mri_data, view, cache=None, show_fps=False, pyramid=None, overlay=None, spacing=None):
     ''' 
     Outputs a figure where the slices of 1 view (sagittal, coronal or axial) can be viewed 
 
@@ -28,28 +256,37 @@ def view_slices(mri_shape, mri_data, view):
     mri_shape -- shape of the MRI array
     mri_data --  MRI array
     view -- string containing the view to display
+    cache -- SliceCache of the displayed slices (created if None)
+    show_fps -- shows the frames per second and latency of the slider updates
+    pyramid -- Pyramid of the MRI, its levels are displayed while scrubbing
+    overlay -- Overlay of a label map, with its opacity slider and label text box (None for no overlay)
+    spacing -- voxel spacing (x, y, z) in mm, sets the aspect of the pixels (None for square pixels)
     '''
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import Slider
+    from blitting import BlitManager
+    if cache is None:
+        cache = slice_cache(mri_data, pyramid=pyramid)
+
     plt.style.use('dark_background')
     plt.subplots_adjust(left=0.25, bottom=0.25)
 
     if view == 'sag':
         max_slice = mri_shape[0]
         mid_slice = mri_shape[0]//2
-        l = plt.imshow(mri_data[mid_slice, :, :].T, cmap='gray', origin='lower')
         slabel = 'Sagittal slices '
         
     if view == 'cor':
         max_slice = mri_shape[1]
         mid_slice = mri_shape[1]//2
-        l = plt.imshow(mri_data[:, mid_slice, :].T, cmap='gray', origin='lower')
         slabel = 'Coronal slices '
         
     if view == 'axi':
         max_slice = mri_shape[2]
         mid_slice = mri_shape[2]//2
-        l = plt.imshow(mri_data[:, :, mid_slice].T, cmap='gray', origin='lower')
         slabel = 'Axial slices '
         
+    l = SliceImage(plt.gca(), cache, view, mri_shape, mid_slice, pyramid=pyramid, overlay=overlay, spacing=spacing)
     plt.axis('off')
     axislice = plt.axes([0.25, 0.1, 0.65, 0.03])
     sslice=Slider(ax=axislice, 
@@ -60,45 +297,56 @@ def view_slices(mri_shape, mri_data, view):
         valinit=mid_slice)
 
 
-    def update(val):
+    blit = BlitManager(plt.gcf(), show_fps)
+    l.add_to(blit)
+    blit.add_slider(sslice)
+
+    def update():
         slice=np.around(sslice.val)
-        if view == 'sag':
-            l.set_data(mri_data[slice, :, :].T)
-        if view == 'cor':
-            l.set_data(mri_data[:, slice, :].T)
-        if view == 'axi':
-            l.set_data(mri_data[:, :, slice].T)
-
-    sslice.on_changed(update)
+        return l.show(slice)
+
+    blit.on_changed(sslice, update)
+    if overlay is not None:
+        overlay.add_controls(plt.gcf(), blit, {view: sslice})
     plt.show()
+    cache.close()
 
 
-def multi_view(mri_shape, mri_data):
+def multi_view(mri_shape, mri_data, cache=None, show_fps=False, pyramid=None, overlay=None, spacing=None):
     ''' 
     Outputs a figure where the slices of the 3 views (sagittal, coronal or axial) can be viewed 
 
     Arguments: 
     mri_shape -- shape of the MRI array
     mri_data --  MRI array
+    cache -- SliceCache of the displayed slices (created if None)
+    show_fps -- shows the frames per second and latency of the slider updates
+    pyramid -- Pyramid of the MRI, its levels are displayed while scrubbing
+    overlay -- Overlay of a label map, with its opacity slider and label text box (None for no overlay)
+    spacing -- voxel spacing (x, y, z) in mm, sets the aspect of the pixels (None for square pixels)
     '''
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import Slider
+    from blitting import BlitManager
+    if cache is None:
+        cache = slice_cache(mri_data, pyramid=pyramid)
+
     max_slice_sag = mri_shape[0]
     max_slice_cor = mri_shape[1]
     max_slice_axi = mri_shape[2]
     mid_slice_sag = mri_shape[0]//2
     mid_slice_cor = mri_shape[1]//2
     mid_slice_axi = mri_shape[2]//2
-    sag_mid = mri_data[mri_shape[0]//2, :, :]
-    cor_mid = mri_data[:, mri_shape[1]//2, :]
-    axi_mid = mri_data[:, :, mri_shape[2]//2]
 
     plt.style.use('dark_background')
     fig, axes = plt.subplots(1,3)
-    l_sag = axes[0].imshow(sag_mid.T, cmap='gray', origin='lower')
-    l_cor = axes[1].imshow(cor_mid.T, cmap='gray', origin='lower')
-    l_axi = axes[2].imshow(axi_mid.T, cmap='gray', origin='lower')
+    l_sag = SliceImage(axes[0], cache, 'sag', mri_shape, mid_slice_sag, pyramid=pyramid, overlay=overlay, spacing=spacing)
+    l_cor = SliceImage(axes[1], cache, 'cor', mri_shape, mid_slice_cor, pyramid=pyramid, overlay=overlay, spacing=spacing)
+    l_axi = SliceImage(axes[2], cache, 'axi', mri_shape, mid_slice_axi, pyramid=pyramid, overlay=overlay, spacing=spacing)
     axes[0].axis('off')
     axes[1].axis('off')
     axes[2].axis('off')
+    blit = BlitManager(fig, show_fps)
 
     # sagittal
     axislice_sag = plt.axes([0.25, 0.1, 0.65, 0.03])
@@ -109,12 +357,14 @@ def multi_view(mri_shape, mri_data):
         valstep=1, 
         valinit=mid_slice_sag)
     
-    def update_sag(val):
+    def update_sag():
         slice=np.around(sslice_sag.val)
-        l_sag.set_data(mri_data[slice, :, :].T)
+        return l_sag.show(slice)
 
 
-    sslice_sag.on_changed(update_sag)
+    l_sag.add_to(blit)
+    blit.add_slider(sslice_sag)
+    blit.on_changed(sslice_sag, update_sag)
 
     # coronal
     axislice_cor = plt.axes([0.25, 0.06, 0.65, 0.03])
@@ -125,12 +375,14 @@ def multi_view(mri_shape, mri_data):
         valstep=1, 
         valinit=mid_slice_cor)
     
-    def update_cor(val):
+    def update_cor():
         slice=np.around(sslice_cor.val)
-        l_cor.set_data(mri_data[:, slice, :].T)
+        return l_cor.show(slice)
 
 
-    sslice_cor.on_changed(update_cor)
+    l_cor.add_to(blit)
+    blit.add_slider(sslice_cor)
+    blit.on_changed(sslice_cor, update_cor)
 
     # axial
     axislice_axi = plt.axes([0.25, 0.02, 0.65, 0.03])
@@ -141,39 +393,169 @@ def multi_view(mri_shape, mri_data):
         valstep=1, 
         valinit=mid_slice_axi)
     
-    def update_axi(val):
+    def update_axi():
         slice=np.around(sslice_axi.val)
-        l_axi.set_data(mri_data[:, :, slice].T)
+        return l_axi.show(slice)
 
 
-    sslice_axi.on_changed(update_axi)
+    l_axi.add_to(blit)
+    blit.add_slider(sslice_axi)
+    blit.on_changed(sslice_axi, update_axi)
 
+    if overlay is not None:
+        overlay.add_controls(fig, blit, {'sag': sslice_sag, 'cor': sslice_cor, 'axi': sslice_axi})
     plt.show()
+    cache.close()
 
 
-def windowing(mri_data, wl, ww):
+def windowing(mri_data, wl, ww, out=None):
 
     ''' 
-    Computes windowing for MRI
+    Computes windowing for MRI with a clip and an in-place scale of the voxels.
+    Integer MRIs of 8 or 16 bits are windowed through a lookup table
+
     Arguments: 
     mri_data --  MRI array
     wl -- window level
     ww -- window width
+    out -- optional float array where the result is stored (it can be mri_data itself for float MRIs)
+
     Returns:
     mri_window -- MRI with windowing applied
     '''
     # INSTEAD OF ENTERING HU MRI, LET US ENTER MRI DATA
     min_window = wl - ww // 2
     max_window = wl + ww // 2
-    mri_window = mri_data.copy()
-    mri_window [mri_window > max_window] = max_window
-    mri_window [mri_window < min_window] = min_window
-    mri_window [(mri_window > min_window) & (mri_window < max_window)] = max_window * (mri_window [(mri_window > min_window) & (mri_window < max_window)] - min_window)/(max_window - min_window)
+    mri_data = np.asanyarray(mri_data)
+
+    if mri_data.dtype.kind in 'iu' and mri_data.dtype.itemsize <= 2:
+        lut = window_lut(mri_data.dtype.str, min_window, max_window)
+        index = mri_data.view('u%d' % mri_data.dtype.itemsize)
+        return np.take(lut, index, out=out, mode='clip')
+
+    return clip_scale(mri_data, min_window, max_window, out)
+
+
+def clip_scale(mri_data, min_window, max_window, out=None):
+    ''' 
+    Window kernel: clips the MRI to [min_window, max_window] and scales the
+    voxels inside the window to [0, max_window]
+
+    Arguments: 
+    mri_data --  MRI array
+    min_window -- lower bound of the window
+    max_window -- upper bound of the window
+    out -- optional float array where the result is stored
+
+    Returns:
+    mri_window -- MRI with windowing applied
+    '''
+    if out is None:
+        out = np.empty(mri_data.shape, dtype=mri_data.dtype if mri_data.dtype.kind == 'f' else np.float64)
+    np.clip(mri_data, min_window, max_window, out=out)
+    if max_window > min_window:
+        # the upper bound scales to itself, only the voxels on or below the
+        # lower bound keep it instead of being scaled to 0
+        below = out <= min_window
+        out -= min_window
+        out *= max_window / (max_window - min_window)
+        np.copyto(out, min_window, where=below)
+
+    return out
+
+
+@functools.lru_cache(maxsize=32)
+def window_lut(dtype, min_window, max_window):
+    ''' 
+    Computes the windowing lookup table of an integer dtype (up to 65536 entries)
+
+    Arguments: 
+    dtype -- dtype string of the MRI (8 or 16 bits integer)
+    min_window -- lower bound of the window
+    max_window -- upper bound of the window
+
+    Returns:
+    lut -- float64 table indexed by the unsigned bit pattern of each voxel
+    '''
+    dtype = np.dtype(dtype)
+    values = np.arange(2 ** (8 * dtype.itemsize), dtype='u%d' % dtype.itemsize).view(dtype)
+    lut = clip_scale(values.astype(np.float64), min_window, max_window)
+    lut.flags.writeable = False
+    return lut
+
+
+def window_sliders(window, intensity_range, x_width=0.1, x_level=0.2):
+    ''' 
+    Adds the vertical window width and level sliders of the windowing viewers
+
+    Arguments: 
+    window -- initial (window level, window width)
+    intensity_range -- (min, max) intensity of the MRI array
+    x_width -- horizontal position of the window width slider in the figure
+    x_level -- horizontal position of the window level slider in the figure
+
+    Returns:
+    swidth -- window width slider
+    slevel -- window level slider
+    '''
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import Slider
+    wl_init, ww_init = window
+    min_voxel, max_voxel = intensity_range
+    axiwindow_width = plt.axes([x_width, 0.25, 0.0225, 0.63])
+    swidth=Slider(ax=axiwindow_width, 
+        label='Window \n width ', 
+        valmin=1, 
+        valmax=max(2*(max_voxel-min_voxel), ww_init), 
+        valstep=1, 
+        valinit=ww_init,
+        orientation="vertical")
     
-    return mri_window
+    axiwindow_level = plt.axes([x_level, 0.25, 0.0225, 0.63])
+    slevel=Slider(ax=axiwindow_level, 
+        label='Window \n level ', 
+        valmin=min(min_voxel, wl_init), 
+        valmax=max(max_voxel, wl_init), 
+        valstep=1, 
+        valinit=wl_init,
+        orientation="vertical")
+    return swidth, slevel
 
 
-def view_slices_window(mri_shape, mri_data, view, max_voxel):
+def preset_buttons(presets, swidth, slevel, x=0.35, y=0.895):
+    ''' 
+    Adds one button per window preset at the top of the figure, setting the
+    window sliders. The default row is below the fps counter and the overlay
+    controls, which take the top of the figure
+
+    Arguments: 
+    presets -- dict of name: (window level, window width)
+    swidth -- window width slider
+    slevel -- window level slider
+    x -- horizontal position of the first button in the figure
+    y -- vertical position of the buttons in the figure
+
+    Returns:
+    buttons -- list of the buttons (they must be referenced while the figure is open)
+    '''
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import Button
+    buttons = []
+    for i, (name, (level, width)) in enumerate(presets.items()):
+        axibutton = plt.axes([x + 0.1*i, y, 0.09, 0.04])
+        button = Button(axibutton, name, color='0.15', hovercolor='0.3')
+
+        def select(event, level=level, width=width):
+            # both sliders queue the same update, which runs once
+            slevel.set_val(level)
+            swidth.set_val(width)
+
+        button.on_clicked(select)
+        buttons.append(button)
+    return buttons
+
+
+def view_slices_window(mri_shape, mri_data, view, max_voxel, cache=None, show_fps=False, pyramid=None, min_voxel=0, window=None, overlay=None, spacing=None, presets=None):
     ''' 
     Outputs a figure where the slices of 1 view (sagittal, coronal or axial) can be viewed and windowing can be applied
 
@@ -182,31 +564,44 @@ def view_slices_window(mri_shape, mri_data, view, max_voxel):
     mri_data --  MRI array
     view -- string containing the view to display
     max_voxel -- maximum intensity of the MRI array 
+    cache -- SliceCache of the displayed slices (created if None)
+    show_fps -- shows the frames per second and latency of the slider updates
+    pyramid -- Pyramid of the MRI, its levels are displayed while scrubbing
+    min_voxel -- minimum intensity of the MRI array
+    window -- initial (window level, window width), e.g. from the intensity percentiles (default: the first preset, or max_voxel, 2*max_voxel)
+    overlay -- Overlay of a label map, with its opacity slider and label text box (None for no overlay)
+    spacing -- voxel spacing (x, y, z) in mm, sets the aspect of the pixels (None for square pixels)
+    presets -- dict of name: (window level, window width) selectable with buttons (e.g. from auto_window)
     '''
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import Slider
+    from blitting import BlitManager
+    if cache is None:
+        cache = slice_cache(mri_data, pyramid=pyramid)
+
     plt.style.use('dark_background')
     plt.subplots_adjust(left=0.25, bottom=0.25)
 
-    wl_init = max_voxel
-    ww_init = max_voxel*2
+    if window is None and presets:
+        window = next(iter(presets.values()))
+    wl_init, ww_init = window if window is not None else (max_voxel, max_voxel*2)
 
     if view == 'sag':
         max_slice = mri_shape[0]
         mid_slice = mri_shape[0]//2
-        l = plt.imshow(windowing(mri_data, wl_init, ww_init)[mid_slice, :, :].T, cmap='gray', origin='lower')
         slabel = 'Sagittal slices '
         
     if view == 'cor':
         max_slice = mri_shape[1]
         mid_slice = mri_shape[1]//2
-        l = plt.imshow(windowing(mri_data, wl_init, ww_init)[:, mid_slice, :].T, cmap='gray', origin='lower') 
         slabel = 'Coronal slices '
         
     if view == 'axi':
         max_slice = mri_shape[2]
         mid_slice = mri_shape[2]//2
-        l = plt.imshow(windowing(mri_data, wl_init, ww_init)[:, :, mid_slice].T, cmap='gray', origin='lower')
         slabel = 'Axial slices '
         
+    l = SliceImage(plt.gca(), cache, view, mri_shape, mid_slice, (wl_init, ww_init), pyramid, overlay, spacing)
     plt.axis('off')
     axislice = plt.axes([0.25, 0.1, 0.65, 0.03])
     sslice=Slider(ax=axislice, 
@@ -216,44 +611,30 @@ def view_slices_window(mri_shape, mri_data, view, max_voxel):
         valstep=1, 
         valinit=mid_slice)
 
-    axiwindow_width = plt.axes([0.1, 0.25, 0.0225, 0.63])
-    swidth=Slider(ax=axiwindow_width, 
-        label='Window \n width ', 
-        valmin=1, 
-        valmax=max_voxel*2, 
-        valstep=1, 
-        valinit=ww_init,
-        orientation="vertical")
-    
-    axiwindow_level = plt.axes([0.2, 0.25, 0.0225, 0.63])
-    slevel=Slider(ax=axiwindow_level, 
-        label='Window \n level ', 
-        valmin=1, 
-        valmax=max_voxel, 
-        valstep=1, 
-        valinit=wl_init,
-        orientation="vertical")
+    swidth, slevel = window_sliders((wl_init, ww_init), (min_voxel, max_voxel), 0.1, 0.2)
+    buttons = preset_buttons(presets, swidth, slevel) if presets else []
+
+    blit = BlitManager(plt.gcf(), show_fps)
+    l.add_to(blit)
 
-    def update(val):
+    def update():
         slice=np.around(sslice.val)
         width=np.around(swidth.val)
         level=np.around(slevel.val)
-        if view == 'sag':
-            l.set_data(windowing(mri_data, level, width)[slice, :, :].T)
-        if view == 'cor':
-            l.set_data(windowing(mri_data, level, width)[:, slice, :].T)
-        if view == 'axi':
-            l.set_data(windowing(mri_data, level, width)[:, :, slice].T)
+        return l.show(slice, (level, width))
 
 
-    sslice.on_changed(update)
-    swidth.on_changed(update)
-    slevel.on_changed(update)
+    for slider in (sslice, swidth, slevel):
+        blit.add_slider(slider)
+        blit.on_changed(slider, update)
 
-    plt.show()  
+    if overlay is not None:
+        overlay.add_controls(plt.gcf(), blit, {view: sslice})
+    plt.show()
+    cache.close()
 
 
-def multi_view_window(mri_shape, mri_data, max_voxel):
+def multi_view_window(mri_shape, mri_data, max_voxel, cache=None, show_fps=False, pyramid=None, min_voxel=0, window=None, overlay=None, spacing=None, presets=None):
     ''' 
     Outputs a figure where the slices of the 3 views (sagittal, coronal or axial) can be viewed 
 
@@ -261,9 +642,24 @@ def multi_view_window(mri_shape, mri_data, max_voxel):
     mri_shape -- shape of the MRI array
     mri_data --  MRI array
     max_voxel -- maximum intensity of the MRI array 
+    cache -- SliceCache of the displayed slices (created if None)
+    show_fps -- shows the frames per second and latency of the slider updates
+    pyramid -- Pyramid of the MRI, its levels are displayed while scrubbing
+    min_voxel -- minimum intensity of the MRI array
+    window -- initial (window level, window width), e.g. from the intensity percentiles (default: the first preset, or max_voxel, 2*max_voxel)
+    overlay -- Overlay of a label map, with its opacity slider and label text box (None for no overlay)
+    spacing -- voxel spacing (x, y, z) in mm, sets the aspect of the pixels (None for square pixels)
+    presets -- dict of name: (window level, window width) selectable with buttons (e.g. from auto_window)
     '''
-    wl_init = max_voxel
-    ww_init = max_voxel*2
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import Slider
+    from blitting import BlitManager
+    if cache is None:
+        cache = slice_cache(mri_data, pyramid=pyramid)
+
+    if window is None and presets:
+        window = next(iter(presets.values()))
+    wl_init, ww_init = window if window is not None else (max_voxel, max_voxel*2)
     
     max_slice_cor = mri_shape[1]
     max_slice_axi = mri_shape[2]
@@ -271,36 +667,19 @@ def multi_view_window(mri_shape, mri_data, max_voxel):
     mid_slice_cor = mri_shape[1]//2
     max_slice_sag = mri_shape[0]
     mid_slice_axi = mri_shape[2]//2
-    sag_mid = windowing(mri_data, wl_init, ww_init)[mri_shape[0]//2, :, :]
-    cor_mid = windowing(mri_data, wl_init, ww_init)[:, mri_shape[1]//2, :]
-    axi_mid = windowing(mri_data, wl_init, ww_init)[:, :, mri_shape[2]//2]
 
     plt.style.use('dark_background')
     fig, axes = plt.subplots(1,3)
-    l_sag = axes[0].imshow(sag_mid.T, cmap='gray', origin='lower')
-    l_cor = axes[1].imshow(cor_mid.T, cmap='gray', origin='lower')
-    l_axi = axes[2].imshow(axi_mid.T, cmap='gray', origin='lower')
+    l_sag = SliceImage(axes[0], cache, 'sag', mri_shape, mid_slice_sag, (wl_init, ww_init), pyramid, overlay, spacing)
+    l_cor = SliceImage(axes[1], cache, 'cor', mri_shape, mid_slice_cor, (wl_init, ww_init), pyramid, overlay, spacing)
+    l_axi = SliceImage(axes[2], cache, 'axi', mri_shape, mid_slice_axi, (wl_init, ww_init), pyramid, overlay, spacing)
     axes[0].axis('off')
     axes[1].axis('off')
     axes[2].axis('off')
+    blit = BlitManager(fig, show_fps)
 
-    axiwindow_width = plt.axes([0.05, 0.25, 0.0225, 0.63])
-    swidth=Slider(ax=axiwindow_width, 
-        label='Window \n width ', 
-        valmin=1, 
-        valmax=np.max(mri_data)*2, 
-        valstep=1, 
-        valinit=ww_init,
-        orientation="vertical")
-    
-    axiwindow_level = plt.axes([0.92, 0.25, 0.0225, 0.63])
-    slevel=Slider(ax=axiwindow_level, 
-        label='Window \n level ', 
-        valmin=1, 
-        valmax=np.max(mri_data), 
-        valstep=1, 
-        valinit=wl_init,
-        orientation="vertical")
+    swidth, slevel = window_sliders((wl_init, ww_init), (min_voxel, max_voxel), 0.05, 0.92)
+    buttons = preset_buttons(presets, swidth, slevel) if presets else []
 
     # sagittal
     axislice_sag = plt.axes([0.25, 0.1, 0.65, 0.03])
@@ -311,16 +690,16 @@ def multi_view_window(mri_shape, mri_data, max_voxel):
         valstep=1, 
         valinit=mid_slice_sag)
     
-    def update_sag(val):
+    def update_sag():
         slice=np.around(sslice_sag.val)
         width=np.around(swidth.val)
         level=np.around(slevel.val)
-        l_sag.set_data(windowing(mri_data, level, width)[slice, :, :].T)
+        return l_sag.show(slice, (level, width))
 
 
-    sslice_sag.on_changed(update_sag)
-    swidth.on_changed(update_sag)
-    slevel.on_changed(update_sag)
+    l_sag.add_to(blit)
+    blit.add_slider(sslice_sag)
+    blit.on_changed(sslice_sag, update_sag)
 
     # coronal
     axislice_cor = plt.axes([0.25, 0.06, 0.65, 0.03])
@@ -331,16 +710,16 @@ def multi_view_window(mri_shape, mri_data, max_voxel):
         valstep=1, 
         valinit=mid_slice_cor)
     
-    def update_cor(val):
+    def update_cor():
         slice=np.around(sslice_cor.val)
         width=np.around(swidth.val)
         level=np.around(slevel.val)
-        l_cor.set_data(windowing(mri_data, level, width)[:, slice, :].T)
+        return l_cor.show(slice, (level, width))
 
 
-    sslice_cor.on_changed(update_cor)
-    swidth.on_changed(update_cor)
-    slevel.on_changed(update_cor)
+    l_cor.add_to(blit)
+    blit.add_slider(sslice_cor)
+    blit.on_changed(sslice_cor, update_cor)
 
     # axial
     axislice_axi = plt.axes([0.25, 0.02, 0.65, 0.03])
@@ -351,15 +730,31 @@ def multi_view_window(mri_shape, mri_data, max_voxel):
         valstep=1, 
         valinit=mid_slice_axi)
     
-    def update_axi(val):
+    def update_axi():
         slice=np.around(sslice_axi.val)
         width=np.around(swidth.val)
         level=np.around(slevel.val)
-        l_axi.set_data(windowing(mri_data, level, width)[:, :, slice].T)
+        return l_axi.show(slice, (level, width))
+
+
+    l_axi.add_to(blit)
+    blit.add_slider(sslice_axi)
+    blit.on_changed(sslice_axi, update_axi)
+
+    # window width/level changes re-window the 3 displayed slices once
+    def update_window():
+        width=np.around(swidth.val)
+        level=np.around(slevel.val)
+        return (l_sag.show(np.around(sslice_sag.val), (level, width)) +
+                l_cor.show(np.around(sslice_cor.val), (level, width)) +
+                l_axi.show(np.around(sslice_axi.val), (level, width)))
 
 
-    sslice_axi.on_changed(update_axi)
-    swidth.on_changed(update_axi)
-    slevel.on_changed(update_axi)
+    for slider in (swidth, slevel):
+        blit.add_slider(slider)
+        blit.on_changed(slider, update_window)
 
-    plt.show()
\ No newline at end of file
+    if overlay is not None:
+        overlay.add_controls(fig, blit, {'sag': sslice_sag, 'cor': sslice_cor, 'axi': sslice_axi})
+    plt.show()
+    cache.close()
@@ -0,0 +1,64 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Headless batch montages: output paths and rendering'''
+
+import os
+import nibabel as nib
+import numpy as np
+import brain_mri_viewer
+from batch import find_nifti, montage_paths, render_montage, run_batch
+
+
+def write_nifti(path, seed=0):
+    mri_data = np.random.default_rng(seed).normal(500, 100, size=(8, 9, 10)).astype(np.float32)
+    nib.save(nib.Nifti1Image(mri_data, np.eye(4)), str(path))
+
+
+def test_montage_paths():
+    files = [('in/scan.nii', 'scan.nii'), ('in/scan.nii.gz', 'scan.nii.gz'), ('in/other.nii.gz', 'other.nii.gz'),
+             ('a/sub.nii.gz', 'sub.nii.gz'), ('b/sub.nii.gz', 'sub.nii.gz')]
+    assert montage_paths(files, 'out') == [os.path.join('out', 'scan.nii_montage.png'), os.path.join('out', 'scan.nii.gz_montage.png'),
+                                           os.path.join('out', 'other_montage.png'), None, None]
+
+
+def test_run_batch_same_stem(tmp_path):
+    # scan.nii and scan.nii.gz in one directory get a montage each
+    os.makedirs(tmp_path / 'in')
+    write_nifti(tmp_path / 'in' / 'scan.nii', 0)
+    write_nifti(tmp_path / 'in' / 'scan.nii.gz', 1)
+    out_dir = tmp_path / 'out'
+    assert run_batch([str(tmp_path / 'in')], str(out_dir), workers=2, raster=True) == 0
+    assert sorted(os.listdir(out_dir)) == ['scan.nii.gz_montage.png', 'scan.nii_montage.png']
+    assert len(find_nifti([str(tmp_path / 'in')])) == 2
+
+
+def test_run_batch_collision_fails(tmp_path):
+    for name in ('a', 'b'):
+        os.makedirs(tmp_path / name)
+        write_nifti(tmp_path / name / 'sub.nii.gz')
+    assert run_batch([str(tmp_path / 'a' / '*.nii.gz'), str(tmp_path / 'b' / '*.nii.gz')], str(tmp_path / 'out'), workers=1, raster=True) == 2
+
+
+def test_render_montage_skips_stats(tmp_path, monkeypatch):
+    def volume_stats(*args, **kwargs):
+        raise AssertionError('the montage computed the intensity statistics')
+    monkeypatch.setattr(brain_mri_viewer, 'volume_stats', volume_stats)
+    write_nifti(tmp_path / 'scan.nii.gz')
+    out_path = str(tmp_path / 'scan_montage.png')
+    assert render_montage(str(tmp_path / 'scan.nii.gz'), out_path, raster=True) == 8 * 9 * 10
+    assert os.path.getsize(out_path) > 0
@@ -0,0 +1,114 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+'''SQLite catalog: incremental indexing and query filters'''
+
+import os
+import nibabel as nib
+import numpy as np
+import pytest
+import catalog
+from catalog import index, index_main, parse_shape, query
+
+
+def write_nifti(path, shape=(4, 5, 6), zooms=(1, 1, 1), dtype=np.int16, affine=None):
+    image = nib.Nifti1Image(np.zeros(shape, dtype=dtype), np.eye(4) if affine is None else affine)
+    image.header.set_zooms(zooms[:len(shape)] + (2.0,) * (len(shape) - len(zooms)))
+    nib.save(image, str(path))
+
+
+@pytest.fixture
+def scans(tmp_path):
+    root = tmp_path / 'scans'
+    os.makedirs(root / 'sub-01')
+    os.makedirs(root / 'sub-02')
+    write_nifti(root / 'sub-01' / 't1.nii.gz', (4, 5, 6), (1, 1, 1))
+    write_nifti(root / 'sub-01' / 'bold.nii.gz', (4, 5, 6, 7), (3, 3, 3), np.float32)
+    write_nifti(root / 'sub-02' / 't1.nii.gz', (4, 5, 6), (1.005, 1, 1), affine=np.diag([-1, -1, 1, 1]))
+    write_nifti(root / 'sub-02' / 't2.nii', (8, 8, 4), (0.5, 0.5, 2))
+    return root
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    paths = []
+    read_header = catalog.read_header
+
+    def counting_read_header(path, stat):
+        paths.append(os.path.basename(os.path.dirname(path)) + '/' + os.path.basename(path))
+        return read_header(path, stat)
+    monkeypatch.setattr(catalog, 'read_header', counting_read_header)
+    return paths
+
+
+def names(rows):
+    return [os.path.relpath(row['path'], os.path.dirname(os.path.dirname(row['path']))) for row in rows]
+
+
+def test_incremental_index(scans, tmp_path, reads):
+    db = str(tmp_path / 'index.sqlite')
+    assert index([str(scans)], db, workers=2) == 0
+    assert sorted(reads) == ['sub-01/bold.nii.gz', 'sub-01/t1.nii.gz', 'sub-02/t1.nii.gz', 'sub-02/t2.nii']
+
+    # unchanged files are not read again
+    reads.clear()
+    assert index([str(scans)], db, workers=2) == 0
+    assert reads == []
+
+    # a changed file is read again, a removed file is deleted
+    write_nifti(scans / 'sub-02' / 't2.nii', (8, 8, 5), (0.5, 0.5, 2))
+    stat = os.stat(scans / 'sub-02' / 't2.nii')
+    os.utime(scans / 'sub-02' / 't2.nii', (stat.st_atime, stat.st_mtime + 10))
+    os.remove(scans / 'sub-01' / 'bold.nii.gz')
+    reads.clear()
+    assert index([str(scans)], db, workers=2) == 0
+    assert reads == ['sub-02/t2.nii']
+    rows = query(db)
+    assert names(rows) == ['sub-01/t1.nii.gz', 'sub-02/t1.nii.gz', 'sub-02/t2.nii']
+    assert (rows[2]['nx'], rows[2]['ny'], rows[2]['nz']) == (8, 8, 5)
+
+
+def test_broken_files_keep_failing(scans, tmp_path, reads):
+    db = str(tmp_path / 'index.sqlite')
+    (scans / 'sub-02' / 'broken.nii').write_bytes(b'not a nifti file')
+    assert index([str(scans)], db, workers=2) == 1
+    reads.clear()
+    assert index_main([str(scans), '--db', db]) == 1
+    assert reads == ['sub-02/broken.nii']
+    assert 'sub-02/broken.nii' not in names(query(db))
+
+    # once fixed, the file is indexed and the run succeeds
+    write_nifti(scans / 'sub-02' / 'broken.nii')
+    stat = os.stat(scans / 'sub-02' / 'broken.nii')
+    os.utime(scans / 'sub-02' / 'broken.nii', (stat.st_atime, stat.st_mtime + 10))
+    assert index_main([str(scans), '--db', db]) == 0
+    assert 'sub-02/broken.nii' in names(query(db))
+
+
+def test_query_filters(scans, tmp_path):
+    db = str(tmp_path / 'index.sqlite')
+    index([str(scans)], db, workers=2)
+    assert len(query(db)) == 4
+    assert names(query(db, shape=parse_shape('4x5x6'))) == ['sub-01/bold.nii.gz', 'sub-01/t1.nii.gz', 'sub-02/t1.nii.gz']
+    assert names(query(db, shape=parse_shape('8,8'))) == ['sub-02/t2.nii']
+    assert names(query(db, orientation='lps')) == ['sub-02/t1.nii.gz']
+    assert names(query(db, dim=4)) == names(query(db, volumes=7)) == ['sub-01/bold.nii.gz']
+    assert names(query(db, dtype='float32')) == ['sub-01/bold.nii.gz']
+    assert names(query(db, voxel_size=(1,))) == ['sub-01/t1.nii.gz', 'sub-02/t1.nii.gz']
+    assert names(query(db, voxel_size=(1,), tolerance=0.001)) == ['sub-01/t1.nii.gz']
+    assert names(query(db, voxel_size=(0.5, 0.5, 2))) == ['sub-02/t2.nii']
+    assert names(query(db, pattern='*/sub-02/*', shape=(4, 5, 6))) == ['sub-02/t1.nii.gz']
+    assert query(db, orientation='RAS', dtype='uint8') == []
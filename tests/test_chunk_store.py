@@ -0,0 +1,115 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Chunked stores round-tripped from synthetic NifTi files and compared with the nibabel dataobj'''
+
+import os
+import nibabel as nib
+import numpy as np
+import pytest
+from chunk_store import StoreImage, convert, is_valid, open_store
+from reorient import reorient_to_ras
+
+CHUNK = 4
+# 11 and 9 are not multiples of the chunk, 8 is
+SHAPE = (11, 8, 9)
+KEYS = [
+    (3, slice(None), slice(None)),
+    (4, slice(None), slice(None)),
+    (slice(None), 7, slice(None)),
+    (slice(None), slice(None), 8),
+    (-1, slice(None), slice(None)),
+    (slice(None), -5, slice(None)),
+    (slice(None), slice(None), -9),
+    (slice(2, 10), slice(3, 5), slice(None)),
+    (slice(None, None, 3), slice(1, None, 2), 4),
+    (slice(-3, None), slice(None, -4), slice(7, 2, -1)),
+    (Ellipsis, 5),
+    (5, 3, 2),
+    Ellipsis,
+]
+
+
+def write_nifti(path, shape, slope=None, inter=None):
+    '''
+    Writes an int16 NifTi file in LPI orientation, optionally with a scale factor
+    '''
+    rng = np.random.default_rng(0)
+    mri_data = rng.integers(-2000, 2000, size=shape).astype(np.int16)
+    affine = np.diag([-1.0, -2.0, -3.0, 1.0])
+    mri = nib.Nifti1Image(mri_data, affine)
+    if slope is not None:
+        mri.header.set_slope_inter(slope, inter)
+    nib.save(mri, path)
+    return path
+
+
+def expected_ras(in_path, volume=None):
+    mri = nib.load(in_path)
+    mri_data = np.asanyarray(mri.dataobj)
+    if volume is not None:
+        mri_data = mri_data[..., volume]
+    return reorient_to_ras(mri_data, mri.affine)
+
+
+@pytest.mark.parametrize('slope, inter', [(None, None), (2.0, 10.0)])
+def test_convert_3d(tmp_path, slope, inter):
+    in_path = write_nifti(str(tmp_path / 'mri.nii.gz'), SHAPE, slope, inter)
+    path = convert(in_path, str(tmp_path / 'mri.store'), chunk=CHUNK)
+    assert is_valid(path, in_path)
+    store = StoreImage(path)
+    expected = expected_ras(in_path)
+    assert store.shape == expected.shape
+    assert store.dataobj.dtype == expected.dtype
+    # voxels are stored scaled, the header of the store has no scale factor
+    assert (store.dataobj.slope, store.dataobj.inter) == (1.0, 0.0)
+    assert store.intensity_range() == (expected.min(), expected.max())
+    assert ''.join(nib.aff2axcodes(store.affine)) == 'RAS'
+    for key in KEYS:
+        np.testing.assert_array_equal(store.dataobj[key], expected[key])
+    np.testing.assert_array_equal(np.asarray(store.dataobj), expected)
+
+
+def test_convert_4d(tmp_path):
+    in_path = write_nifti(str(tmp_path / 'series.nii.gz'), SHAPE + (3,), 0.5, -1.0)
+    store = StoreImage(convert(in_path, str(tmp_path / 'series.store'), chunk=CHUNK))
+    # LPI is flipped to RAS without permuting the axes
+    assert store.shape == SHAPE + (3,)
+    for t in range(3):
+        expected = expected_ras(in_path, t)
+        volume = store.dataobj.volume(t)
+        assert volume.shape == expected.shape
+        for key in KEYS:
+            np.testing.assert_array_equal(volume[key], expected[key])
+        np.testing.assert_array_equal(store.dataobj[..., t], expected)
+        assert store.intensity_range(t) == (expected.min(), expected.max())
+    series = np.stack([expected_ras(in_path, t) for t in range(3)], axis=-1)
+    np.testing.assert_array_equal(store.dataobj[2, :, -1, :], series[2, :, -1, :])
+    assert store.intensity_range() == (series.min(), series.max())
+
+
+def test_open_store_reconverts_changed_file(tmp_path):
+    in_path = write_nifti(str(tmp_path / 'mri.nii'), SHAPE)
+    cache_dir = str(tmp_path / 'cache')
+    open_store(in_path, cache_dir, chunk=CHUNK)
+    stores = os.listdir(cache_dir)
+    assert len(stores) == 1
+    # a rewritten file (other size) invalidates the store
+    write_nifti(in_path, SHAPE[:2] + (10,))
+    assert not is_valid(os.path.join(cache_dir, stores[0]), in_path)
+    store = open_store(in_path, cache_dir, chunk=CHUNK)
+    np.testing.assert_array_equal(np.asarray(store.dataobj), expected_ras(in_path))
@@ -0,0 +1,55 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+'''Parallel loading of the compared MRIs into shared memory'''
+
+import os
+import nibabel as nib
+import numpy as np
+import pytest
+from compare import load_scans
+
+
+def shared_blocks():
+    return set(os.listdir('/dev/shm'))
+
+
+def write_nifti(path, seed=0):
+    mri_data = np.random.default_rng(seed).normal(500, 100, size=(8, 9, 10)).astype(np.float32)
+    nib.save(nib.Nifti1Image(mri_data, np.eye(4)), str(path))
+    return mri_data
+
+
+@pytest.mark.skipif(not os.path.isdir('/dev/shm'), reason='shared memory blocks are not listed in /dev/shm')
+def test_load_scans(tmp_path):
+    before = shared_blocks()
+    mri_data = [write_nifti(tmp_path / ('scan%d.nii' % i), i) for i in range(2)]
+    scans = load_scans([str(tmp_path / 'scan0.nii'), str(tmp_path / 'scan1.nii')], workers=2)
+    for scan, data in zip(scans, mri_data):
+        np.testing.assert_allclose(scan.mri_data, data)
+    for scan in scans:
+        scan.close()
+    assert shared_blocks() == before
+
+
+@pytest.mark.skipif(not os.path.isdir('/dev/shm'), reason='shared memory blocks are not listed in /dev/shm')
+def test_load_scans_failure_frees_blocks(tmp_path):
+    before = shared_blocks()
+    write_nifti(tmp_path / 'scan0.nii')
+    write_nifti(tmp_path / 'scan2.nii')
+    with pytest.raises(FileNotFoundError):
+        load_scans([str(tmp_path / 'scan0.nii'), str(tmp_path / 'missing.nii'), str(tmp_path / 'scan2.nii')], workers=3)
+    assert shared_blocks() == before
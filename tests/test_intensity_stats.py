@@ -0,0 +1,61 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Streaming intensity statistics of 3D and 4D MRIs'''
+
+import nibabel as nib
+import numpy as np
+import pytest
+from brain_mri_viewer import MRI
+from intensity_stats import volume_stats
+
+
+def synthetic_series(shape=(9, 10, 11, 4)):
+    '''
+    4D MRI whose later volumes are brighter, so the first volume does not have the range of the series
+    '''
+    rng = np.random.default_rng(0)
+    mri_data = rng.normal(500, 100, size=shape)
+    mri_data += 100 * np.arange(shape[3])
+    return mri_data
+
+
+@pytest.mark.parametrize('slab', [1, 3, 8, 64])
+@pytest.mark.parametrize('ndim', [3, 4])
+def test_volume_stats(slab, ndim):
+    mri_data = synthetic_series()
+    if ndim == 3:
+        mri_data = mri_data[..., 0]
+    stats = volume_stats(mri_data, slab)
+    assert stats.count == mri_data.size
+    assert stats.min == mri_data.min() and stats.max == mri_data.max()
+    assert stats.mean == pytest.approx(mri_data.mean())
+    assert stats.std == pytest.approx(mri_data.std())
+    # percentiles are interpolated inside the histogram bins
+    assert stats.percentile(50) == pytest.approx(np.percentile(mri_data, 50), abs=2 * stats.width)
+
+
+def test_series_stats_cover_all_volumes(tmp_path):
+    mri_data = synthetic_series().astype(np.float32)
+    path = str(tmp_path / 'series.nii.gz')
+    nib.save(nib.Nifti1Image(mri_data, np.eye(4)), path)
+    mri = MRI(nib.load(path))
+    mri.extract_info(None, series=True)
+    assert mri.min_voxel == mri_data.min()
+    assert mri.max_voxel == mri_data.max()
+    assert mri.max_voxel > mri_data[..., 0].max()
+    assert mri.intensity_stats().count == mri_data.size
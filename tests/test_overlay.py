@@ -0,0 +1,165 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Label map overlays: pixel aspect of the slices, label index and color lookup table'''
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+from overlay import LabelIndex, Overlay, read_lut
+from view_slices import VIEWS, SliceImage, plot_montage, slice_aspect, slice_cache
+
+SHAPE = (12, 10, 8)
+SPACING = (1.0, 1.0, 3.0)
+
+
+def synthetic_labels():
+    label_data = np.zeros(SHAPE, dtype=np.int16)
+    label_data[2:5, 3:7, 1:3] = 17
+    label_data[6:11, 1:4, 4:8] = 53
+    return label_data
+
+
+@pytest.mark.parametrize('view', VIEWS)
+@pytest.mark.parametrize('with_overlay', [False, True])
+def test_slice_image_aspect(view, with_overlay):
+    mri_data = np.random.default_rng(0).normal(size=SHAPE)
+    overlay = Overlay(synthetic_labels()) if with_overlay else None
+    fig, ax = plt.subplots()
+    cache = slice_cache(mri_data, prefetch=0)
+    SliceImage(ax, cache, view, SHAPE, SHAPE[VIEWS.index(view)] // 2, overlay=overlay, spacing=SPACING)
+    assert ax.get_aspect() == pytest.approx(slice_aspect(SPACING, view))
+    plt.close(fig)
+
+
+@pytest.mark.parametrize('with_overlay', [False, True])
+def test_montage_aspect(with_overlay):
+    mri_data = np.random.default_rng(0).normal(size=SHAPE)
+    overlay = Overlay(synthetic_labels()) if with_overlay else None
+    fig = plt.figure()
+    plot_montage(fig, mri_data, SHAPE, nslices=2, overlay=overlay, spacing=SPACING)
+    aspects = [ax.get_aspect() for ax in fig.axes]
+    assert aspects == pytest.approx([slice_aspect(SPACING, view) for view in VIEWS for _ in range(2)])
+    plt.close(fig)
+
+
+def test_coronal_aspect():
+    # coronal slices of (1, 1, 3) mm voxels are 3 times taller than wide
+    assert slice_aspect(SPACING, 'cor') == 3.0
+
+
+LUT = """#$Id: FreeSurferColorLUT.txt
+#No. Label Name:                            R   G   B   A
+
+0   Unknown                                 0   0   0   0
+17  Left-Hippocampus                        220 216 20  0
+53  Right-Hippocampus                       220 216 20  0
+  2 Left-Cerebral-White-Matter              245 245 245 0
+bad line
+1000 ctx-lh-unknown 25 5
+"""
+
+
+def brute_force_boxes(label_data, view, slice):
+    mri_slice = np.moveaxis(label_data, VIEWS.index(view), 0)[slice]
+    boxes = {}
+    for label in np.unique(mri_slice[mri_slice != 0]):
+        rows, cols = np.nonzero(mri_slice == label)
+        boxes[int(label)] = (rows.min(), rows.max(), cols.min(), cols.max())
+    return boxes
+
+
+def random_labels(labels, seed=0):
+    rng = np.random.default_rng(seed)
+    label_data = rng.choice(np.asarray([0] * 6 + list(labels)), size=SHAPE)
+    return label_data
+
+
+def test_read_lut(tmp_path):
+    path = tmp_path / 'lut.txt'
+    path.write_text(LUT)
+    colors, names = read_lut(str(path))
+    assert names == {0: 'Unknown', 17: 'Left-Hippocampus', 53: 'Right-Hippocampus', 2: 'Left-Cerebral-White-Matter'}
+    assert colors[17] == (220, 216, 20) and colors[2] == (245, 245, 245)
+
+
+@pytest.mark.parametrize('labels', [[17, 53], [1, 2, 3, 4000], [-5, 3, 70000]])
+def test_label_index(labels):
+    label_data = random_labels(labels).astype(np.int32)
+    index = LabelIndex(label_data)
+    present = sorted(int(label) for label in np.unique(label_data) if label != 0)
+    assert list(index.labels) == present
+    for view in VIEWS:
+        for slice in range(label_data.shape[VIEWS.index(view)]):
+            boxes = brute_force_boxes(label_data, view, slice)
+            assert index.labels_in(view, slice) == boxes
+            if boxes:
+                union = np.array(list(boxes.values()))
+                assert index.bbox(view, slice) == (union[:, 0].min(), union[:, 1].max(), union[:, 2].min(), union[:, 3].max())
+            else:
+                assert index.bbox(view, slice) is None
+
+
+def test_jump():
+    label_data = synthetic_labels()
+    # a larger cross-section of label 17 on sagittal slice 3
+    label_data[3, 0:9, 0:8] = 17
+    index = LabelIndex(label_data)
+    assert index.jump(17)['sag'] == 3
+    slices = index.jump(53)
+    for view, slice in slices.items():
+        axis = VIEWS.index(view)
+        counts = np.sum(np.moveaxis(label_data, axis, 0) == 53, axis=(1, 2))
+        assert slice == int(np.argmax(counts))
+    assert index.jump(99) is None
+
+
+def test_empty_label_map():
+    index = LabelIndex(np.zeros(SHAPE, dtype=np.int16))
+    assert len(index.labels) == 0
+    assert index.bbox('axi', 0) is None and index.labels_in('axi', 0) == {}
+    assert Overlay(np.zeros(SHAPE, dtype=np.int16)).rgba('axi', 0) == (None, None)
+
+
+def test_overlay_lut_and_find(tmp_path):
+    path = tmp_path / 'lut.txt'
+    path.write_text(LUT)
+    overlay = Overlay(synthetic_labels(), str(path), opacity=0.5)
+    assert overlay.find('left-hippocampus') == 17 and overlay.find(' 53 ') == 53 and overlay.find('nothing') is None
+    assert overlay.name(17) == 'Left-Hippocampus' and overlay.name(8) == '8'
+    image, extent = overlay.rgba('axi', 1)
+    assert extent == (1.5, 4.5, 2.5, 6.5)
+    # rows of the image are the second axis of the slice (displayed transposed)
+    assert image.shape == (4, 3, 4)
+    assert tuple(image[0, 0]) == (220, 216, 20, 128)
+    overlay.set_opacity(0)
+    assert overlay.rgba('axi', 1)[0][..., 3].max() == 0
+
+
+@pytest.mark.parametrize('labels', [[17, 53], [-5, 3, 70000]])
+def test_colorize(labels):
+    label_data = random_labels(labels).astype(np.int32)
+    overlay = Overlay(label_data.astype(np.float32))
+    assert overlay.dense == (min(labels) > 0 and max(labels) < 2**16)
+    image = overlay.colorize(label_data[:, :, 2])
+    assert np.all(image[label_data[:, :, 2] == 0] == 0)
+    for label in labels:
+        colors = image[label_data[:, :, 2] == label]
+        if len(colors):
+            assert np.all(colors == colors[0]) and colors[0, 3] > 0
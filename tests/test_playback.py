@@ -0,0 +1,66 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Gray scale of the 4D playback viewer'''
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import nibabel as nib
+import numpy as np
+import pytest
+import playback
+from brain_mri_viewer import MRI
+
+
+@pytest.fixture
+def figure(monkeypatch):
+    '''
+    Records the figure of the viewer instead of showing it
+    '''
+    shown = []
+    monkeypatch.setattr(playback.plt, 'show', lambda: shown.append(plt.gcf()))
+    yield shown
+    plt.close('all')
+
+
+def series_clims(figure, tmp_path, window=None):
+    rng = np.random.default_rng(0)
+    mri_data = rng.normal(500, 50, size=(8, 9, 10, 4)).astype(np.float32)
+    # later volumes are brighter than the first one
+    mri_data += 300 * np.arange(4, dtype=np.float32)
+    path = str(tmp_path / 'series.nii.gz')
+    nib.save(nib.Nifti1Image(mri_data, np.eye(4)), path)
+    mri = MRI(nib.load(path))
+    mri.extract_info(None, series=True)
+    mri.check_coord()
+    playback.play_series(mri.mri_shape, mri.mri_data, playback.VIEWS, (mri.min_voxel, mri.max_voxel), window, buffer_size=2)
+    images = [image for ax in figure[0].axes for image in ax.images]
+    return mri_data, [image.get_clim() for image in images]
+
+
+def test_gray_scale_covers_series(figure, tmp_path):
+    mri_data, clims = series_clims(figure, tmp_path)
+    assert len(clims) == 3
+    for vmin, vmax in clims:
+        assert vmin == mri_data.min() and vmax == mri_data.max()
+
+
+def test_windowed_gray_scale(figure, tmp_path):
+    # windowing scales the voxels inside the window to [0, max_window]
+    mri_data, clims = series_clims(figure, tmp_path, window=(900, 400))
+    assert clims == [(0, 1100)] * 3
@@ -0,0 +1,71 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Sliding-slab intensity projections checked against brute-force reductions of each slab'''
+
+import numpy as np
+import pytest
+from projection import SlidingProjection, projection
+from view_slices import VIEWS
+
+SHAPE = (11, 7, 9)
+REDUCTIONS = {'mip': np.max, 'minip': np.min, 'aip': np.mean}
+
+
+def synthetic_volume():
+    return np.random.default_rng(0).integers(-1000, 1000, size=SHAPE).astype(np.int16)
+
+
+def brute_force(mri_data, view, mode, start, thickness):
+    '''
+    Reduction of the slab [start, start + thickness) clipped to the MRI, as SlidingProjection clips it
+    '''
+    axis = VIEWS.index(view)
+    n = mri_data.shape[axis]
+    low = max(0, min(start, n - 1))
+    high = min(low + thickness, n)
+    mri_slab = np.take(mri_data, np.arange(low, high), axis=axis)
+    return REDUCTIONS[mode](mri_slab.astype(np.float64) if mode == 'aip' else mri_slab, axis=axis)
+
+
+@pytest.mark.parametrize('mode', sorted(REDUCTIONS))
+@pytest.mark.parametrize('view', VIEWS)
+@pytest.mark.parametrize('thickness', [1, 2, 3, 4, 5, 7, 9, 11, 20])
+def test_sliding_projection(mode, view, thickness):
+    mri_data = synthetic_volume()
+    sliding = SlidingProjection(mri_data, view, mode, thickness, max_blocks=2)
+    n = SHAPE[VIEWS.index(view)]
+    # forward, backward and jumping slabs, including the first and last slices and starts outside the MRI
+    starts = list(range(-1, n + 2)) + list(range(n, -2, -1)) + [0, n - 1, n // 2, 0]
+    for start in starts:
+        expected = brute_force(mri_data, view, mode, start, thickness)
+        mri_projection = sliding.get(start)
+        if mode == 'aip':
+            np.testing.assert_allclose(mri_projection, expected, rtol=1e-12)
+        else:
+            np.testing.assert_array_equal(mri_projection, expected)
+            assert mri_projection.dtype == mri_data.dtype
+    assert len(sliding.blocks) <= 2
+
+
+@pytest.mark.parametrize('mode', sorted(REDUCTIONS))
+@pytest.mark.parametrize('view', VIEWS)
+@pytest.mark.parametrize('slab', [1, 4, 16])
+def test_projection(mode, view, slab):
+    mri_data = synthetic_volume()
+    expected = brute_force(mri_data, view, mode, 0, SHAPE[VIEWS.index(view)])
+    np.testing.assert_allclose(projection(mri_data, view, mode, slab), expected, rtol=1e-12)
@@ -0,0 +1,107 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Reorientation to RAS of synthetic MRIs in each of the 48 axis orientations'''
+
+import itertools
+import nibabel as nib
+import numpy as np
+import pytest
+from nibabel.orientations import apply_orientation, axcodes2ornt, ornt_transform
+from reorient import ReorientedProxy, ras_affine, ras_shape, ras_transform, reorient_to_ras
+
+SHAPE = (5, 6, 7)
+ZOOMS = (1.0, 2.0, 3.0)
+AXIS_CODES = [''.join(pair[flip] for pair, flip in zip(pairs, flips))
+              for pairs in itertools.permutations([('R', 'L'), ('A', 'P'), ('S', 'I')])
+              for flips in itertools.product([0, 1], repeat=3)]
+
+KEYS = [
+    (2, slice(None), slice(None)),
+    (slice(None), 3, slice(None)),
+    (slice(None), slice(None), -1),
+    (slice(1, 4), slice(None, None, -1), 0),
+    (slice(None, None, -2), Ellipsis),
+    (Ellipsis, slice(5, 1, -1)),
+    Ellipsis,
+    -2,
+]
+
+
+def synthetic_affine(codes):
+    '''
+    Affine of a voxel grid whose axes point along the given axis codes, with
+    a different voxel size and an offset on each axis
+    '''
+    affine = np.eye(4)
+    for axis, (ras_axis, flip) in enumerate(axcodes2ornt(codes)):
+        affine[:3, axis] = 0
+        affine[int(ras_axis), axis] = flip * ZOOMS[axis]
+    affine[:3, 3] = [-10, 20, 5]
+    return affine
+
+
+def expected_ras(mri_data, codes):
+    '''
+    Reference RAS array computed by nibabel from the axis codes
+    '''
+    return apply_orientation(mri_data, ornt_transform(axcodes2ornt(codes), axcodes2ornt('RAS')))
+
+
+def test_axis_codes():
+    assert len(set(AXIS_CODES)) == 48
+
+
+@pytest.mark.parametrize('codes', AXIS_CODES)
+def test_reorient_array(codes):
+    affine = synthetic_affine(codes)
+    assert ''.join(nib.aff2axcodes(affine)) == codes
+    mri_data = np.arange(np.prod(SHAPE), dtype=np.float64).reshape(SHAPE)
+    mri_ras = reorient_to_ras(mri_data, affine)
+    np.testing.assert_array_equal(mri_ras, expected_ras(mri_data, codes))
+    assert mri_ras.shape == ras_shape(affine, SHAPE)
+    # strided view, no copy
+    assert np.shares_memory(mri_ras, mri_data)
+
+
+@pytest.mark.parametrize('codes', AXIS_CODES)
+def test_ras_affine(codes):
+    affine = synthetic_affine(codes)
+    mri = nib.Nifti1Image(np.zeros(SHAPE, dtype=np.int16), affine)
+    canonical = nib.as_closest_canonical(mri)
+    np.testing.assert_allclose(ras_affine(affine, SHAPE), canonical.affine)
+    assert ''.join(nib.aff2axcodes(ras_affine(affine, SHAPE))) == 'RAS'
+
+
+@pytest.mark.parametrize('codes', AXIS_CODES)
+def test_reorient_proxy(codes, tmp_path):
+    affine = synthetic_affine(codes)
+    mri_data = np.arange(np.prod(SHAPE), dtype=np.int16).reshape(SHAPE)
+    path = str(tmp_path / 'mri.nii.gz')
+    nib.save(nib.Nifti1Image(mri_data, affine), path)
+    mri = nib.load(path)
+    expected = expected_ras(mri_data, codes)
+
+    mri_ras = reorient_to_ras(mri.dataobj, mri.affine)
+    if codes == 'RAS':
+        assert mri_ras is mri.dataobj
+        mri_ras = ReorientedProxy(mri.dataobj, ras_transform(mri.affine))
+    assert isinstance(mri_ras, ReorientedProxy)
+    assert mri_ras.shape == expected.shape
+    np.testing.assert_array_equal(np.asarray(mri_ras), expected)
+    for key in KEYS:
+        np.testing.assert_array_equal(mri_ras[key], expected[key])
@@ -0,0 +1,102 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+'''Volume cache of the slice server: memory budget and loading in the thread pool'''
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import nibabel as nib
+import numpy as np
+from serve import VolumeCache, load_volume, render_slice, volume_nbytes
+
+MB = 2**20
+
+
+class FakeSlices:
+    def __init__(self):
+        self.nbytes = 0
+
+
+class FakeMRI:
+    def __init__(self, path):
+        self.path = path
+        self.mri_data = np.zeros(MB, dtype=np.uint8)
+        self.isotropic = FakeSlices()
+
+
+def write_files(tmp_path, n):
+    paths = []
+    for i in range(n):
+        path = tmp_path / ('scan%d.nii' % i)
+        path.write_bytes(b'')
+        paths.append(str(path))
+    return paths
+
+
+def test_budget_counts_resampled_slices(tmp_path):
+    paths = write_files(tmp_path, 3)
+
+    async def run(cache):
+        a = await cache.get(paths[0])
+        b = await cache.get(paths[1])
+        assert cache.nbytes == 2 * MB and list(cache.volumes.values()) == [a, b]
+        # the resampled slices of a grow beyond the budget: the least recently used MRI is dropped
+        a.isotropic.nbytes = 2 * MB
+        assert await cache.get(paths[0]) is a
+        assert list(cache.volumes.values()) == [a] and cache.nbytes == 3 * MB
+        c = await cache.get(paths[2])
+        assert list(cache.volumes.values()) == [c] and cache.nbytes == MB
+        assert (cache.hits, cache.misses) == (1, 3)
+
+    with ThreadPoolExecutor(2) as executor:
+        asyncio.run(run(VolumeCache(lambda path, volume: FakeMRI(path), executor, max_mb=3)))
+
+
+def test_stat_and_load_in_thread_pool(tmp_path, monkeypatch):
+    paths = write_files(tmp_path, 1)
+    threads = []
+    stat = os.stat
+
+    def recording_stat(path, *args, **kwargs):
+        if path in paths:
+            threads.append(threading.current_thread())
+        return stat(path, *args, **kwargs)
+    monkeypatch.setattr(os, 'stat', recording_stat)
+
+    def loader(path, volume):
+        threads.append(threading.current_thread())
+        return FakeMRI(path)
+
+    async def run(cache):
+        first, second = await asyncio.gather(cache.get(paths[0]), cache.get(paths[0]))
+        assert first is second and cache.misses == 1
+
+    with ThreadPoolExecutor(2) as executor:
+        asyncio.run(run(VolumeCache(loader, executor)))
+    assert len(threads) == 3 and threading.main_thread() not in threads
+
+
+def test_volume_nbytes(tmp_path):
+    path = str(tmp_path / 'scan.nii')
+    mri_data = np.random.default_rng(0).normal(500, 100, size=(8, 9, 10)).astype(np.float32)
+    nib.save(nib.Nifti1Image(mri_data, np.diag([1, 1, 3, 1])), path)
+    mri = load_volume(path)
+    assert volume_nbytes(mri) == mri.mri_data.nbytes == mri_data.nbytes
+    body, shape = render_slice(mri, 'cor', 4, (500, 400), 'raw', isotropic=True)
+    assert len(body) == shape[0] * shape[1]
+    assert mri.isotropic.nbytes > 0 and volume_nbytes(mri) == mri_data.nbytes + mri.isotropic.nbytes
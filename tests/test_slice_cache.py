@@ -0,0 +1,202 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''LRU eviction, prefetching and closing of the cache of displayed slices'''
+
+import threading
+import time
+import numpy as np
+import pytest
+from slice_cache import SliceCache
+
+SLICE_BYTES = 8 * 8 * 8
+N_SLICES = {'sag': 20, 'cor': 20, 'axi': 20}
+
+
+class CountingLoader:
+    '''
+    Loader of 8x8 float64 slices filled with the slice index, counting the loads of each key
+    '''
+    def __init__(self):
+        self.loads = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, view, slice, window, level):
+        with self.lock:
+            key = (view, slice, window, level)
+            self.loads[key] = self.loads.get(key, 0) + 1
+        return np.full((8, 8), float(slice))
+
+
+def wait_for(condition, timeout=5.0):
+    '''
+    Waits for the prefetching thread to reach a condition
+    '''
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+@pytest.fixture
+def loader():
+    return CountingLoader()
+
+
+def test_hits_and_misses(loader):
+    cache = SliceCache(loader, N_SLICES, max_bytes=10 * SLICE_BYTES, prefetch=0)
+    assert cache.get('axi', 3)[0, 0] == 3
+    assert cache.get('axi', 3.0)[0, 0] == 3
+    cache.get('cor', 3)
+    cache.get('axi', 3, window=(100, 50))
+    assert loader.loads == {('axi', 3, None, 0): 1, ('cor', 3, None, 0): 1, ('axi', 3, (100, 50), 0): 1}
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['slices'], stats['bytes']) == (1, 3, 3, 3 * SLICE_BYTES)
+    assert cache.thread is None
+
+
+def test_lru_eviction(loader):
+    cache = SliceCache(loader, N_SLICES, max_bytes=3 * SLICE_BYTES, prefetch=0)
+    for slice in (0, 1, 2):
+        cache.get('axi', slice)
+    # slice 0 becomes the most recently used, so slice 1 is evicted first
+    cache.get('axi', 0)
+    cache.get('axi', 3)
+    assert [key[1] for key in cache.slices] == [2, 0, 3]
+    assert cache.nbytes == 3 * SLICE_BYTES and cache.evictions == 1
+    cache.get('axi', 1)
+    assert loader.loads['axi', 1, None, 0] == 2
+    assert [key[1] for key in cache.slices] == [0, 3, 1]
+
+
+def test_slice_larger_than_budget(loader):
+    # the last slice is kept even if it does not fit in the budget
+    cache = SliceCache(loader, N_SLICES, max_bytes=SLICE_BYTES // 2, prefetch=0)
+    cache.get('sag', 0)
+    cache.get('sag', 1)
+    assert list(cache.slices) == [('sag', 1, None, 0)]
+
+
+def test_clear(loader):
+    cache = SliceCache(loader, N_SLICES, prefetch=0)
+    cache.get('axi', 0)
+    cache.clear()
+    assert cache.stats()['slices'] == 0 and cache.nbytes == 0
+    cache.get('axi', 0)
+    assert loader.loads['axi', 0, None, 0] == 2
+
+
+@pytest.mark.parametrize('direction', [1, -1])
+def test_prefetch_direction(loader, direction):
+    cache = SliceCache(loader, N_SLICES, prefetch=3)
+    try:
+        cache.get('cor', 10)
+        cache.get('cor', 10 + direction)
+        expected = [('cor', 10 + direction * i, None, 0) for i in (2, 3, 4)]
+        assert wait_for(lambda: all(key in cache.slices for key in expected))
+        # nothing is prefetched behind the scrub direction
+        assert ('cor', 10 - direction, None, 0) not in loader.loads
+        assert cache.stats()['prefetched'] == 3
+        hits = cache.hits
+        cache.get('cor', 10 + 2 * direction)
+        assert cache.hits == hits + 1
+    finally:
+        cache.close()
+
+
+def test_prefetch_stops_at_the_ends(loader):
+    cache = SliceCache(loader, N_SLICES, prefetch=4)
+    try:
+        cache.get('sag', 17)
+        cache.get('sag', 18)
+        assert wait_for(lambda: ('sag', 19, None, 0) in cache.slices)
+        time.sleep(0.05)
+        assert all(0 <= key[1] < 20 for key in loader.loads)
+    finally:
+        cache.close()
+
+
+def test_no_prefetch_without_moving(loader):
+    cache = SliceCache(loader, N_SLICES, prefetch=4)
+    try:
+        cache.get('axi', 5)
+        cache.get('axi', 5)
+        time.sleep(0.05)
+        assert list(loader.loads) == [('axi', 5, None, 0)]
+    finally:
+        cache.close()
+
+
+def test_close_stops_the_thread(loader):
+    cache = SliceCache(loader, N_SLICES, prefetch=2)
+    assert cache.thread.is_alive()
+    cache.close()
+    cache.thread.join(timeout=5)
+    assert not cache.thread.is_alive()
+    # the cache still serves slices after closing, without prefetching
+    cache.get('axi', 1)
+    cache.get('axi', 2)
+    time.sleep(0.05)
+    assert ('axi', 3, None, 0) not in loader.loads
+
+
+def test_level_slices_are_shared(loader):
+    cache = SliceCache(loader, N_SLICES, prefetch=0)
+    # the full resolution slices 8 to 11 are the slice 2 of level 2
+    for slice in range(8, 12):
+        assert cache.get('axi', slice, level=2)[0, 0] == 2
+    assert loader.loads == {('axi', 2, None, 2): 1}
+    assert cache.stats()['slices'] == 1 and cache.hits == 3
+    cache.get('axi', 9, level=1)
+    cache.get('axi', 9)
+    assert ('axi', 4, None, 1) in loader.loads and ('axi', 9, None, 0) in loader.loads
+
+
+def test_level_prefetch(loader):
+    # 20 slices have 5 slices at level 2
+    cache = SliceCache(loader, N_SLICES, prefetch=4)
+    try:
+        cache.get('sag', 4, level=2)
+        cache.get('sag', 8, level=2)
+        assert wait_for(lambda: ('sag', 4, None, 2) in cache.slices)
+        time.sleep(0.05)
+        assert sorted(key[1] for key in loader.loads) == [1, 2, 3, 4]
+        # refining to full resolution does not reverse the scrub direction of the level
+        cache.get('sag', 8)
+        cache.get('sag', 9)
+        assert wait_for(lambda: ('sag', 13, None, 0) in cache.slices)
+        assert all(key[3] == 0 or key[1] < 5 for key in loader.loads)
+    finally:
+        cache.close()
+
+
+def test_pyramid_slice_cache():
+    from pyramid import Pyramid
+    from view_slices import display_slice, slice_cache
+    mri_data = np.random.default_rng(0).normal(size=(70, 64, 64)).astype(np.float32)
+    pyramid = Pyramid(mri_data, max_size=32, min_size=8, background=False)
+    cache = slice_cache(mri_data, prefetch=0, pyramid=pyramid)
+    levels = [level for level in pyramid.levels if level > 0]
+    for level in levels:
+        mri_level = pyramid.levels[level]
+        for slice in range(70):
+            expected = display_slice(mri_level, 'sag', min(slice // 2**level, mri_level.shape[0] - 1))
+            np.testing.assert_array_equal(cache.get('sag', slice, None, level), expected)
+    # one entry per slice of each level, not per full resolution slice
+    assert cache.stats()['slices'] == sum(-(-70 // 2**level) for level in levels)
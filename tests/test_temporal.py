@@ -0,0 +1,86 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Streaming voxelwise temporal maps checked against numpy reductions over the volumes'''
+
+import nibabel as nib
+import numpy as np
+import pytest
+from temporal import TemporalAccumulator, temporal_maps
+
+SHAPE = (6, 5, 7)
+N_VOLUMES = 13
+
+
+def synthetic_series(dtype=np.float64):
+    rng = np.random.default_rng(0)
+    # a large offset makes the merge of the variances numerically demanding
+    mri_data = 1e4 + rng.normal(0, 20, size=SHAPE + (N_VOLUMES,))
+    mri_data[0, 0, 0] = 5.0
+    return mri_data.astype(dtype)
+
+
+def expected_maps(mri_data):
+    mri_data = mri_data.astype(np.float64)
+    mean = np.mean(mri_data, axis=-1)
+    std = np.std(mri_data, axis=-1, ddof=1)
+    tsnr = np.divide(mean, std, out=np.zeros_like(mean), where=std > 0)
+    return {'mean': mean, 'std': std, 'tsnr': tsnr, 'max': np.max(mri_data, axis=-1)}
+
+
+def assert_maps(maps, expected):
+    for name in ('mean', 'std', 'tsnr', 'max'):
+        assert maps[name].dtype == np.float32
+        np.testing.assert_allclose(maps[name], expected[name], rtol=1e-5, atol=1e-5, err_msg=name)
+
+
+@pytest.mark.parametrize('block', [1, 2, 3, 5, 13, 20])
+def test_accumulator(block):
+    mri_data = synthetic_series()
+    accumulator = TemporalAccumulator(SHAPE)
+    for start in range(0, N_VOLUMES, block):
+        accumulator.update(mri_data[..., start:start+block])
+    assert accumulator.count == N_VOLUMES
+    assert_maps(accumulator.maps(), expected_maps(mri_data))
+
+
+@pytest.mark.parametrize('block', [1, 4, 5])
+@pytest.mark.parametrize('slab', [1, 2, 3, 7, 10])
+@pytest.mark.parametrize('workers', [1, 3])
+def test_temporal_maps(block, slab, workers):
+    # neither 13 volumes nor 7 slices are multiples of the block and slab sizes
+    mri_data = synthetic_series()
+    assert_maps(temporal_maps(mri_data, block, workers, slab), expected_maps(mri_data))
+
+
+def test_temporal_maps_default_slabs():
+    mri_data = synthetic_series()
+    assert_maps(temporal_maps(mri_data, block=4, workers=4), expected_maps(mri_data))
+
+
+def test_constant_voxels():
+    mri_data = np.full(SHAPE + (5,), 7.0)
+    maps = temporal_maps(mri_data, block=2, workers=2)
+    assert np.all(maps['std'] == 0) and np.all(maps['tsnr'] == 0)
+
+
+def test_temporal_maps_proxy(tmp_path):
+    mri_data = synthetic_series(np.float32)
+    path = str(tmp_path / 'series.nii.gz')
+    nib.save(nib.Nifti1Image(mri_data, np.eye(4)), path)
+    mri = nib.load(path, keep_file_open=True)
+    assert_maps(temporal_maps(mri.dataobj, block=3, workers=2, slab=3), expected_maps(mri_data))
@@ -0,0 +1,130 @@
+# Copyright (c) 2022 Enrique Mondragon Estrada
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Windowing kernel and lookup tables checked against the original masked implementation'''
+
+import numpy as np
+import pytest
+from view_slices import clip_scale, window_lut, windowing
+
+WINDOWS = [(800, 1600), (500, 301), (300, 200), (-50, 400), (1000, 1), (1000, 0)]
+
+
+def windowing_reference(mri_data, wl, ww):
+    '''
+    Original masked gather/scatter windowing (integer MRIs are cast to float64 as the kernel does)
+    '''
+    min_window = wl - ww // 2
+    max_window = wl + ww // 2
+    mri_window = mri_data.astype(mri_data.dtype if mri_data.dtype.kind == 'f' else np.float64)
+    mri_window [mri_window > max_window] = max_window
+    mri_window [mri_window < min_window] = min_window
+    mri_window [(mri_window > min_window) & (mri_window < max_window)] = max_window * (mri_window [(mri_window > min_window) & (mri_window < max_window)] - min_window)/(max_window - min_window)
+    return mri_window
+
+
+def synthetic_volume(dtype, shape=(16, 17, 18), seed=0):
+    '''
+    Random volume of a typical scanner range, with voxels on the bounds of the test windows
+    '''
+    rng = np.random.default_rng(seed)
+    mri_data = rng.normal(500, 500, size=shape)
+    if np.dtype(dtype).kind == 'u':
+        mri_data = np.abs(mri_data)
+    if np.dtype(dtype) == np.uint8:
+        mri_data = mri_data / 8
+    flat = mri_data.reshape(-1)
+    bounds = [wl + sign * (ww // 2) for wl, ww in WINDOWS for sign in (-1, 1)]
+    flat[:len(bounds)] = bounds
+    info = np.finfo(dtype) if np.dtype(dtype).kind == 'f' else np.iinfo(dtype)
+    return np.clip(mri_data, info.min, info.max).astype(dtype)
+
+
+def assert_window(mri_window, expected):
+    np.testing.assert_allclose(mri_window, expected, rtol=8 * np.finfo(expected.dtype).eps, atol=0)
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32', 'int16', 'uint16', 'uint8'])
+@pytest.mark.parametrize('wl, ww', WINDOWS)
+def test_windowing_matches_reference(dtype, wl, ww):
+    mri_data = synthetic_volume(dtype)
+    mri_window = windowing(mri_data, wl, ww)
+    expected = windowing_reference(mri_data, wl, ww)
+    assert mri_window.dtype == expected.dtype
+    assert mri_window.shape == mri_data.shape
+    assert_window(mri_window, expected)
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32', 'int16'])
+@pytest.mark.parametrize('wl, ww', [(300, 200), (-50, 401)])
+def test_window_bounds(dtype, wl, ww):
+    min_window, max_window = wl - ww // 2, wl + ww // 2
+    mri_data = np.array([min_window - 10, min_window, min_window + 1, wl, max_window - 1, max_window, max_window + 10], dtype=dtype)
+    mri_window = windowing(mri_data, wl, ww)
+    # voxels on or below the lower bound keep it (they are not scaled to 0)
+    assert mri_window[0] == min_window and mri_window[1] == min_window
+    np.testing.assert_allclose(mri_window[-2:], max_window, rtol=8 * np.finfo(mri_window.dtype).eps)
+    assert_window(mri_window, windowing_reference(mri_data, wl, ww))
+
+
+@pytest.mark.parametrize('ww', [0, 1])
+def test_empty_window(ww):
+    # a width of 0 or 1 is a window of a single intensity: the MRI is thresholded
+    mri_data = synthetic_volume('float64')
+    np.testing.assert_array_equal(windowing(mri_data, 700, ww), np.full(mri_data.shape, 700.0))
+
+
+def test_odd_width():
+    # the bounds are wl -/+ ww // 2, as in the original implementation
+    mri_data = np.array([89.0, 91.0, 100.0, 110.0, 111.0])
+    np.testing.assert_allclose(windowing(mri_data, 100, 21), [90.0, 110 / 20, 110 / 20 * 10, 110.0, 110.0])
+
+
+def test_negative_int16_lut():
+    # negative voxels are looked up through their unsigned bit pattern
+    mri_data = np.array([-32768, -1000, -1, 0, 1, 32767], dtype=np.int16)
+    mri_window = windowing(mri_data, -500, 1000)
+    assert mri_data.view(np.uint16)[1] > 32767
+    assert_window(mri_window, windowing_reference(mri_data, -500, 1000))
+    lut = window_lut(np.dtype(np.int16).str, -1000, 0)
+    assert lut.shape == (65536,) and not lut.flags.writeable
+    assert lut[np.uint16(np.int16(-1000).view(np.uint16))] == -1000
+
+
+@pytest.mark.parametrize('dtype, out_dtype', [('float64', 'float64'), ('float32', 'float32'), ('int16', 'float64'), ('uint8', 'float64')])
+def test_out(dtype, out_dtype):
+    mri_data = synthetic_volume(dtype)
+    out = np.empty(mri_data.shape, dtype=out_dtype)
+    mri_window = windowing(mri_data, 500, 301, out=out)
+    assert mri_window is out
+    assert_window(out, windowing_reference(mri_data, 500, 301))
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+def test_out_in_place(dtype):
+    mri_data = synthetic_volume(dtype)
+    expected = windowing_reference(mri_data, 500, 301)
+    mri_window = windowing(mri_data, 500, 301, out=mri_data)
+    assert mri_window is mri_data
+    assert_window(mri_data, expected)
+
+
+def test_clip_scale_slice_view():
+    # non contiguous views (e.g. a sagittal slice) are windowed without a copy of the input
+    mri_data = synthetic_volume('float64')
+    mri_slice = mri_data[3, :, ::2]
+    assert_window(clip_scale(mri_slice, 350, 650), windowing_reference(mri_slice, 500, 301))